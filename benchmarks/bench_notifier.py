@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""OpenstackNotifier throughput benchmarks.
+
+Runs the notification handlers directly (micro benchmarks) and a whole
+notifier against kombu's in-memory transport, and prints the results as
+json:
+
+    python benchmarks/bench_notifier.py --messages 20000 --output new.json
+    python benchmarks/bench_notifier.py --compare old.json new.json
+"""
+from argparse import ArgumentParser
+from threading import Event
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import kombu  # type: ignore
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+# the fixtures, and the package when it is not installed
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+
+from fixtures import messages  # noqa: E402
+from openstack_notifier.notifier import OpenstackNotifier  # noqa: E402
+from openstack_notifier.notifier import QueueConfig  # noqa: E402
+
+clock = time.perf_counter
+
+# seconds without any notification received before giving up
+STALL_TIMEOUT = 10.0
+
+
+class FakeMessage(object):
+    """The attributes of a kombu message used by the notifier."""
+    content_type = 'application/json'
+    content_encoding = 'utf-8'
+    headers = {}  # type: dict
+    delivery_info = {}  # type: dict
+
+    def __init__(self, body):
+        self.body = body
+
+    def decode(self):
+        return json.loads(self.body)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {'p%d' % p: round(samples[min(len(samples) - 1,
+                                         len(samples) * p // 100)] * 1e6, 2)
+            for p in (50, 90, 99)}
+
+
+def measure(name, handler, inputs):
+    """Calls `handler` on every input, timing each call.
+
+    The peak memory is measured by a second, traced, run since tracing
+    slows down the allocations.
+    """
+    latencies = []
+    start = clock()
+    for item in inputs:
+        t0 = clock()
+        handler(item)
+        latencies.append(clock() - t0)
+    elapsed = clock() - start
+    tracemalloc.start()
+    for item in inputs:
+        handler(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'name': name,
+            'messages': len(inputs),
+            'msg_per_sec': round(len(inputs) / elapsed, 1),
+            'latency_us': percentiles(latencies),
+            'peak_memory_kb': round(peak / 1024.0, 1)}
+
+
+def micro_benchmarks(count):
+    results = []
+    for oslo in (False, True):
+        suffix = 'oslo' if oslo else 'plain'
+        raws = [json.dumps(m).encode() for m in messages(count, oslo=oslo)]
+
+        notifier = OpenstackNotifier('memory://', callback=lambda data: None)
+        # the kombu path includes kombu's json decoding of the body
+        results.append(measure(
+            'rabbitmq_callback_%s' % suffix,
+            lambda raw: notifier.rabbitmq_callback(json.loads(raw), None),
+            raws))
+
+        notifier = OpenstackNotifier('memory://', callback=lambda data: None,
+                                     raw=True)
+        results.append(measure(
+            'rabbitmq_message_%s' % suffix,
+            notifier.rabbitmq_message,
+            [FakeMessage(raw) for raw in raws]))
+
+        notifier = OpenstackNotifier('memory://', callback=lambda data: None,
+                                     raw=True, lazy=True)
+        results.append(measure(
+            'rabbitmq_message_lazy_%s' % suffix,
+            notifier.rabbitmq_message,
+            [FakeMessage(raw) for raw in raws]))
+    return results
+
+
+def consume(count, trace, **kwargs):
+    """Publishes `count` notifications, then consumes them.
+
+    Returns the seconds spent, the time each notification reached the
+    callback and, with `trace`, the peak memory.
+    """
+    exchange_name = 'bench_%s' % os.getpid()
+    exchange = kombu.Exchange(exchange_name, 'topic', durable=False)
+    received = []
+    finished = Event()
+
+    def callback(data):
+        received.append(clock())
+        if len(received) == count:
+            finished.set()
+
+    queue_config = QueueConfig(exchange=exchange_name,
+                               queue='bench_%s' % os.getpid(),
+                               routing_key='notifications.info')
+    notifier = OpenstackNotifier('memory://', callback=callback,
+                                 queue_configs=[queue_config], **kwargs)
+    with kombu.Connection('memory://') as conn:
+        # declare the queue before publishing
+        kombu.Queue(queue_config.queue, exchange=exchange,
+                    routing_key=queue_config.routing_key, durable=False,
+                    auto_delete=True)(conn.channel()).declare()
+        producer = conn.Producer(serializer='json')
+        for m in messages(count):
+            producer.publish(m, exchange=exchange,
+                             routing_key='notifications.info')
+    if trace:
+        tracemalloc.start()
+    start = clock()
+    notifier.start()
+    try:
+        progress = 0
+        while not finished.wait(timeout=STALL_TIMEOUT):
+            if len(received) == progress or not notifier.alive():
+                raise RuntimeError('stalled after %d of %d notifications'
+                                   % (len(received), count))
+            progress = len(received)
+        elapsed = clock() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace else None
+    finally:
+        notifier.stop(drain=False)
+        if trace:
+            tracemalloc.stop()
+    return elapsed, received, peak
+
+
+def memory_transport_benchmark(count, **kwargs):
+    """Consumes `count` notifications from kombu's in-memory transport.
+
+    The notifications are all queued before consuming, so the time they
+    wait in the queue depends on `count`: the intervals between two
+    callbacks are reported instead of latencies. The peak memory is
+    measured by a second, traced, run.
+    """
+    elapsed, times, _ = consume(count, False, **kwargs)
+    _, _, peak = consume(count, True, **kwargs)
+    options = ','.join('%s=%s' % kv for kv in sorted(kwargs.items()))
+    return {'name': 'memory_transport' + (':' + options if options else ''),
+            'messages': count,
+            'msg_per_sec': round(count / elapsed, 1),
+            'interarrival_us': percentiles([b - a for a, b in zip(times,
+                                                                  times[1:])]),
+            'peak_memory_kb': round(peak / 1024.0, 1)}
+
+
+def run(count):
+    results = micro_benchmarks(count)
+    results.append(memory_transport_benchmark(count))
+    results.append(memory_transport_benchmark(count, raw=True))
+    results.append(memory_transport_benchmark(count, raw=True, ack=True))
+    return {'python': platform.python_version(),
+            'kombu': kombu.__version__,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'results': results}
+
+
+def compare(old_path, new_path, threshold):
+    """Prints the throughput change, returns 1 on regressions."""
+    with open(old_path) as f:
+        old = dict((r['name'], r) for r in json.load(f)['results'])
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    status = 0
+    for r in new:
+        if r['name'] not in old:
+            continue
+        ratio = r['msg_per_sec'] / old[r['name']]['msg_per_sec']
+        regression = ratio < 1 - threshold
+        status = status or int(regression)
+        print('%-45s %10.1f -> %10.1f msg/s %+6.1f%%%s' % (
+            r['name'], old[r['name']]['msg_per_sec'], r['msg_per_sec'],
+            (ratio - 1) * 100, '  REGRESSION' if regression else ''))
+    return status
+
+
+def main(args):
+    parser = ArgumentParser(description='openstack_notifier benchmarks')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--output', default=None,
+                        help='write the json results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two json results')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='throughput drop reported as regression')
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.compare:
+        return compare(parsed_args.compare[0], parsed_args.compare[1],
+                       parsed_args.threshold)
+
+    report = json.dumps(run(parsed_args.messages), indent=2)
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as f:
+            f.write(report)
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
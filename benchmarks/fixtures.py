@@ -0,0 +1,102 @@
+"""Realistic nova/neutron notifications used by the benchmarks."""
+import json
+import time
+
+SUBNET = {
+    'description': '', 'tags': [], 'updated_at': '2019-03-15T08:32:59Z',
+    'ipv6_ra_mode': None,
+    'allocation_pools': [{'start': '10.70.156.162',
+                          'end': '10.70.156.190'}],
+    'host_routes': [{'nexthop': '0.0.0.0',
+                     'destination': '169.254.0.0/16'}],
+    'revision_number': 0, 'ipv6_address_mode': None,
+    'cidr': '10.70.156.160/27', 'id': 'd22e9750-f4a4-41b8-993b-6fa7db143c3d',
+    'subnetpool_id': 'e7f42f51-ed97-459f-9e8d-14dfeb98d20d',
+    'service_types': [], 'name': 'pec-collaudo-static.subnet',
+    'enable_dhcp': False, 'segment_id': None,
+    'network_id': '8255253d-d6b9-4d3e-8032-4440998dc77f',
+    'tenant_id': 'a259eaeebee34985b4728bfb111a62ad',
+    'created_at': '2019-03-15T08:32:59Z',
+    'dns_nameservers': ['169.254.169.239'],
+    'gateway_ip': '10.70.156.161', 'ip_version': 4, 'shared': False,
+    'project_id': 'a259eaeebee34985b4728bfb111a62ad'}
+
+PORT = {
+    'allowed_address_pairs': [], 'extra_dhcp_opts': [],
+    'updated_at': '2019-03-15T08:33:01Z', 'device_owner': 'compute:nova',
+    'revision_number': 3, 'port_security_enabled': True,
+    'binding:profile': {}, 'binding:vnic_type': 'normal',
+    'fixed_ips': [{'subnet_id': 'd22e9750-f4a4-41b8-993b-6fa7db143c3d',
+                   'ip_address': '10.70.156.170'}],
+    'id': '5a0a5b5e-2bb2-4d2e-9c55-5a4e9f0a0a10',
+    'security_groups': ['0c3a3f4e-8d5b-4f8b-b5b0-7ad6d1bf9d2f'],
+    'binding:vif_details': {'port_filter': True, 'ovs_hybrid_plug': True},
+    'binding:vif_type': 'ovs', 'mac_address': 'fa:16:3e:5c:2a:11',
+    'project_id': 'a259eaeebee34985b4728bfb111a62ad', 'status': 'ACTIVE',
+    'binding:host_id': 'compute-017', 'description': '', 'tags': [],
+    'dns_assignment': [{'hostname': 'host-10-70-156-170',
+                        'ip_address': '10.70.156.170',
+                        'fqdn': 'host-10-70-156-170.openstacklocal.'}],
+    'device_id': '9d2c7a43-3f0a-4d4b-8a2c-6c1e0c8e1f25',
+    'name': '', 'admin_state_up': True,
+    'network_id': '8255253d-d6b9-4d3e-8032-4440998dc77f',
+    'dns_name': '', 'created_at': '2019-03-15T08:33:00Z',
+    'tenant_id': 'a259eaeebee34985b4728bfb111a62ad'}
+
+INSTANCE = {
+    'state_description': '', 'availability_zone': 'nova',
+    'terminated_at': '', 'ephemeral_gb': 0,
+    'instance_type_id': 5, 'deleted_at': '', 'reservation_id': 'r-3x0q4e2k',
+    'instance_id': '9d2c7a43-3f0a-4d4b-8a2c-6c1e0c8e1f25',
+    'display_name': 'vm-017', 'hostname': 'vm-017',
+    'state': 'active', 'progress': '', 'launched_at': '2019-03-15T08:33:05',
+    'metadata': {}, 'node': 'compute-017', 'ramdisk_id': '',
+    'access_ip_v6': None, 'disk_gb': 20, 'access_ip_v4': None,
+    'kernel_id': '', 'host': 'compute-017',
+    'user_id': '4c0f1e2a5d6b4f7c8e9a0b1c2d3e4f50',
+    'image_ref_url': 'http://glance:9292/images/1c2b3a4d',
+    'cell_name': '', 'root_gb': 20,
+    'tenant_id': 'a259eaeebee34985b4728bfb111a62ad',
+    'created_at': '2019-03-15 08:32:58+00:00', 'memory_mb': 2048,
+    'instance_type': 'm1.small', 'vcpus': 1,
+    'image_meta': {'container_format': 'bare', 'min_ram': '0',
+                   'disk_format': 'qcow2', 'min_disk': '20',
+                   'base_image_ref': '1c2b3a4d'},
+    'architecture': None, 'os_type': None,
+    'instance_flavor_id': '2',
+    'fixed_ips': [{'floating_ips': [], 'label': 'pec-collaudo-static',
+                   'version': 4, 'meta': {}, 'address': '10.70.156.170',
+                   'type': 'fixed', 'vif_mac': 'fa:16:3e:5c:2a:11'}]}
+
+EVENTS = [
+    ('subnet.update.end', {'subnet': SUBNET}),
+    ('subnet.delete.end', {'subnet_id': SUBNET['id'], 'subnet': SUBNET}),
+    ('port.create.end', {'port': PORT}),
+    ('port.update.end', {'port': PORT}),
+    ('port.delete.end', {'port_id': PORT['id']}),
+    ('compute.instance.update', INSTANCE),
+    ('compute.instance.create.end', INSTANCE),
+]
+
+
+def notification(event_type, payload, n=0):
+    """Returns an oslo notification as sent by nova/neutron."""
+    return {'message_id': '0e1f2a3b-4c5d-6e7f-8091-%012d' % n,
+            'publisher_id': 'network.controller-01',
+            'event_type': event_type,
+            'priority': 'INFO',
+            'payload': payload,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S.000000',
+                                       time.gmtime())}
+
+
+def oslo_wrap(message):
+    return {'oslo.version': '2.0', 'oslo.message': json.dumps(message)}
+
+
+def messages(count, oslo=True, events=EVENTS):
+    """Yields `count` message bodies, cycling over `events`."""
+    for n in range(count):
+        event_type, payload = events[n % len(events)]
+        message = notification(event_type, payload, n)
+        yield oslo_wrap(message) if oslo else message
@@ -1,2 +1,17 @@
 from openstack_notifier.notifier import OpenstackNotifier  # noqa
 from openstack_notifier.notifier import CallbackData       # noqa
+from openstack_notifier.dispatch import InlineDispatcher   # noqa
+from openstack_notifier.dispatch import PoolDispatcher     # noqa
+from openstack_notifier.dispatch import KeyedDispatcher    # noqa
+from openstack_notifier.dispatch import resource_key       # noqa
+from openstack_notifier.metrics import Metrics            # noqa
+from openstack_notifier.metrics import MetricsServer      # noqa
+from openstack_notifier.dedup import DedupCache           # noqa
+from openstack_notifier.coalesce import Coalescer        # noqa
+from openstack_notifier.sharding import ShardedOpenstackNotifier  # noqa
+from openstack_notifier.checkpoint import Checkpoint      # noqa
+from openstack_notifier.shedding import LoadShedder     # noqa
+from openstack_notifier.statecache import ResourceCache  # noqa
+from openstack_notifier.hub import NotifierHub         # noqa
+from openstack_notifier.profiling import Profiler      # noqa
+from openstack_notifier.aggregation import Aggregator   # noqa
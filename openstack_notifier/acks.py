@@ -0,0 +1,122 @@
+from threading import Condition, Lock
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Callable
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class AckTracker(object):
+    """Acknowledges the messages of a channel in batches.
+
+    `delivered` must be called, in delivery order, for every message
+    received on the channel and `done` when its processing ends (from any
+    thread). `flush`, called by the consumer thread, acknowledges with a
+    single `multiple` ack every message up to the first one still being
+    processed; failed messages are requeued, or rejected if they were
+    already redelivered. With `multiple=False`, for transports that do not
+    implement `multiple` acks, the messages are acknowledged one by one.
+    """
+
+    def __init__(self,
+                 batch_size=100,  # type: int
+                 interval=0.1,    # type: float
+                 multiple=True,   # type: bool
+                 ):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.multiple = multiple
+        self.lock = Lock()
+        self.completed = Condition(self.lock)
+        self.pending = deque()  # type: Deque[Any]
+        self.results = {}  # type: Dict[Any, bool]
+        self.last_flush = time.time()
+
+    def delivered(self,
+                  message,  # type: Any
+                  ):  # type: (...) -> None
+        with self.lock:
+            self.pending.append(message)
+
+    def done(self,
+             message,  # type: Any
+             ok,       # type: bool
+             ):  # type: (...) -> None
+        with self.lock:
+            self.results[message.delivery_tag] = ok
+            self.completed.notify_all()
+
+    def due(self):  # type: () -> bool
+        completed = len(self.results)
+        return completed >= self.batch_size or (
+            completed > 0 and time.time() - self.last_flush >= self.interval)
+
+    def flush(self):  # type: () -> None
+        flushed = []
+        with self.lock:
+            while self.pending \
+                    and self.pending[0].delivery_tag in self.results:
+                message = self.pending.popleft()
+                flushed.append(
+                    (message, self.results.pop(message.delivery_tag)))
+        self.last_flush = time.time()
+        last = None
+        for message, ok in flushed:
+            if ok and not self.multiple:
+                message.ack()
+            elif ok:
+                last = message
+            elif message.delivery_info.get('redelivered', False):
+                log.warning('rejecting message %s, failed twice'
+                            % message.delivery_tag)
+                message.reject(requeue=False)
+            else:
+                message.requeue()
+        if last is not None:
+            last.ack(multiple=True)
+
+    def in_flight(self):  # type: () -> int
+        """Number of received messages not acknowledged yet."""
+        return len(self.pending)
+
+    def wait(self,
+             timeout=None,  # type: Optional[float]
+             ):  # type: (...) -> bool
+        """Waits until every delivered message is done, for at most
+        `timeout` seconds. Returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            while len(self.results) < len(self.pending):
+                if deadline is None:
+                    self.completed.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.completed.wait(remaining)
+        return True
+
+
+def join_done(done,   # type: Optional[Callable[[bool], None]]
+              count,  # type: int
+              ):  # type: (...) -> List[Optional[Callable[[bool], None]]]
+    """Splits a `done(ok)` callback in `count` callbacks.
+
+    `done` is called once all of them have been called, with `ok=True`
+    only if all of them succeeded.
+    """
+    if done is None or count == 1:
+        return [done] * count
+    lock = Lock()
+    state = {'left': count, 'ok': True}
+
+    def part_done(ok):  # type: (bool) -> None
+        with lock:
+            state['left'] -= 1
+            state['ok'] = state['ok'] and ok
+            if state['left'] > 0:
+                return
+        done(bool(state['ok']))
+
+    return [part_done] * count
@@ -0,0 +1,306 @@
+from threading import Event, Lock, Thread
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import logging
+import math
+import time
+
+log = logging.getLogger(__name__)
+
+# the key of the notifications beyond `max_keys`
+OVERFLOW = ('__overflow__',)
+
+Key = Tuple[Any, ...]
+# key -> [count, sum]
+Counts = Dict[Key, List[float]]
+
+
+def field_getter(path,  # type: str
+                 ):  # type: (...) -> Callable[[Dict[str, Any]], Any]
+    """Returns a function reading a dotted `path` of a payload."""
+    names = path.split('.')
+
+    def get(payload):  # type: (Dict[str, Any]) -> Any
+        value = payload  # type: Any
+        for name in names:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(name)
+        return value
+
+    return get
+
+
+class Aggregate(object):
+    """The notifications of a key in a window.
+
+    `key` holds the event type (with `by_event_type`) followed by the
+    values of the aggregator `fields`. `sum` is the sum of the `value`
+    field, None without one.
+    """
+    __slots__ = ('start', 'end', 'key', 'count', 'sum')
+
+    def __init__(self,
+                 start,     # type: float
+                 end,       # type: float
+                 key,       # type: Key
+                 count,     # type: int
+                 sum=None,  # type: Optional[float]
+                 ):
+        self.start = start
+        self.end = end
+        self.key = key
+        self.count = count
+        self.sum = sum
+
+    def __eq__(self,
+               other,  # type: Any
+               ):  # type: (...) -> bool
+        return isinstance(other, Aggregate) and \
+            (self.start, self.end, self.key, self.count, self.sum) == \
+            (other.start, other.end, other.key, other.count, other.sum)
+
+    def __ne__(self, other):  # type: (Any) -> bool
+        return not self == other
+
+    def __repr__(self):  # type: () -> str
+        return 'Aggregate(%r, %r, %r, %r, %r)' % (
+            self.start, self.end, self.key, self.count, self.sum)
+
+
+def _add(counts,  # type: Counts
+         key,     # type: Key
+         count,   # type: float
+         value,   # type: float
+         ):  # type: (...) -> None
+    entry = counts.get(key)
+    if entry is None:
+        counts[key] = [count, value]
+    else:
+        entry[0] += count
+        entry[1] += value
+
+
+AggregatesCallback = Callable[[List[Aggregate]], Any]
+
+
+class Aggregator(object):
+    """Counts the notifications by key in time windows.
+
+    The notifications are grouped by their timestamp in windows of
+    `window` seconds, starting every `slide` seconds (tumbling windows by
+    default, sliding ones with a smaller `slide`, a divisor of `window`),
+    and by key: the event type and the values of the `fields` payload
+    paths (dotted, like `port.project_id`). An `Aggregate` is emitted
+    for every key of a window, with the notifications count and the sum
+    of the `value` payload field, once the window ended `lateness`
+    seconds ago; the notifications of the windows already emitted are
+    dropped (counted in `late`).
+
+    The counts are kept in panes of `slide` seconds, a sliding window
+    adds the newest pane to its running totals and subtracts the oldest
+    one. At most `max_keys` distinct keys are kept, the notifications of
+    the other keys are counted under `OVERFLOW`.
+    """
+
+    def __init__(self,
+                 window=60.0,         # type: float
+                 slide=None,          # type: Optional[float]
+                 fields=(),           # type: Tuple[str, ...]
+                 value=None,          # type: Optional[str]
+                 by_event_type=True,  # type: bool
+                 max_keys=10000,      # type: int
+                 lateness=0.0,        # type: float
+                 callback=None,       # type: Optional[AggregatesCallback]
+                 ):
+        if slide is None:
+            slide = window
+        if window <= 0 or slide <= 0:
+            raise ValueError('window and slide must be > 0')
+        panes = window / slide
+        if abs(panes - round(panes)) > 1e-9:
+            raise ValueError('window must be a multiple of slide')
+        self.window = window
+        self.slide = slide
+        self.panes_per_window = int(round(panes))
+        self.fields = [field_getter(f) for f in fields]
+        self.value = None if value is None else field_getter(value)
+        self.by_event_type = by_event_type
+        self.max_keys = max_keys
+        self.lateness = lateness
+        self.callback = callback
+        self.lock = Lock()
+        # pane index -> counts, of the panes not closed yet
+        self.open = {}  # type: Dict[int, Counts]
+        # the closed panes still in the current window, oldest first
+        self.recent = deque()  # type: Deque[Tuple[int, Counts]]
+        self.totals = {}  # type: Counts
+        # key -> number of open and recent panes holding it
+        self.refs = {}  # type: Dict[Key, int]
+        self.next_index = None  # type: Optional[int]
+        self.late = 0
+        self.overflowed = 0
+        self.quit_event = Event()
+        self.thread = None  # type: Optional[Thread]
+
+    def __len__(self):  # type: () -> int
+        """Number of distinct keys kept."""
+        return len(self.refs)
+
+    def subscribe(self,
+                  notifier,     # type: Any
+                  pattern='*',  # type: str
+                  ):  # type: (...) -> None
+        """Registers the aggregator as a handler of `notifier`."""
+        notifier.subscribe(pattern, self.add)
+
+    def key(self,
+            data,  # type: Any
+            ):  # type: (...) -> Key
+        if not self.fields:
+            return (data.event_type,) if self.by_event_type else ()
+        payload = data.payload
+        values = tuple(get(payload) for get in self.fields)
+        if self.by_event_type:
+            return (data.event_type,) + values
+        return values
+
+    def add(self,
+            data,      # type: Any
+            now=None,  # type: Optional[float]
+            ):  # type: (...) -> None
+        timestamp = data.timestamp
+        if timestamp is None:
+            timestamp = time.time() if now is None else now
+        key = self.key(data)
+        value = 0.0
+        if self.value is not None:
+            try:
+                value = float(self.value(data.payload) or 0)
+            except (TypeError, ValueError):
+                pass
+        index = int(math.floor(timestamp / self.slide))
+        with self.lock:
+            if self.next_index is not None and index < self.next_index:
+                self.late += 1
+                return
+            pane = self.open.get(index)
+            if pane is None:
+                pane = self.open[index] = {}
+            if key not in pane:
+                if key not in self.refs and len(self.refs) >= self.max_keys:
+                    self.overflowed += 1
+                    key = OVERFLOW
+                if key not in pane:
+                    self.refs[key] = self.refs.get(key, 0) + 1
+            _add(pane, key, 1, value)
+
+    def expired(self,
+                now=None,  # type: Optional[float]
+                ):  # type: (...) -> List[Aggregate]
+        """Closes the windows ended `lateness` seconds before `now` and
+        returns their aggregates."""
+        if now is None:
+            now = time.time()
+        last = int(math.floor((now - self.lateness) / self.slide)) - 1
+        with self.lock:
+            return self.close(last)
+
+    def flush(self):  # type: () -> List[Aggregate]
+        """Closes all the windows and returns their aggregates."""
+        with self.lock:
+            if not self.open and not self.totals:
+                return []
+            if self.open:
+                last = max(self.open)
+            else:
+                last = self.next_index - 1  # type: ignore
+            # the windows still holding the last pane
+            aggregates = self.close(last + self.panes_per_window - 1)
+            while self.recent:
+                self.evict(self.recent.popleft()[1])
+            return aggregates
+
+    def close(self,
+              last,  # type: int
+              ):  # type: (...) -> List[Aggregate]
+        """Closes the panes up to the `last` index, called locked."""
+        aggregates = []  # type: List[Aggregate]
+        if self.next_index is None:
+            if not self.open:
+                return aggregates
+            self.next_index = min(self.open)
+        while self.next_index <= last:
+            index = self.next_index
+            if not self.totals:
+                # skip the empty panes
+                if not self.open:
+                    self.next_index = last + 1
+                    break
+                index = self.next_index = max(index, min(self.open))
+                if index > last:
+                    break
+            pane = self.open.pop(index, None)
+            if pane is not None:
+                self.recent.append((index, pane))
+                for key, (count, value) in pane.items():
+                    _add(self.totals, key, count, value)
+            while self.recent and \
+                    self.recent[0][0] <= index - self.panes_per_window:
+                self.evict(self.recent.popleft()[1])
+            end = (index + 1) * self.slide
+            start = end - self.window
+            with_sum = self.value is not None
+            for key, (count, value) in self.totals.items():
+                aggregates.append(Aggregate(start, end, key, int(count),
+                                            value if with_sum else None))
+            self.next_index = index + 1
+        return aggregates
+
+    def evict(self,
+              pane,  # type: Counts
+              ):  # type: (...) -> None
+        """Removes a pane that left the window from the totals."""
+        totals = self.totals
+        refs = self.refs
+        for key, (count, value) in pane.items():
+            entry = totals[key]
+            entry[0] -= count
+            entry[1] -= value
+            if entry[0] <= 0:
+                del totals[key]
+            refs[key] -= 1
+            if refs[key] <= 0:
+                del refs[key]
+
+    def emit(self,
+             aggregates,  # type: List[Aggregate]
+             ):  # type: (...) -> None
+        if not aggregates or self.callback is None:
+            return
+        try:
+            self.callback(aggregates)
+        except Exception:
+            log.exception('Error in aggregation callback')
+
+    def start(self):  # type: () -> None
+        """Emits the aggregates to `callback` from a thread."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.quit_event.clear()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):  # type: () -> None
+        interval = min(self.slide, 1.0)
+        while not self.quit_event.wait(interval):
+            self.emit(self.expired())
+
+    def stop(self):  # type: () -> None
+        """Stops the thread and emits the windows not closed yet."""
+        self.quit_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = None
+        self.emit(self.flush())
@@ -0,0 +1,248 @@
+"""asyncio interface of the notifier (python >= 3.5)."""
+from threading import Lock, Semaphore
+from collections import deque
+from functools import partial
+from typing import Any, Callable, Deque, List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+from openstack_notifier.notifier import OpenstackNotifier, CallbackData
+
+log = logging.getLogger(__name__)
+
+Item = Tuple[Callable[[Any], Any], Any, Optional[Callable[[bool], None]]]
+
+
+def _wake(waiters,  # type: List[asyncio.Future[None]]
+          ):  # type: (...) -> None
+    for waiter in waiters:
+        if not waiter.done():
+            waiter.set_result(None)
+
+
+def _iterate(data,  # type: CallbackData
+             ):  # type: (...) -> None
+    """Callback marking the notifications read with `async for`."""
+
+
+class LoopDispatcher(object):
+    """Hands the notifications from the consumer thread to an event loop.
+
+    The consumer thread blocks once `max_queue_size` notifications are
+    waiting, so the broker stops sending when the loop falls behind (with
+    `ack=True`, after `prefetch_count` messages). The loop is woken up
+    only when it is waiting for notifications, not once per message.
+    """
+
+    def __init__(self,
+                 max_queue_size=1000,  # type: int
+                 ):
+        self.loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self.items = deque()  # type: Deque[Item]
+        self.lock = Lock()
+        self.slots = Semaphore(max_queue_size)
+        self.waiters = []  # type: List[asyncio.Future[None]]
+        self.stopping = False
+        self.closed = False
+        self.observer = None  # type: Any
+
+    def start(self):  # type: () -> None
+        self.stopping = False
+        self.closed = False
+
+    def stop(self,
+             timeout=None,  # type: Optional[float]
+             ):  # type: (...) -> None
+        pass
+
+    def queue_depth(self):  # type: () -> int
+        return len(self.items)
+
+    def dispatch(self,
+                 func,       # type: Callable[[Any], Any]
+                 data,       # type: Any
+                 done=None,  # type: Optional[Callable[[bool], None]]
+                 ):  # type: (...) -> None
+        while not self.slots.acquire(timeout=0.1):
+            if self.stopping:
+                if done is not None:
+                    done(False)
+                return
+        with self.lock:
+            self.items.append((func, data, done))
+            waiters, self.waiters = self.waiters, []
+        if waiters and self.loop is not None:
+            self.loop.call_soon_threadsafe(_wake, waiters)
+
+    async def get(self):  # type: () -> Optional[Item]
+        """Returns the next notification, None once closed and empty."""
+        while True:
+            with self.lock:
+                if self.items:
+                    return self.items.popleft()
+                if self.closed:
+                    return None
+                assert self.loop is not None
+                waiter = self.loop.create_future()
+                self.waiters.append(waiter)
+            await waiter
+
+    def release(self):  # type: () -> None
+        self.slots.release()
+
+    def discard(self):  # type: () -> int
+        """Drops the waiting notifications, their `done` is not called."""
+        with self.lock:
+            dropped = len(self.items)
+            self.items.clear()
+        for _ in range(dropped):
+            self.slots.release()
+        return dropped
+
+    def close(self):  # type: () -> None
+        """Wakes up the readers, called from the loop."""
+        with self.lock:
+            self.closed = True
+            waiters, self.waiters = self.waiters, []
+        _wake(waiters)
+
+
+class AsyncOpenstackNotifier(object):
+    """asyncio version of `OpenstackNotifier`.
+
+    `callback` and the handlers registered with `subscribe` can be
+    coroutine functions, they are run by `concurrency` tasks (so with
+    `concurrency > 1` the notifications order is not kept). Without
+    `callback` the notifications can be read with `async for`:
+
+        async with AsyncOpenstackNotifier(url) as notifier:
+            async for data in notifier:
+                ...
+
+    The other keyword arguments are passed to `OpenstackNotifier`. With
+    `ack=True` a message is acknowledged when its callback returns or, with
+    `async for`, when the next notification is requested.
+    """
+
+    def __init__(self,
+                 url,                 # type: str
+                 callback=None,       # type: Optional[Callable[[Any], Any]]
+                 concurrency=1,       # type: int
+                 max_queue_size=1000,  # type: int
+                 **kwargs             # type: Any
+                 ):
+        if concurrency < 1:
+            raise ValueError('concurrency must be >= 1')
+        self.concurrency = concurrency
+        self.dispatcher = LoopDispatcher(max_queue_size=max_queue_size)
+        self.iterate = callback is None
+        self.notifier = OpenstackNotifier(
+            url, callback=_iterate if callback is None else callback,
+            dispatcher=self.dispatcher, **kwargs)
+        self.tasks = []  # type: List[asyncio.Future[None]]
+        self.done = None  # type: Optional[Callable[[bool], None]]
+
+    def subscribe(self,
+                  pattern,  # type: str
+                  handler,  # type: Callable[[CallbackData], Any]
+                  ):  # type: (...) -> None
+        self.notifier.subscribe(pattern, handler)
+
+    async def start(self):  # type: () -> None
+        if self.notifier.alive():
+            return
+        self.dispatcher.loop = asyncio.get_event_loop()
+        if not self.iterate:
+            self.tasks = [asyncio.ensure_future(self.work())
+                          for _ in range(self.concurrency)]
+        self.notifier.start()
+
+    async def stop(self,
+                   timeout=None,  # type: Optional[float]
+                   drain=True,    # type: bool
+                   ):  # type: (...) -> None
+        """See `OpenstackNotifier.stop`.
+
+        With `async for` the notifications not read yet are abandoned.
+        """
+        self.dispatcher.stopping = True
+        if self.iterate:
+            drain = False
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(
+            None, partial(self.notifier.stop, timeout, drain))
+        self.dispatcher.close()
+        if self.tasks:
+            await asyncio.wait(self.tasks)
+        self.tasks = []
+
+    def alive(self):  # type: () -> bool
+        return self.notifier.alive()
+
+    async def wait_ready(self,
+                         timeout=None,  # type: Optional[float]
+                         ):  # type: (...) -> bool
+        """See `OpenstackNotifier.wait_ready`."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, self.notifier.wait_ready, timeout)
+
+    def queue_depth(self):  # type: () -> int
+        return self.dispatcher.queue_depth()
+
+    async def work(self):  # type: () -> None
+        dispatcher = self.dispatcher
+        while True:
+            item = await dispatcher.get()
+            if item is None:
+                return
+            try:
+                await self.run_handler(*item)
+            finally:
+                dispatcher.release()
+
+    def __aiter__(self):  # type: () -> AsyncOpenstackNotifier
+        return self
+
+    async def __anext__(self):  # type: () -> CallbackData
+        if self.done is not None:
+            previous, self.done = self.done, None
+            previous(True)
+        while True:
+            item = await self.dispatcher.get()
+            if item is None:
+                raise StopAsyncIteration
+            self.dispatcher.release()
+            func, data, done = item
+            if func is _iterate:
+                self.done = done
+                return data  # type: ignore
+            # a subscribed handler
+            await self.run_handler(func, data, done)
+
+    async def run_handler(self,
+                          func,  # type: Callable[[Any], Any]
+                          data,  # type: Any
+                          done,  # type: Optional[Callable[[bool], None]]
+                          ):  # type: (...) -> None
+        start = time.time()
+        ok = False
+        try:
+            result = func(data)
+            if asyncio.iscoroutine(result):
+                await result
+            ok = True
+        except Exception:
+            log.exception('Error in callback for %s' % data)
+        if self.dispatcher.observer is not None:
+            self.dispatcher.observer(data, time.time() - start, ok)
+        if done is not None:
+            done(ok)
+
+    async def __aenter__(self):  # type: () -> AsyncOpenstackNotifier
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):  # type: (*Any) -> None
+        await self.stop()
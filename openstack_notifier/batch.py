@@ -0,0 +1,58 @@
+from typing import Any, Callable, List, Optional
+import time
+
+DoneCallback = Optional[Callable[[bool], None]]
+
+
+class Batcher(object):
+    """Groups notifications in batches.
+
+    A batch is ready when it holds `max_batch_size` notifications or when
+    its first notification was added `max_batch_latency` seconds ago.
+    """
+
+    def __init__(self,
+                 max_batch_size=100,     # type: int
+                 max_batch_latency=1.0,  # type: float
+                 ):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be >= 1')
+        self.max_batch_size = max_batch_size
+        self.max_batch_latency = max_batch_latency
+        self.items = []  # type: List[Any]
+        self.dones = []  # type: List[Callable[[bool], None]]
+        self.deadline = None  # type: Optional[float]
+
+    def __len__(self):  # type: () -> int
+        return len(self.items)
+
+    def add(self,
+            data,  # type: Any
+            done,  # type: DoneCallback
+            ):  # type: (...) -> None
+        if not self.items:
+            self.deadline = time.time() + self.max_batch_latency
+        self.items.append(data)
+        if done is not None:
+            self.dones.append(done)
+
+    def timeout(self):  # type: () -> Optional[float]
+        """Seconds before the current batch is due, None if empty."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def due(self):  # type: () -> bool
+        return len(self.items) >= self.max_batch_size or (
+            self.deadline is not None and time.time() >= self.deadline)
+
+    def take(self):  # type: () -> Any
+        """Returns the current batch and a `done(ok)` for all its items."""
+        items, dones = self.items, self.dones
+        self.items, self.dones, self.deadline = [], [], None
+
+        def done(ok):  # type: (bool) -> None
+            for d in dones:
+                d(ok)
+
+        return items, done
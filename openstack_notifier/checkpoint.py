@@ -0,0 +1,190 @@
+from threading import Lock
+from typing import Callable, Dict, Hashable, List, Optional
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+DoneCallback = Optional[Callable[[bool], None]]
+
+
+def _add(counts,     # type: Dict[float, int]
+         timestamp,  # type: float
+         ):  # type: (...) -> None
+    counts[timestamp] = counts.get(timestamp, 0) + 1
+
+
+def _remove(counts,     # type: Dict[float, int]
+            timestamp,  # type: float
+            ):  # type: (...) -> bool
+    count = counts.get(timestamp, 0)
+    if count == 0:
+        return False
+    if count == 1:
+        del counts[timestamp]
+    else:
+        counts[timestamp] = count - 1
+    return True
+
+
+class Checkpoint(object):
+    """Low watermark of every queue, saved in a file.
+
+    The low watermark of a queue is the timestamp of its oldest
+    notification still being processed (or failed and requeued), the
+    timestamp of its newest processed notification when there is none:
+    the notifications older than it were all processed. `flush` writes the
+    watermarks to `path` (through a temporary file, fsync'd and renamed
+    over it). The notifier flushes them every `batch_size` notifications
+    or `interval` seconds.
+
+    A queue consumed again ignores the notifications older than its saved
+    watermark minus `rewind` seconds, which leaves room for notifications
+    queued out of order.
+    """
+
+    def __init__(self,
+                 path,            # type: str
+                 batch_size=1000,  # type: int
+                 interval=1.0,    # type: float
+                 rewind=60.0,     # type: float
+                 ):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.rewind = rewind
+        self.lock = Lock()
+        self.flush_lock = Lock()
+        # queue -> watermark, as of the last flush
+        self.timestamps = self.load()  # type: Dict[str, float]
+        self.saved = dict(self.timestamps)
+        # queue -> timestamp -> count, of the notifications being processed
+        self.in_flight = {}  # type: Dict[str, Dict[float, int]]
+        # queue -> message key -> timestamps, of the failed notifications
+        # requeued
+        self.retrying = {}  # type: Dict[str, Dict[Hashable, List[float]]]
+        self.newest = {}  # type: Dict[str, float]
+        self.pending = 0
+        self.last_flush = time.time()
+
+    def load(self):  # type: () -> Dict[str, float]
+        """Returns the saved watermarks."""
+        try:
+            with open(self.path) as f:
+                timestamps = json.load(f)
+            return dict((str(queue), float(timestamp))
+                        for queue, timestamp in timestamps.items())
+        except (IOError, OSError):
+            return {}
+        except (AttributeError, TypeError, ValueError):
+            log.warning('ignoring invalid checkpoint %s' % self.path)
+            return {}
+
+    def min_timestamp(self,
+                      queue='',  # type: str
+                      ):  # type: (...) -> Optional[float]
+        """The `min_timestamp` of `queue`, None without checkpoint."""
+        timestamp = self.timestamps.get(queue)
+        if timestamp is None:
+            return None
+        return timestamp - self.rewind
+
+    def wrap(self,
+             timestamp,       # type: Optional[float]
+             done,            # type: DoneCallback
+             queue='',        # type: str
+             retry_key=None,  # type: Optional[Hashable]
+             ):  # type: (...) -> Callable[[bool], None]
+        """Returns a `done(ok)` ending the processing of a notification.
+
+        With a `retry_key` a failed notification is requeued: it holds back
+        the watermark until its redelivery with the same key is done (see
+        `redelivery`).
+        """
+        if timestamp is not None:
+            with self.lock:
+                _add(self.in_flight.setdefault(queue, {}), timestamp)
+
+        def checkpoint_done(ok):  # type: (bool) -> None
+            if timestamp is not None:
+                self.update(queue, timestamp, ok, retry_key)
+            if done is not None:
+                done(ok)
+
+        return checkpoint_done
+
+    def redelivery(self,
+                   queue,  # type: str
+                   key,    # type: Hashable
+                   done,   # type: DoneCallback
+                   ):  # type: (...) -> Callable[[bool], None]
+        """Returns a `done(ok)` ending the redelivery of a message, which
+        releases the notification requeued with `key`, whether the
+        redelivery is processed or dropped."""
+
+        def redelivery_done(ok):  # type: (bool) -> None
+            with self.lock:
+                retrying = self.retrying.get(queue, {})
+                timestamps = retrying.get(key)
+                if timestamps:
+                    timestamps.pop()
+                    if not timestamps:
+                        del retrying[key]
+            if done is not None:
+                done(ok)
+
+        return redelivery_done
+
+    def update(self,
+               queue,      # type: str
+               timestamp,  # type: float
+               ok,         # type: bool
+               retry_key,  # type: Optional[Hashable]
+               ):  # type: (...) -> None
+        with self.lock:
+            _remove(self.in_flight[queue], timestamp)
+            if ok:
+                self.pending += 1
+                newest = self.newest.get(queue)
+                if newest is None or timestamp > newest:
+                    self.newest[queue] = timestamp
+            elif retry_key is not None:
+                self.retrying.setdefault(queue, {}).setdefault(
+                    retry_key, []).append(timestamp)
+
+    def watermarks(self):  # type: () -> Dict[str, float]
+        """The current watermarks, called locked."""
+        timestamps = dict(self.timestamps)
+        for queue in set(self.newest) | set(self.in_flight) \
+                | set(self.retrying):
+            oldest = list(self.in_flight.get(queue, ()))
+            for requeued in self.retrying.get(queue, {}).values():
+                oldest.extend(requeued)
+            if oldest:
+                timestamps[queue] = min(oldest)
+            elif queue in self.newest:
+                timestamps[queue] = self.newest[queue]
+        return timestamps
+
+    def due(self):  # type: () -> bool
+        return self.pending >= self.batch_size or (
+            self.pending > 0 and time.time() - self.last_flush
+            >= self.interval)
+
+    def flush(self):  # type: () -> None
+        with self.lock:
+            timestamps = self.timestamps = self.watermarks()
+            self.pending = 0
+        self.last_flush = time.time()
+        with self.flush_lock:
+            if not timestamps or timestamps == self.saved:
+                return
+            tmp = '%s.tmp' % self.path
+            with open(tmp, 'w') as f:
+                json.dump(timestamps, f, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+            self.saved = timestamps
@@ -0,0 +1,137 @@
+from threading import Lock
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+import time
+
+from openstack_notifier.dispatch import resource_key
+from openstack_notifier.subscriptions import PatternIndex
+
+DoneCallback = Optional[Callable[[bool], None]]
+Ready = List[Tuple[Any, DoneCallback]]
+
+
+def _join(dones,  # type: List[Callable[[bool], None]]
+          ):  # type: (...) -> DoneCallback
+    if not dones:
+        return None
+    if len(dones) == 1:
+        return dones[0]
+
+    def done(ok):  # type: (bool) -> None
+        for d in dones:
+            d(ok)
+
+    return done
+
+
+class _Pending(object):
+    def __init__(self, deadline):  # type: (float) -> None
+        self.deadline = deadline
+        # event_type -> [latest data, dones of the coalesced events]
+        self.events = OrderedDict()  # type: OrderedDict[str, List[Any]]
+
+
+class Coalescer(object):
+    """Keeps only the latest notification per resource and event type.
+
+    The notifications with the same `key_func(data)` (by default the
+    resource type and id) received within `window` seconds from the first
+    one are held back, and for each event type only the newest is
+    delivered when the window expires. The notifications matching the
+    `terminal` patterns are delivered immediately, after the pending ones
+    of the same resource. At most `max_keys` resources are held back, the
+    oldest ones are delivered early when the limit is reached.
+    """
+
+    def __init__(self,
+                 window=1.0,                # type: float
+                 key_func=resource_key,     # type: Callable[[Any], Any]
+                 max_keys=10000,            # type: int
+                 terminal=('*.delete.end',),  # type: Tuple[str, ...]
+                 ):
+        self.window = window
+        self.key_func = key_func
+        self.max_keys = max_keys
+        self.terminal = PatternIndex()
+        for pattern in terminal:
+            self.terminal.add(pattern, True)
+        self.pending = OrderedDict()  # type: OrderedDict[Hashable, _Pending]
+        self.lock = Lock()
+        self.coalesced = 0
+
+    def __len__(self):  # type: () -> int
+        return len(self.pending)
+
+    def add(self,
+            data,      # type: Any
+            done,      # type: DoneCallback
+            now=None,  # type: Optional[float]
+            ):  # type: (...) -> Ready
+        """Adds a notification, returns the ones to deliver now."""
+        if now is None:
+            now = time.time()
+        key = self.key_func(data)
+        if key is None:
+            return [(data, done)]
+        ready = []  # type: Ready
+        with self.lock:
+            if self.terminal.match(data.event_type):
+                pending = self.pending.pop(key, None)
+                if pending is not None:
+                    ready.extend(self.release(pending))
+                ready.append((data, done))
+                return ready
+            pending = self.pending.get(key)
+            if pending is None:
+                if len(self.pending) >= self.max_keys:
+                    _, oldest = self.pending.popitem(last=False)
+                    ready.extend(self.release(oldest))
+                pending = self.pending[key] = _Pending(now + self.window)
+            event = pending.events.get(data.event_type)
+            if event is None:
+                pending.events[data.event_type] = [data, []]
+                event = pending.events[data.event_type]
+            else:
+                event[0] = data
+                self.coalesced += 1
+            if done is not None:
+                event[1].append(done)
+        return ready
+
+    def release(self,
+                pending,  # type: _Pending
+                ):  # type: (...) -> Ready
+        return [(data, _join(dones))
+                for data, dones in pending.events.values()]
+
+    def expired(self,
+                now=None,  # type: Optional[float]
+                ):  # type: (...) -> Ready
+        """Returns the notifications whose window expired."""
+        if now is None:
+            now = time.time()
+        ready = []  # type: Ready
+        with self.lock:
+            while self.pending:
+                key = next(iter(self.pending))
+                if self.pending[key].deadline > now:
+                    break
+                ready.extend(self.release(self.pending.pop(key)))
+        return ready
+
+    def flush(self):  # type: () -> Ready
+        """Returns all the pending notifications."""
+        with self.lock:
+            pending, self.pending = self.pending, OrderedDict()
+        ready = []  # type: Ready
+        for p in pending.values():
+            ready.extend(self.release(p))
+        return ready
+
+    def timeout(self):  # type: () -> Optional[float]
+        """Seconds before the next window expires, None if empty."""
+        with self.lock:
+            if not self.pending:
+                return None
+            deadline = self.pending[next(iter(self.pending))].deadline
+        return max(0.0, deadline - time.time())
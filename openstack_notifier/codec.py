@@ -0,0 +1,139 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+import json
+import re
+
+JsonLoads = Callable[[Any], Any]
+
+try:
+    import orjson  # type: ignore
+    json_loads = orjson.loads  # type: JsonLoads
+except ImportError:
+    try:
+        import ujson  # type: ignore
+        json_loads = ujson.loads
+    except ImportError:
+        json_loads = json.loads
+
+# the value of a string field, following its name, in a plain or an
+# oslo-wrapped (escaped) body; the values with escape sequences are skipped
+_VALUE_RE = re.compile(br'\\?"\s*:\s*\\?"([^"\\]*)\\?"')
+
+
+def decode_body(raw,               # type: Any
+                loads=json_loads,  # type: JsonLoads
+                ):  # type: (...) -> Dict[str, Any]
+    """Decodes a raw notification, unwrapping the oslo envelope.
+
+    `loads` defaults to the fastest installed json library (orjson,
+    ujson, then the standard library).
+    """
+    body = loads(raw)
+    if isinstance(body, dict) and 'oslo.message' in body:
+        body = loads(body['oslo.message'])
+    return body  # type: ignore
+
+
+def decode_message(message,           # type: Any
+                   loads=json_loads,  # type: JsonLoads
+                   ):  # type: (...) -> Dict[str, Any]
+    """Decodes a kombu message, see `decode_body`.
+
+    Messages that are not plain json are decoded by kombu.
+    """
+    if message.content_type == 'application/json' \
+            and not message.headers.get('compression'):
+        return decode_body(message.body, loads)
+    body = message.decode()
+    if isinstance(body, dict) and 'oslo.message' in body:
+        body = loads(body['oslo.message'])
+    return body  # type: ignore
+
+
+def _scan_field(raw,   # type: bytes
+                name,  # type: bytes
+                ):  # type: (...) -> Optional[bytes]
+    if raw.count(name) != 1:
+        return None
+    start = raw.find(name)
+    if raw[start - 1:start] != b'"':
+        return None
+    match = _VALUE_RE.match(raw, start + len(name))
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def scan_envelope(raw,  # type: bytes
+                  ):  # type: (...) -> Optional[Tuple[str, str]]
+    """Reads event_type and timestamp from a raw notification.
+
+    Returns None, and the notification has to be decoded, unless both
+    names appear exactly once in the body.
+    """
+    event_type = _scan_field(raw, b'event_type')
+    if event_type is None:
+        return None
+    timestamp = _scan_field(raw, b'timestamp')
+    if timestamp is None:
+        return None
+    return event_type.decode('utf-8'), timestamp.decode('utf-8')
+
+
+# the quotes of the plain and of the oslo-wrapped (escaped) bodies
+_QUOTES = (b'"', b'\\"')
+# a string `id` field of an object
+_ID_RES = dict(
+    (quote, re.compile(br'[{,]\s*%sid%s\s*:\s*%s([^"\\]*)%s'
+                       % ((re.escape(quote),) * 4)))
+    for quote in _QUOTES)
+_VALUE_RES = dict(
+    (quote, re.compile(br'%s([^"\\]*)%s' % ((re.escape(quote),) * 2)))
+    for quote in _QUOTES)
+_COLON_RE = re.compile(br'\s*:\s*')
+_NESTED_RE = re.compile(br'[{}\[\]]')
+
+
+def _find_key(raw,  # type: bytes
+              key,  # type: bytes
+              ):  # type: (...) -> Tuple[int, int]
+    """Returns the number of `key` strings in `raw` and, if it is the
+    only one, the offset of its value (-1 if it is not an object key)."""
+    count = raw.count(key)
+    if count != 1:
+        return count, -1
+    match = _COLON_RE.match(raw, raw.find(key) + len(key))
+    if match is None:
+        return count, -1
+    return count, match.end()
+
+
+def scan_resource_key(raw,  # type: bytes
+                      ):  # type: (...) -> Optional[Tuple[str, str]]
+    """Reads the `resource_key` of a raw notification.
+
+    Returns None, and the notification has to be decoded, unless the id is
+    a string found unambiguously: in the only `<resource>` object, before
+    any nested value, or in the only `<resource>_id` field.
+    """
+    event_type = _scan_field(raw, b'event_type')
+    if event_type is None:
+        return None
+    name = event_type.split(b'.', 1)[0]
+    quote = _QUOTES[b'"oslo.message"' in raw]
+    count, start = _find_key(raw, quote + name + quote)
+    if count == 1:
+        if raw[start:start + 1] != b'{':
+            return None
+        nested = _NESTED_RE.search(raw, start + 1)
+        match = _ID_RES[quote].search(
+            raw, start, len(raw) if nested is None else nested.start())
+    elif count == 0:
+        count, start = _find_key(raw, quote + name + b'_id' + quote)
+        if start < 0:
+            return None
+        match = _VALUE_RES[quote].match(raw, start)
+    else:
+        return None
+    if match is None:
+        return None
+    return name.decode('utf-8'), match.group(1).decode('utf-8')
@@ -0,0 +1,95 @@
+from threading import Lock
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+import hashlib
+import json
+import time
+
+
+def notification_key(body,  # type: Dict[str, Any]
+                     ):  # type: (...) -> Hashable
+    """The oslo message_id, or a hash of event_type, timestamp and payload.
+    """
+    message_id = body.get('message_id')
+    if message_id is not None:
+        return message_id  # type: ignore
+    data = json.dumps([body.get('event_type'), body.get('timestamp'),
+                       body.get('payload')], sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class DedupCache(object):
+    """Remembers the notifications seen in the last `ttl` seconds.
+
+    At most `max_entries` keys are kept, the least recently seen are
+    evicted first. A key seen again is refreshed, so the entries are
+    always ordered by expiration and the expired ones are evicted from the
+    head of the cache.
+    """
+
+    def __init__(self,
+                 max_entries=100000,  # type: int
+                 ttl=600.0,           # type: float
+                 ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # type: OrderedDict[Hashable, float]
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):  # type: () -> int
+        return len(self.entries)
+
+    def seen(self,
+             key,       # type: Hashable
+             now=None,  # type: Optional[float]
+             ):  # type: (...) -> bool
+        """True if `key` was already seen, records it otherwise."""
+        if now is None:
+            now = time.time()
+        entries = self.entries
+        with self.lock:
+            while entries:
+                oldest = next(iter(entries))
+                if entries[oldest] > now:
+                    break
+                del entries[oldest]
+            duplicate = key in entries
+            if duplicate:
+                del entries[key]
+                self.hits += 1
+            else:
+                self.misses += 1
+                if len(entries) >= self.max_entries:
+                    entries.popitem(last=False)
+            entries[key] = now + self.ttl
+        return duplicate
+
+    def forget(self,
+               key,  # type: Hashable
+               ):  # type: (...) -> None
+        """Removes `key`, so the notification is processed again."""
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def wrap(self,
+             key,   # type: Hashable
+             done,  # type: Optional[Callable[[bool], None]]
+             ):  # type: (...) -> Callable[[bool], None]
+        """Wraps a `done(ok)` callback forgetting `key` on failure.
+
+        A failed notification is requeued with `ack=True`, and must not
+        be dropped as a duplicate when delivered again.
+        """
+        def dedup_done(ok):  # type: (bool) -> None
+            if not ok:
+                self.forget(key)
+            if done is not None:
+                done(ok)
+
+        return dedup_done
+
+    def stats(self):  # type: () -> Dict[str, int]
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self.entries)}
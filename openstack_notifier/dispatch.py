@@ -0,0 +1,263 @@
+from threading import Thread
+from typing import Optional, Any, Callable, List, Tuple, Hashable
+import multiprocessing
+import logging
+import time
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue  # type: ignore
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+Observer = Optional[Callable[[Any, float, bool], None]]
+
+
+def _remaining(deadline,  # type: Optional[float]
+               ):  # type: (...) -> Optional[float]
+    """Seconds left until `deadline`, None without deadline."""
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0.0)
+
+
+class InlineDispatcher(object):
+    """Calls the callbacks on the consumer thread (default).
+
+    `observer`, if set, is called after every callback with the data, the
+    callback duration in seconds and whether the callback succeeded.
+    """
+
+    def __init__(self):  # type: () -> None
+        self.observer = None  # type: Observer
+
+    def start(self):  # type: () -> None
+        pass
+
+    def stop(self,
+             timeout=None,  # type: Optional[float]
+             ):  # type: (...) -> None
+        pass
+
+    def queue_depth(self):  # type: () -> int
+        return 0
+
+    def dispatch(self,
+                 func,       # type: Callable[[Any], None]
+                 data,       # type: Any
+                 done=None,  # type: Optional[Callable[[bool], None]]
+                 ):  # type: (...) -> None
+        observer = self.observer
+        if observer is not None:
+            start = time.time()
+        try:
+            func(data)
+        except Exception:
+            if observer is not None:
+                observer(data, time.time() - start, False)
+            if done is not None:
+                done(False)
+            raise
+        if observer is not None:
+            observer(data, time.time() - start, True)
+        if done is not None:
+            done(True)
+
+
+class PoolDispatcher(object):
+    """Hands the callbacks to a pool of worker threads (or processes).
+
+    `dispatch` blocks when `max_queue_size` items are waiting, so a slow
+    callback slows down the consumer instead of growing memory without
+    bound. With `processes=True` each worker thread runs its callbacks in
+    a `multiprocessing.Pool`, so callbacks and their data must be
+    picklable. `observer` works as in `InlineDispatcher`.
+    """
+
+    def __init__(self,
+                 workers=4,             # type: int
+                 max_queue_size=1000,   # type: int
+                 processes=False,       # type: bool
+                 ):
+        if workers < 1:
+            raise ValueError('workers must be >= 1')
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.processes = processes
+        self.threads = []  # type: List[Thread]
+        self.pool = None  # type: Optional[Any]
+        self.queues = [queue.Queue(max_queue_size)
+                       ]  # type: List[queue.Queue[Any]]
+        self.observer = None  # type: Observer
+
+    def start(self):  # type: () -> None
+        if self.threads:
+            return
+        if self.processes:
+            self.pool = multiprocessing.Pool(self.workers)
+        self.threads = [Thread(target=self.run,
+                               args=(self.queues[i % len(self.queues)],))
+                        for i in range(self.workers)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def run(self,
+            items,  # type: queue.Queue[Any]
+            ):  # type: (...) -> None
+        while True:
+            item = items.get()
+            try:
+                if item is _STOP:
+                    return
+                func, data, done = item  # type: Tuple[Any, Any, Any]
+                self.call(func, data, done)
+            finally:
+                items.task_done()
+
+    def call(self,
+             func,  # type: Callable[[Any], None]
+             data,  # type: Any
+             done,  # type: Optional[Callable[[bool], None]]
+             ):  # type: (...) -> None
+        ok = False
+        start = time.time()
+        try:
+            if self.pool is not None:
+                self.pool.apply(func, (data,))
+            else:
+                func(data)
+            ok = True
+        except Exception:
+            log.exception('Error in callback for %s' % data)
+        if self.observer is not None:
+            self.observer(data, time.time() - start, ok)
+        if done is not None:
+            done(ok)
+
+    def queue_depth(self):  # type: () -> int
+        return sum(q.qsize() for q in self.queues)
+
+    def queue_for(self,
+                  data,  # type: Any
+                  ):  # type: (...) -> queue.Queue[Any]
+        return self.queues[0]
+
+    def discard(self):  # type: () -> int
+        """Drops the queued callbacks, their `done` is not called.
+
+        Returns the number of dropped callbacks.
+        """
+        dropped = 0
+        for items in self.queues:
+            stops = 0
+            while True:
+                try:
+                    item = items.get_nowait()
+                except queue.Empty:
+                    break
+                items.task_done()
+                if item is _STOP:
+                    stops += 1
+                else:
+                    dropped += 1
+            for _ in range(stops):
+                items.put(_STOP)
+        return dropped
+
+    def dispatch(self,
+                 func,       # type: Callable[[Any], None]
+                 data,       # type: Any
+                 done=None,  # type: Optional[Callable[[bool], None]]
+                 ):  # type: (...) -> None
+        """Queues `func(data)`, then `done(ok)` is called by the worker."""
+        self.queue_for(data).put((func, data, done))
+
+    def stop(self,
+             timeout=None,  # type: Optional[float]
+             ):  # type: (...) -> None
+        """Runs the queued callbacks and stops the workers.
+
+        Gives up after `timeout` seconds: the callbacks still queued are
+        dropped, the running ones complete in the background.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        stops = 0
+        try:
+            for i in range(len(self.threads)):
+                self.queues[i % len(self.queues)].put(
+                    _STOP, timeout=_remaining(deadline))
+                stops += 1
+        except queue.Full:
+            pass
+        for t in self.threads:
+            t.join(_remaining(deadline))
+        running = len([t for t in self.threads if t.is_alive()])
+        if running:
+            dropped = self.discard()
+            for i in range(stops, len(self.threads)):
+                self.queues[i % len(self.queues)].put(_STOP)
+            log.warning('stop timed out, %d callbacks dropped, %d running'
+                        % (dropped, running))
+        self.threads = []
+        if self.pool is not None:
+            if running:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+                self.pool.join()
+            self.pool = None
+
+
+def resource_key(data,  # type: Any
+                 ):  # type: (...) -> Optional[Hashable]
+    """Returns the (resource type, resource id) a notification refers to.
+
+    The resource type is the first part of the event_type, the id is read
+    from `payload[type]['id']` (create/update) or `payload[type + '_id']`
+    (delete). Returns None if the id can not be found.
+    """
+    resource = data.event_type.split('.', 1)[0]
+    payload = data.payload
+    body = payload.get(resource)
+    if isinstance(body, dict) and 'id' in body:
+        return (resource, body['id'])
+    if resource + '_id' in payload:
+        return (resource, payload[resource + '_id'])
+    return None
+
+
+class KeyedDispatcher(PoolDispatcher):
+    """Runs the callbacks on `workers` threads, keeping the order per key.
+
+    `key_func` maps a notification to a key, notifications with the same
+    key are always handled, in order, by the same worker. Defaults to
+    `resource_key`, so the create/update/delete notifications of a
+    resource are never reordered.
+    """
+
+    def __init__(self,
+                 key_func=resource_key,  # type: Callable[[Any], Any]
+                 workers=4,              # type: int
+                 max_queue_size=1000,    # type: int
+                 processes=False,        # type: bool
+                 ):
+        super(KeyedDispatcher, self).__init__(
+            workers=workers, max_queue_size=max_queue_size,
+            processes=processes)
+        self.key_func = key_func
+        self.queues = [queue.Queue(max_queue_size) for _ in range(workers)]
+
+    def queue_for(self,
+                  data,  # type: Any
+                  ):  # type: (...) -> queue.Queue[Any]
+        try:
+            key = self.key_func(data)
+        except Exception:
+            log.exception('Error computing the key of %s' % data)
+            key = None
+        return self.queues[hash(key) % len(self.queues)]
@@ -0,0 +1,324 @@
+from threading import Event, Lock, Thread
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import logging
+import socket
+import time
+
+import kombu  # type: ignore
+
+from openstack_notifier.notifier import OpenstackNotifier, Stream
+from openstack_notifier.reconnect import backoff_delay, rotate_urls
+
+log = logging.getLogger(__name__)
+
+Command = Tuple[str, OpenstackNotifier, Event]
+
+
+class _Connection(object):
+    """A broker connection, and its thread, shared by many notifiers.
+
+    Notifiers are attached and detached through `commands`, run by the
+    connection thread between two `drain_events`.
+    """
+
+    def __init__(self,
+                 hub,    # type: NotifierHub
+                 index,  # type: int
+                 ):
+        self.hub = hub
+        self.index = index
+        self.notifiers = []  # type: List[OpenstackNotifier]
+        self.streams = {}  # type: Dict[OpenstackNotifier, List[Stream]]
+        self.commands = deque()  # type: Deque[Command]
+        self.rabbitmq = None  # type: Any
+        self.connected = False
+        self.down_since = None  # type: Optional[float]
+        self.thread = None  # type: Optional[Thread]
+        self.reconnects = 0
+        self.connection_errors = 0
+
+    def alive(self):  # type: () -> bool
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):  # type: () -> None
+        if self.alive():
+            return
+        self.thread = Thread(target=self.run,
+                             name='openstack_notifier-hub-%d' % self.index)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def command(self,
+                action,    # type: str
+                notifier,  # type: OpenstackNotifier
+                ):  # type: (...) -> Event
+        """Queues `action` for the connection thread.
+
+        The returned event is set once it has run.
+        """
+        event = Event()
+        self.commands.append((action, notifier, event))
+        return event
+
+    def wait(self,
+             event,  # type: Event
+             ):  # type: (...) -> None
+        while not event.wait(0.1):
+            if not self.alive():
+                # the thread ended before running the command
+                self.run_commands()
+                return
+
+    def run_commands(self):  # type: () -> None
+        while self.commands:
+            try:
+                action, notifier, event = self.commands.popleft()
+            except IndexError:
+                return
+            try:
+                if action == 'attach':
+                    if notifier not in self.notifiers:
+                        self.notifiers.append(notifier)
+                        if self.rabbitmq is not None:
+                            self.open(notifier)
+                elif action == 'pause':
+                    notifier.pause_streams(self.streams.get(notifier, []))
+                else:
+                    if notifier in self.notifiers:
+                        self.notifiers.remove(notifier)
+                    self.close(notifier)
+            finally:
+                event.set()
+
+    def open(self,
+             notifier,  # type: OpenstackNotifier
+             ):  # type: (...) -> None
+        """Starts consuming the queues of `notifier`.
+
+        A notifier whose queues can not be consumed (a queue declared
+        with other arguments, a missing permission...) is detached, the
+        connection errors are raised.
+        """
+        log.info('start listening for notifications on queues %s' %
+                 notifier.queue_configs)
+        try:
+            self.streams[notifier] = notifier.open_streams(
+                self.rabbitmq, notifier.queue_configs)
+        except tuple(self.rabbitmq.connection_errors):
+            raise
+        except Exception as e:
+            log.exception('detaching notifier, error consuming %s: %s'
+                          % (notifier.queue_configs, e))
+            self.notifiers.remove(notifier)
+            self.hub.failed(notifier, e)
+            return
+        notifier.ready.set()
+
+    def close(self,
+              notifier,  # type: OpenstackNotifier
+              ):  # type: (...) -> None
+        streams = self.streams.pop(notifier, None)
+        notifier.ready.clear()
+        if streams is not None:
+            notifier.close_streams(streams)
+
+    def run(self):  # type: () -> None
+        hub = self.hub
+        failures = 0
+        while not hub.quit_event.is_set():
+            self.run_commands()
+            try:
+                self.consume_once(rotate_urls(hub.url, failures + self.index))
+                break
+            except Exception as e:
+                log.exception('error in NotifierHub: %s' % e)
+            self.connection_errors += 1
+            for notifier in list(self.notifiers):
+                with notifier.streams_lock:
+                    notifier.connection_errors += 1
+            if self.connected or self.down_since is None:
+                # the connection was up, count the failures from here
+                self.down_since = time.time()
+                self.connected = False
+                failures = 0
+            failures += 1
+            delay = backoff_delay(failures, hub.reconnect_delay,
+                                  hub.max_reconnect_delay)
+            log.warning('reconnecting in %.1f seconds' % delay)
+            deadline = time.time() + delay
+            # keep attaching and detaching notifiers while disconnected
+            while not hub.quit_event.is_set() and time.time() < deadline:
+                self.run_commands()
+                hub.quit_event.wait(min(0.1, delay))
+        self.run_commands()
+
+    def on_connected(self):  # type: () -> None
+        self.connected = True
+        down_since, self.down_since = self.down_since, None
+        if down_since is None:
+            return
+        self.reconnects += 1
+        downtime = time.time() - down_since
+        for notifier in list(self.notifiers):
+            with notifier.streams_lock:
+                notifier.reconnects += 1
+                notifier.downtime += downtime
+        log.info('reconnected after %.1f seconds' % downtime)
+
+    def consume_once(self,
+                     url,  # type: str
+                     ):  # type: (...) -> None
+        hub = self.hub
+        rabbitmq = None
+        try:
+            rabbitmq = kombu.Connection(
+                url, failover_strategy='round-robin',
+                connect_timeout=2, heartbeat=hub.heartbeat)
+            rabbitmq.ensure_connection(max_retries=3)
+            self.rabbitmq = rabbitmq
+            for notifier in list(self.notifiers):
+                self.open(notifier)
+            self.on_connected()
+
+            while not hub.quit_event.is_set():
+                self.run_commands()
+                # sent while the messages keep coming too, rate limited
+                rabbitmq.heartbeat_check()
+                # wake up often enough to run the commands
+                timeout = 0.1
+                for notifier, streams in list(self.streams.items()):
+                    timeout = min(timeout, notifier.housekeeping(streams))
+                try:
+                    rabbitmq.drain_events(timeout=timeout)
+                except socket.timeout:
+                    pass
+        finally:
+            for notifier in list(self.streams):
+                self.close(notifier)
+            self.rabbitmq = None
+            if rabbitmq is not None:
+                try:
+                    rabbitmq.release()
+                except Exception as e:
+                    log.debug('error closing the connection: %s' % e)
+
+
+class NotifierHub(object):
+    """Consumes the queues of many notifiers over a few connections.
+
+    Every notifier created with `hub=` (or by `notifier`) is attached,
+    when started, to the connection with the fewest notifiers, where its
+    queues are consumed on their own channels. A message is handled by
+    the notifier of its channel, so callbacks run inline on the
+    connection thread delay the other notifiers of the connection: use a
+    dispatcher for slow callbacks.
+    """
+
+    def __init__(self,
+                 url,                       # type: str
+                 connections=1,             # type: int
+                 heartbeat=10,              # type: int
+                 reconnect_delay=0.5,       # type: float
+                 max_reconnect_delay=30.0,  # type: float
+                 ):
+        if connections < 1:
+            raise ValueError('connections must be >= 1')
+        self.url = url
+        self.heartbeat = heartbeat
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connections = [_Connection(self, i) for i in range(connections)]
+        self.assigned = {}  # type: Dict[OpenstackNotifier, _Connection]
+        self.errors = {}  # type: Dict[OpenstackNotifier, Exception]
+        self.lock = Lock()
+        self.quit_event = Event()
+
+    def notifier(self,
+                 **kwargs  # type: Any
+                 ):  # type: (...) -> OpenstackNotifier
+        """Returns a notifier consuming through this hub."""
+        return OpenstackNotifier(self.url, hub=self, **kwargs)
+
+    def attach(self,
+               notifier,  # type: OpenstackNotifier
+               ):  # type: (...) -> None
+        """Starts consuming the queues of `notifier`.
+
+        Raises the error of the notifier queues if they can not be
+        consumed.
+        """
+        with self.lock:
+            self.errors.pop(notifier, None)
+            connection = self.assigned.get(notifier)
+            if connection is None:
+                connection = min(self.connections,
+                                 key=lambda c: (len([
+                                     n for n, a in self.assigned.items()
+                                     if a is c]), c.index))
+                self.assigned[notifier] = connection
+            self.quit_event.clear()
+            # queued before starting, so it is run before connecting
+            event = connection.command('attach', notifier)
+            connection.start()
+        connection.wait(event)
+        with self.lock:
+            error = self.errors.pop(notifier, None)
+        if error is not None:
+            raise error
+
+    def failed(self,
+               notifier,  # type: OpenstackNotifier
+               error,     # type: Exception
+               ):  # type: (...) -> None
+        """Detaches a notifier whose queues can not be consumed."""
+        with self.lock:
+            self.assigned.pop(notifier, None)
+            self.errors[notifier] = error
+
+    def pause(self,
+              notifier,  # type: OpenstackNotifier
+              ):  # type: (...) -> None
+        """Stops delivering messages to `notifier`, which stays attached
+        until `detach` to acknowledge the messages received."""
+        with self.lock:
+            connection = self.assigned.get(notifier)
+        if connection is not None:
+            connection.wait(connection.command('pause', notifier))
+
+    def detach(self,
+               notifier,  # type: OpenstackNotifier
+               ):  # type: (...) -> None
+        """Stops consuming the queues of `notifier`.
+
+        The pending acknowledgements and batches are flushed first.
+        """
+        with self.lock:
+            connection = self.assigned.pop(notifier, None)
+        if connection is not None:
+            connection.wait(connection.command('detach', notifier))
+
+    def alive(self,
+              notifier,  # type: OpenstackNotifier
+              ):  # type: (...) -> bool
+        connection = self.assigned.get(notifier)
+        return connection is not None and connection.alive()
+
+    def connection_stats(self):  # type: () -> List[Dict[str, Any]]
+        """Notifiers, reconnections and errors of every connection."""
+        return [{'connected': c.rabbitmq is not None,
+                 'notifiers': len(c.notifiers),
+                 'reconnects': c.reconnects,
+                 'connection_errors': c.connection_errors}
+                for c in self.connections]
+
+    def stop(self):  # type: () -> None
+        """Closes the connections, the notifiers are left attached.
+
+        They are consumed again by the next `attach`.
+        """
+        self.quit_event.set()
+        for connection in self.connections:
+            if connection.thread is not None:
+                connection.thread.join()
+            connection.thread = None
@@ -0,0 +1,210 @@
+from threading import Lock, Thread, local
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import bisect
+import logging
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import HTTPServer  # type: ignore
+    from BaseHTTPServer import BaseHTTPRequestHandler  # type: ignore
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0,
+                   30.0, 60.0, 300.0)
+
+
+class _Shard(object):
+    """The counters and histograms updated by a single thread."""
+
+    def __init__(self):  # type: () -> None
+        self.counters = {}  # type: Dict[Tuple[str, str], int]
+        self.histograms = {}  # type: Dict[str, List[float]]
+
+
+class Metrics(object):
+    """Counters and histograms of a notifier.
+
+    Every thread updates its own counters, without locking, and
+    `snapshot` sums them. Counters are broken down by event_type,
+    histograms count the observed values in the `buckets` upper bounds
+    (the last bucket is +Inf). The gauges registered under the same name,
+    by the notifiers sharing the metrics, are summed.
+    """
+
+    def __init__(self,
+                 buckets=DEFAULT_BUCKETS,  # type: Tuple[float, ...]
+                 prefix='openstack_notifier',  # type: str
+                 ):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self.lock = Lock()
+        self.local = local()
+        self.shards = []  # type: List[_Shard]
+        self.gauges = {}  # type: Dict[str, List[Callable[[], float]]]
+
+    def shard(self):  # type: () -> _Shard
+        shard = _Shard()
+        with self.lock:
+            self.shards.append(shard)
+        self.local.counters = shard.counters
+        self.local.histograms = shard.histograms
+        return shard
+
+    def inc(self,
+            name,        # type: str
+            event_type,  # type: str
+            ):  # type: (...) -> None
+        try:
+            counters = self.local.counters
+        except AttributeError:
+            counters = self.shard().counters
+        key = (name, event_type)
+        counters[key] = counters.get(key, 0) + 1
+
+    def observe(self,
+                name,   # type: str
+                value,  # type: float
+                ):  # type: (...) -> None
+        try:
+            histograms = self.local.histograms
+        except AttributeError:
+            histograms = self.shard().histograms
+        histogram = histograms.get(name)
+        if histogram is None:
+            # bucket counts (+Inf included), sum, count
+            histogram = histograms[name] = [0.0] * (len(self.buckets) + 3)
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def gauge(self,
+              name,      # type: str
+              function,  # type: Callable[[], float]
+              ):  # type: (...) -> None
+        """Reports the value returned by `function` in the snapshots,
+        added to the other gauges of the same name."""
+        with self.lock:
+            self.gauges.setdefault(name, []).append(function)
+
+    def snapshot(self):  # type: () -> Dict[str, Any]
+        """Returns the current values.
+
+        `{'counters': {name: {event_type: count}},
+          'histograms': {name: {'buckets': [(le, cumulative count)],
+                                'sum': float, 'count': int}},
+          'gauges': {name: value}}`
+        """
+        with self.lock:
+            shards = list(self.shards)
+        counters = {}  # type: Dict[str, Dict[str, int]]
+        totals = {}  # type: Dict[str, List[float]]
+        for shard in shards:
+            for (name, event_type), n in list(dict(shard.counters).items()):
+                by_type = counters.setdefault(name, {})
+                by_type[event_type] = by_type.get(event_type, 0) + n
+            for name, histogram in list(dict(shard.histograms).items()):
+                total = totals.setdefault(name, [0.0] * len(histogram))
+                for i, v in enumerate(list(histogram)):
+                    total[i] += v
+        histograms = {}  # type: Dict[str, Dict[str, Any]]
+        for name, total in totals.items():
+            cumulative = 0
+            buckets = []
+            for le, count in zip(self.buckets + (float('inf'),), total):
+                cumulative += int(count)
+                buckets.append((le, cumulative))
+            histograms[name] = {'buckets': buckets,
+                                'sum': total[-2],
+                                'count': int(total[-1])}
+        with self.lock:
+            registered = [(name, list(functions))
+                          for name, functions in self.gauges.items()]
+        gauges = {}  # type: Dict[str, float]
+        for name, functions in registered:
+            try:
+                gauges[name] = sum(function() for function in functions)
+            except Exception:
+                log.exception('Error reading gauge %s' % name)
+        return {'counters': counters,
+                'histograms': histograms,
+                'gauges': gauges}
+
+    def prometheus(self):  # type: () -> str
+        """Returns a snapshot in the prometheus text format."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, by_type in sorted(snapshot['counters'].items()):
+            metric = '%s_%s_total' % (self.prefix, name)
+            lines.append('# TYPE %s counter' % metric)
+            for event_type, n in sorted(by_type.items()):
+                lines.append('%s{event_type="%s"} %d'
+                             % (metric, _escape(event_type), n))
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            metric = '%s_%s' % (self.prefix, name)
+            lines.append('# TYPE %s histogram' % metric)
+            for le, n in histogram['buckets']:
+                le_s = '+Inf' if le == float('inf') else repr(float(le))
+                lines.append('%s_bucket{le="%s"} %d' % (metric, le_s, n))
+            lines.append('%s_sum %r' % (metric, float(histogram['sum'])))
+            lines.append('%s_count %d' % (metric, histogram['count']))
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric = '%s_%s' % (self.prefix, name)
+            lines.append('# TYPE %s gauge' % metric)
+            lines.append('%s %r' % (metric, float(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):  # type: (str) -> str
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+class MetricsServer(object):
+    """Serves the metrics in the prometheus text format on /metrics."""
+
+    def __init__(self,
+                 metrics,        # type: Metrics
+                 host='0.0.0.0',  # type: str
+                 port=9100,      # type: int
+                 ):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None  # type: Optional[HTTPServer]
+        self.thread = None  # type: Optional[Thread]
+
+    def start(self):  # type: () -> None
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # type: () -> None
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # type: ignore
+                log.debug(format, *args)
+
+        self.server = HTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):  # type: () -> None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+        self.server = None
+        self.thread = None
@@ -1,22 +1,90 @@
-from threading import Thread, Event
+from threading import Thread, Event, Lock
+from functools import partial
 from typing import Optional, Dict, Any, Callable, List
-import time
 import logging
-import json
 import kombu  # type: ignore
 from uuid import uuid4
 import socket
+from openstack_notifier.dispatch import InlineDispatcher, KeyedDispatcher
+from openstack_notifier.acks import AckTracker, join_done
+from openstack_notifier.batch import Batcher
+from openstack_notifier.timestamp import parse_timestamp
+from openstack_notifier.codec import json_loads, decode_message, JsonLoads
+from openstack_notifier.codec import decode_body, scan_envelope
+from openstack_notifier.subscriptions import PatternIndex
+from openstack_notifier.metrics import Metrics
+from openstack_notifier.dedup import DedupCache, notification_key
+from openstack_notifier.coalesce import Coalescer
+from openstack_notifier.reconnect import backoff_delay, rotate_urls
+from openstack_notifier.checkpoint import Checkpoint
+from openstack_notifier.recording import Recorder
+from openstack_notifier.projection import Projection, merge
+from openstack_notifier.shedding import LoadShedder
+from openstack_notifier.wakeup import Waker, connection_socket, wait_readable
+from openstack_notifier.profiling import Profiler
+import time
 
 log = logging.getLogger(__name__)
 
+# drain timeout of the transports whose drain loop can not be woken up
+POLL_INTERVAL = 0.05
+
+
+class CallbackData(object):
+    """A notification passed to the callbacks.
+
+    With `raw`, the json body of the notification, the payload is decoded
+    (by `loads`) on first access.
+    """
+    __slots__ = ('event_type', '_payload', 'timestamp', 'raw', 'loads',
+                 'projection')
 
-class CallbackData:
     def __init__(self,
                  event_type,         # type: str
-                 payload             # type: Dict[str, Any]
+                 payload=None,       # type: Optional[Dict[str, Any]]
+                 timestamp=None,     # type: Optional[float]
+                 raw=None,           # type: Optional[bytes]
+                 loads=json_loads,   # type: JsonLoads
+                 projection=None,    # type: Optional[Projection]
                  ):
         self.event_type = event_type
-        self.payload = payload
+        self._payload = payload
+        # notification timestamp (UTC epoch), not compared by __eq__
+        self.timestamp = timestamp
+        self.raw = raw
+        self.loads = loads
+        # applied to the payload decoded from raw
+        self.projection = projection
+
+    @property
+    def payload(self):  # type: () -> Dict[str, Any]
+        # raw is read once: another thread may decode it meanwhile
+        raw = self.raw
+        if self._payload is None and raw is not None:
+            payload = decode_body(raw, self.loads).get('payload', {})
+            if self.projection is not None:
+                payload = self.projection(payload)
+            self._payload = payload
+            self.raw = None
+        return self._payload  # type: ignore
+
+    @payload.setter
+    def payload(self,
+                value,  # type: Dict[str, Any]
+                ):  # type: (...) -> None
+        self._payload = value
+        self.raw = None
+
+    def __getstate__(self):  # type: () -> Any
+        # raw first, the payload is set before raw is cleared
+        raw = self.raw
+        return (self.event_type, self._payload, self.timestamp, raw,
+                self.projection)
+
+    def __setstate__(self, state):  # type: (Any) -> None
+        self.event_type, self._payload, self.timestamp, self.raw, \
+            self.projection = state
+        self.loads = json_loads
 
     def __eq__(self,
                other,  # type: object
@@ -36,13 +104,21 @@ class QueueConfig:
                  exchange,            # type: str
                  queue="",          # type: str
                  routing_key="*",   # type: str
+                 prefetch_count=None,  # type: Optional[int]
+                 durable=False,       # type: bool
                  ):
         self.exchange = exchange
         if queue == "":
+            if durable:
+                raise ValueError('durable queues must be named')
             self.queue = "openstack_notifier-%s" % uuid4()
         else:
             self.queue = queue
         self.routing_key = routing_key
+        # overrides the notifier prefetch_count on a dedicated channel
+        self.prefetch_count = prefetch_count
+        # survives the notifier restarts, keeping the notifications
+        self.durable = durable
 
     def __repr__(self):  # type: () -> str
         return("QueueConfig<exchange=%s queue=%s routing_key=%s>" %
@@ -53,10 +129,50 @@ class QueueConfig:
             return False
         return self.exchange == other.exchange \
             and self.queue == other.queue \
-            and self.routing_key == other.routing_key
+            and self.routing_key == other.routing_key \
+            and self.prefetch_count == other.prefetch_count \
+            and self.durable == other.durable
+
+
+def default_queue_configs():  # type: () -> List[QueueConfig]
+    return [
+        QueueConfig(exchange='neutron',
+                    queue='',
+                    routing_key='notifications.info'),
+        QueueConfig(exchange='nova',
+                    queue='',
+                    routing_key='notifications.info'),
+        ]
+
+
+class Stream(object):
+    """The queues consumed on a channel, with their acknowledgements."""
+
+    def __init__(self,
+                 name,            # type: str
+                 prefetch_count,  # type: int
+                 ack_tracker,     # type: Optional[AckTracker]
+                 ):
+        self.name = name
+        self.prefetch_count = prefetch_count
+        self.ack_tracker = ack_tracker
+        self.min_timestamp = 0.0
+        self.received = 0
+        self.channel = None  # type: Any
+        self.consumer = None  # type: Any
+
+    def stats(self):  # type: () -> Dict[str, int]
+        in_flight = 0
+        if self.ack_tracker is not None:
+            in_flight = self.ack_tracker.in_flight()
+        return {'received': self.received,
+                'in_flight': in_flight,
+                'prefetch_count': self.prefetch_count}
 
 
 OpenstackNotifierCallback = Optional[Callable[[CallbackData], None]]
+OpenstackNotifierBatchCallback = Optional[
+    Callable[[List[CallbackData]], None]]
 
 
 class OpenstackNotifier(object):
@@ -65,117 +181,829 @@ class OpenstackNotifier(object):
                  callback=None,         # type: OpenstackNotifierCallback
                  queue_configs=None,    # type: Optional[List[QueueConfig]]
                  min_timestamp=None,  # type: Optional[float]
+                 dispatcher=None,       # type: Optional[Any]
+                 ack=False,             # type: bool
+                 prefetch_count=100,    # type: int
+                 ack_batch_size=50,     # type: int
+                 ack_interval=0.1,      # type: float
+                 batch_callback=None,   # type: OpenstackNotifierBatchCallback
+                 max_batch_size=100,    # type: int
+                 max_batch_latency=1.0,  # type: float
+                 raw=False,             # type: bool
+                 lazy=False,            # type: bool
+                 loads=None,            # type: Optional[JsonLoads]
+                 metrics=None,          # type: Optional[Metrics]
+                 dedup=None,            # type: Optional[DedupCache]
+                 coalescer=None,        # type: Optional[Coalescer]
+                 accept=None,  # type: Optional[Callable[[CallbackData], bool]]
+                 channel_per_queue=False,  # type: bool
+                 thread_per_queue=False,   # type: bool
+                 reconnect=True,           # type: bool
+                 reconnect_delay=0.5,      # type: float
+                 max_reconnect_delay=30.0,  # type: float
+                 heartbeat=10,             # type: int
+                 checkpoint=None,          # type: Optional[Checkpoint]
+                 recorder=None,            # type: Optional[Recorder]
+                 projections=None,  # type: Optional[Dict[str, List[str]]]
+                 shedder=None,             # type: Optional[LoadShedder]
+                 hub=None,                 # type: Optional[Any]
+                 profiler=None,            # type: Optional[Profiler]
                  ):
         self.url = url
+        self.raw = raw
+        self.lazy = lazy
+        if loads is None:
+            self.loads = json_loads  # type: JsonLoads
+        else:
+            self.loads = loads
+        self.ack = ack
+        self.prefetch_count = prefetch_count
+        self.ack_batch_size = ack_batch_size
+        self.ack_interval = ack_interval
+        self.channel_per_queue = channel_per_queue or thread_per_queue
+        self.thread_per_queue = thread_per_queue
+        self.streams = []  # type: List[Stream]
+        self.streams_lock = Lock()
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.heartbeat = heartbeat
+        self.reconnects = 0
+        self.connection_errors = 0
+        self.downtime = 0.0
         self.callback = callback
+        self.subscriptions = PatternIndex()
+        self.projections = PatternIndex()
+        self.projection_cache = {}  # type: Dict[str, Optional[Projection]]
+        for pattern, fields in (projections or {}).items():
+            self.project(pattern, fields)
+        if dispatcher is None:
+            self.dispatcher = InlineDispatcher()  # type: Any
+        else:
+            self.dispatcher = dispatcher
+        self.batch_callback = batch_callback
+        self.batcher = None  # type: Optional[Batcher]
+        self.batch_lock = Lock()
+        if batch_callback is not None:
+            if isinstance(self.dispatcher, KeyedDispatcher):
+                raise ValueError('batches can not be dispatched by key')
+            self.batcher = Batcher(max_batch_size=max_batch_size,
+                                   max_batch_latency=max_batch_latency)
+        self.dedup = dedup
+        self.coalescer = coalescer
+        self.accept = accept
+        self.checkpoint = checkpoint
+        self.recorder = recorder
+        self.shedder = shedder
+        self.hub = hub
+        # the stages of handle_message, timed versions with a profiler
+        self.decode_message = decode_message
+        self.scan_envelope = scan_envelope
+        self.unwrap = self.loads
+        self.parse_timestamp = parse_timestamp
+        self.profiler = profiler
+        if profiler is not None:
+            self.instrument(profiler)
+        self.metrics = metrics
+        if metrics is not None or profiler is not None:
+            self.dispatcher.observer = self.callback_finished
+        if metrics is not None:
+            metrics.gauge('queue_depth', self.queue_depth)
+            metrics.gauge('reconnects', lambda: self.reconnects)
+            metrics.gauge('downtime_seconds', lambda: self.downtime)
+            if coalescer is not None:
+                metrics.gauge('coalesce_pending', coalescer.__len__)
         if min_timestamp is None:
-            self.min_timestamp = 0
+            self.min_timestamp = 0.0
         else:
-            self.min_timestamp = int(min_timestamp)
+            self.min_timestamp = float(min_timestamp)
         if queue_configs is None:
-            self.queue_configs = [
-                QueueConfig(exchange='neutron',
-                            queue='',
-                            routing_key='notifications.info'),
-                QueueConfig(exchange='nova',
-                            queue='',
-                            routing_key='notifications.info'),
-                ]
+            self.queue_configs = default_queue_configs()
         else:
             self.queue_configs = queue_configs
+        if any(q.prefetch_count is not None for q in self.queue_configs):
+            # the prefetch window is set per channel, and only limits the
+            # messages not acknowledged yet
+            if not ack:
+                raise ValueError('QueueConfig.prefetch_count requires ack')
+            if not self.channel_per_queue and len(self.queue_configs) > 1:
+                raise ValueError('QueueConfig.prefetch_count requires '
+                                 'channel_per_queue')
+        if channel_per_queue and not thread_per_queue and hub is None \
+                and isinstance(self.dispatcher, InlineDispatcher) \
+                and len(self.queue_configs) > 1:
+            log.warning('channel_per_queue: the queues are consumed, and '
+                        'their callbacks run, on a single thread, use '
+                        'thread_per_queue or a dispatcher')
         super(OpenstackNotifier, self).__init__()
 
         self.thread = None  # type: Optional[Thread]
         self.quit_event = Event()
+        self.waker = None  # type: Optional[Waker]
+        self.ready = Event()
+        self.consumers = 0
+        # (drain, deadline) while stopping
+        self.stopping = None  # type: Optional[Any]
 
     def rabbitmq_callback(self,
                           body,  # type: Dict[str, Any]
-                          message  # type: str
+                          message  # type: Any
                           ):  # type: (...) -> None
+        self.handle_message(body, message)
+
+    def rabbitmq_message(self,
+                         message,  # type: Any
+                         ):  # type: (...) -> None
+        """`on_message` handler used with `raw=True`.
+
+        The message body is decoded here, and only once, by `self.loads`
+        instead of being decoded by kombu first.
+        """
+        self.handle_message(None, message)
+
+    def handle_message(self,
+                       body,         # type: Optional[Dict[str, Any]]
+                       message,      # type: Any
+                       stream=None,  # type: Optional[Stream]
+                       ):  # type: (...) -> None
+        done = None  # type: Optional[Callable[[bool], None]]
+        ack_tracker = None
+        if stream is not None:
+            stream.received += 1
+            ack_tracker = stream.ack_tracker
+        if ack_tracker is not None:
+            ack_tracker.delivered(message)
+            done = partial(ack_tracker.done, message)
+            if self.checkpoint is not None \
+                    and message.delivery_info.get('redelivered', False):
+                done = self.checkpoint.redelivery(
+                    stream.name, message.body, done)  # type: ignore
+        metrics = self.metrics
+        event_type = None
+        event_ts_s = None  # type: Optional[str]
+        raw = None
         try:
-            log.debug('received message: %s' % body)
-            if "oslo.message" in body:
-                body = json.loads(body['oslo.message'])
-            event_type = body.get('event_type', None)
-            event_ts_s = body.get('timestamp', None)
+            if self.recorder is not None:
+                self.recorder.record_message(message)
+            if body is None:
+                if self.callback is None and self.batcher is None \
+                        and not self.subscriptions.match_raw(message.body):
+                    if metrics is not None:
+                        metrics.inc('unsubscribed', '')
+                    return
+                envelope = None
+                if self.lazy and message.content_type == 'application/json' \
+                        and not message.headers.get('compression'):
+                    envelope = self.scan_envelope(message.body)
+                if envelope is not None:
+                    # the payload is decoded by CallbackData when needed
+                    raw = message.body
+                    event_type, event_ts_s = envelope
+                else:
+                    body = self.decode_message(message, self.loads)
+            elif "oslo.message" in body:
+                body = self.unwrap(body['oslo.message'])
+            if raw is None:
+                assert body is not None
+                log.debug('received message: %s', body)
+                event_type = body.get('event_type', None)
+                event_ts_s = body.get('timestamp', None)
+            if metrics is not None:
+                metrics.inc('received', event_type or '')
             if event_type is None:
                 return
             if event_ts_s is None:
-                log.debug('message has no timestamp, skipping: %s'
-                          % body)
+                log.debug('message has no timestamp, skipping: %s', body)
+                if metrics is not None:
+                    metrics.inc('missing_timestamp', event_type)
                 return
-            event_ts = time.mktime(time.strptime(
-                event_ts_s, '%Y-%m-%d %H:%M:%S.%f'))
-            if self.min_timestamp > event_ts:
-                log.debug('old message, skipping: %s, min_timestamp: %s'
-                          % (body, self.min_timestamp))
+            event_ts = self.parse_timestamp(event_ts_s)
+            min_timestamp = self.min_timestamp
+            if stream is not None and stream.min_timestamp > min_timestamp:
+                min_timestamp = stream.min_timestamp
+            if min_timestamp > event_ts:
+                log.debug('old message, skipping: %s, min_timestamp: %s',
+                          body, min_timestamp)
+                if metrics is not None:
+                    metrics.inc('filtered_old', event_type)
                 return
+            if self.shedder is not None \
+                    and self.shedder.shed(event_type, event_ts):
+                if metrics is not None:
+                    metrics.inc('shed', event_type)
+                return
+            dedup_key = None
+            if self.dedup is not None:
+                if body is None:
+                    body = decode_body(raw, self.loads)
+                dedup_key = notification_key(body)
+                if self.dedup.seen(dedup_key):
+                    log.debug('duplicate message, skipping: %s', body)
+                    if metrics is not None:
+                        metrics.inc('duplicate', event_type)
+                    return
 
-            if self.callback is not None:
-                payload = body.get('payload', {})
-                callback_data = CallbackData(event_type=event_type,
-                                             payload=payload)
-                log.debug('calling callback (%s)' % callback_data)
-                self.callback(callback_data)
+            handlers = self.handlers(event_type)
+            if handlers or self.batcher is not None:
+                projection = None
+                if len(self.projections) > 0:
+                    projection = self.projection(event_type)
+                if body is None:
+                    callback_data = CallbackData(event_type=event_type,
+                                                 timestamp=event_ts,
+                                                 raw=raw, loads=self.loads,
+                                                 projection=projection)
+                else:
+                    payload = body.get('payload', {})
+                    if projection is not None:
+                        payload = projection(payload)
+                    callback_data = CallbackData(event_type=event_type,
+                                                 payload=payload,
+                                                 timestamp=event_ts)
+                if self.accept is not None \
+                        and not self.accept(callback_data):
+                    return
+                # from here on the dispatcher reports the outcome
+                callback_done, done = done, None
+                if dedup_key is not None:
+                    callback_done = self.dedup.wrap(  # type: ignore
+                        dedup_key, callback_done)
+                if self.checkpoint is not None:
+                    # a failed message is requeued once, its redelivery
+                    # is recognized by its body
+                    retry_key = None
+                    if ack_tracker is not None and not \
+                            message.delivery_info.get('redelivered', False):
+                        retry_key = message.body
+                    callback_done = self.checkpoint.wrap(
+                        event_ts, callback_done,
+                        '' if stream is None else stream.name, retry_key)
+                if self.coalescer is not None:
+                    self.release(
+                        self.coalescer.add(callback_data, callback_done))
+                else:
+                    self.deliver(callback_data, handlers, callback_done)
         except Exception:
+            if body is None:
+                body = getattr(message, 'body', None)
             log.exception('Error while parsing message %s' % body)
+            if metrics is not None:
+                metrics.inc('parse_error', event_type or '')
+        finally:
+            if done is not None:
+                done(True)
+            if ack_tracker is not None and ack_tracker.due():
+                ack_tracker.flush()
+
+    def callback_finished(self,
+                          data,     # type: Any
+                          seconds,  # type: float
+                          ok,       # type: bool
+                          ):  # type: (...) -> None
+        """Dispatcher observer updating the metrics and the profiler."""
+        if self.profiler is not None:
+            self.profiler.callback_finished(data, seconds, ok)
+        metrics = self.metrics
+        if metrics is None:
+            return
+        metrics.observe('callback_seconds', seconds)
+        now = time.time()
+        if not isinstance(data, list):
+            data = (data,)
+        for item in data:
+            if not ok:
+                metrics.inc('callback_error', item.event_type)
+            if item.timestamp is not None:
+                metrics.observe('lag_seconds', now - item.timestamp)
+
+    def instrument(self,
+                   profiler,  # type: Profiler
+                   ):  # type: (...) -> None
+        """Replaces the stages of `handle_message` by timed versions."""
+        self.decode_message = profiler.timed('decode', decode_message)
+        self.scan_envelope = profiler.timed('decode', scan_envelope)
+        self.unwrap = profiler.timed('unwrap', self.loads)
+        self.parse_timestamp = profiler.timed('timestamp', parse_timestamp)
+        self.deliver = profiler.timed_deliver(  # type: ignore
+            self.deliver)
+        self.handle_message = profiler.timed_message(  # type: ignore
+            self.handle_message)
+
+    def subscribe(self,
+                  pattern,  # type: str
+                  handler,  # type: Callable[[CallbackData], None]
+                  ):  # type: (...) -> None
+        """Calls `handler` for the notifications matching `pattern`.
+
+        `pattern` is a glob on the event_type, like `port.*.end` or
+        `security_group.*`.
+        """
+        self.subscriptions.add(pattern, handler)
+
+    def project(self,
+                pattern,  # type: str
+                fields,   # type: List[str]
+                ):  # type: (...) -> None
+        """Keeps only `fields` in the payloads matching `pattern`.
+
+        `fields` are dotted paths like `port.fixed_ips.ip_address`. When
+        more patterns match an event_type, the union of their fields is
+        kept.
+        """
+        self.projections.add(pattern, Projection(fields))
+        self.projection_cache = {}
+
+    def projection(self,
+                   event_type,  # type: str
+                   ):  # type: (...) -> Optional[Projection]
+        try:
+            return self.projection_cache[event_type]
+        except KeyError:
+            pass
+        projection = merge(list(self.projections.match(event_type)))
+        if len(self.projection_cache) >= 10000:
+            self.projection_cache = {}
+        self.projection_cache[event_type] = projection
+        return projection
+
+    def handlers(self,
+                 event_type,  # type: str
+                 ):  # type: (...) -> List[Callable[[CallbackData], None]]
+        handlers = list(self.subscriptions.match(event_type))
+        if self.callback is not None:
+            handlers.insert(0, self.callback)
+        return handlers
+
+    def deliver(self,
+                data,      # type: CallbackData
+                handlers,  # type: List[Callable[[CallbackData], None]]
+                done,      # type: Optional[Callable[[bool], None]]
+                ):  # type: (...) -> None
+        dones = join_done(done, len(handlers) + int(self.batcher is not None))
+        if self.batcher is not None:
+            with self.batch_lock:
+                self.batcher.add(data, dones.pop())
+                due = self.batcher.due()
+            if due:
+                self.flush_batch()
+        for handler in handlers:
+            log.debug('calling %s (%s)', handler, data)
+            try:
+                self.dispatcher.dispatch(handler, data, dones.pop())
+            except Exception:
+                log.exception('Error in callback for %s' % data)
+
+    def release(self,
+                ready,  # type: List[Any]
+                ):  # type: (...) -> None
+        """Delivers the notifications released by the coalescer."""
+        for data, done in ready:
+            self.deliver(data, self.handlers(data.event_type), done)
+
+    def flush_coalescer(self):  # type: () -> None
+        if self.coalescer is not None:
+            self.release(self.coalescer.flush())
+
+    def flush_batch(self):  # type: () -> None
+        if self.batcher is None:
+            return
+        with self.batch_lock:
+            if len(self.batcher) == 0:
+                return
+            batch, done = self.batcher.take()
+        log.debug('calling batch callback (%d notifications)' % len(batch))
+        try:
+            self.dispatcher.dispatch(self.batch_callback, batch, done)
+        except Exception:
+            log.exception('Error in batch callback')
+
+    def housekeeping(self,
+                     streams=None,  # type: Optional[List[Stream]]
+                     ):  # type: (...) -> float
+        """Runs the periodic tasks of a consumer thread.
+
+        Only the acknowledgements of `streams`, the ones consumed by the
+        calling thread, are flushed (by default those of every stream).
+        Returns the seconds before the next task is due.
+        """
+        if streams is None:
+            streams = list(self.streams)
+        timeout = 1.0
+        if self.coalescer is not None:
+            self.release(self.coalescer.expired())
+            coalesce_timeout = self.coalescer.timeout()
+            if coalesce_timeout is not None:
+                timeout = min(timeout, coalesce_timeout)
+        if self.batcher is not None:
+            if self.batcher.due():
+                self.flush_batch()
+            batch_timeout = self.batcher.timeout()
+            if batch_timeout is not None:
+                timeout = min(timeout, batch_timeout)
+        for stream in streams:
+            if stream.ack_tracker is not None:
+                if stream.ack_tracker.due():
+                    stream.ack_tracker.flush()
+                timeout = min(timeout, self.ack_interval)
+        if self.checkpoint is not None:
+            if self.checkpoint.due():
+                self.checkpoint.flush()
+            timeout = min(timeout, self.checkpoint.interval)
+        if self.recorder is not None:
+            if self.recorder.due():
+                self.recorder.flush()
+            timeout = min(timeout, self.recorder.flush_interval)
+        return max(timeout, 0.001)
 
     def start(self):  # type: () -> None
-        if self.thread is not None and self.thread.isAlive():
+        if self.alive():
+            return
+        self.stopping = None
+        self.dispatcher.start()
+        if self.hub is not None:
+            try:
+                self.hub.attach(self)
+            except Exception:
+                self.dispatcher.stop()
+                raise
             return
+        if self.waker is None:
+            self.waker = Waker()
         self.thread = Thread(target=self.run)
         self.thread.start()
 
+    def wait_ready(self,
+                   timeout=None,  # type: Optional[float]
+                   ):  # type: (...) -> bool
+        """Waits until all the queues are being consumed.
+
+        Returns False after `timeout` seconds.
+        """
+        return self.ready.wait(timeout)
+
+    def consumer_count(self):  # type: () -> int
+        """Number of consumer threads."""
+        if not self.thread_per_queue or len(self.queue_configs) < 2:
+            return 1
+        return len(self.queue_configs)
+
+    def consumer_ready(self,
+                       ready,  # type: bool
+                       ):  # type: (...) -> None
+        with self.streams_lock:
+            self.consumers += 1 if ready else -1
+            if self.consumers >= self.consumer_count():
+                self.ready.set()
+            else:
+                self.ready.clear()
+
     def run(self):  # type: () -> None
+        if self.consumer_count() == 1:
+            self.consume(self.queue_configs)
+            return
+        threads = [Thread(target=self.consume, args=([q],),
+                          name='openstack_notifier-%s' % q.queue)
+                   for q in self.queue_configs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def consume(self,
+                queue_configs,  # type: List[QueueConfig]
+                ):  # type: (...) -> None
+        """Consumes `queue_configs` until stopped.
+
+        When the connection fails, and `reconnect` is set, the queues are
+        declared again on a new connection after a backoff delay, starting
+        from the next of the `;` separated broker urls.
+        """
+        failures = 0
+        state = {'down_since': None, 'connected': False}  # type: Any
+
+        def connected():  # type: () -> None
+            down_since = state['down_since']
+            state['connected'] = True
+            self.consumer_ready(True)
+            if down_since is None:
+                return
+            with self.streams_lock:
+                self.reconnects += 1
+                self.downtime += time.time() - down_since
+            log.info('reconnected after %.1f seconds'
+                     % (time.time() - down_since))
+
+        while not self.quit_event.is_set():
+            try:
+                self.consume_once(rotate_urls(self.url, failures),
+                                  queue_configs, connected)
+                return
+            except Exception as e:
+                log.exception('error in OpenstackManager: %s' % e)
+            finally:
+                if state['connected']:
+                    self.consumer_ready(False)
+            with self.streams_lock:
+                self.connection_errors += 1
+            if not self.reconnect:
+                return
+            if state['connected'] or state['down_since'] is None:
+                # the connection was up, count the failures from here
+                state['down_since'] = time.time()
+                state['connected'] = False
+                failures = 0
+            failures += 1
+            delay = backoff_delay(failures, self.reconnect_delay,
+                                  self.max_reconnect_delay)
+            log.warning('reconnecting in %.1f seconds' % delay)
+            self.quit_event.wait(delay)
+
+    def consume_once(self,
+                     url,            # type: str
+                     queue_configs,  # type: List[QueueConfig]
+                     on_connected=None,  # type: Optional[Callable[[], None]]
+                     ):  # type: (...) -> None
+        """Consumes `queue_configs` on a connection until stopped.
+
+        `on_connected` is called once consuming. Connection errors are
+        raised.
+        """
+        rabbitmq = None
+        streams = []  # type: List[Stream]
         try:
-            rabbitmq = None
-            channel = None
-            consumer = None
             rabbitmq = kombu.Connection(
-                self.url, failover_strategy='round-robin',
-                connect_timeout=2, hearthbeat=1)
+                url, failover_strategy='round-robin',
+                connect_timeout=2, heartbeat=self.heartbeat)
             rabbitmq.ensure_connection(max_retries=3)
             log.info('start listening for notifications on queues %s' %
-                     self.queue_configs)
-
-            channel = rabbitmq.channel()
-            consumer = kombu.Consumer(channel,
-                                      callbacks=[self.rabbitmq_callback],
-                                      no_ack=True)
-
-            for q in self.queue_configs:
-                exchange = kombu.Exchange(q.exchange,
-                                          type='topic',
-                                          durable=False)
-                q = kombu.Queue(q.queue, exchange=exchange,
-                                routing_key=q.routing_key, durable=False,
-                                no_ack=True, auto_delete=True)
-                consumer.add_queue(q)
-
-            consumer.consume(no_ack=True)
+                     queue_configs)
+            streams = self.open_streams(rabbitmq, queue_configs)
+            if on_connected is not None:
+                on_connected()
+
+            sock = connection_socket(rabbitmq)
             while not self.quit_event.is_set():
-                while not self.quit_event.wait(timeout=1):
-                    try:
-                        while not self.quit_event.is_set():
-                            rabbitmq.drain_events(timeout=1)
-                    except socket.timeout:
-                        rabbitmq.heartbeat_check()
-        except Exception as e:
-            log.exception('error in OpenstackManager: %s' % e)
+                # drain_events does not send heartbeats, even while the
+                # messages keep coming: heartbeat_check is rate limited
+                rabbitmq.heartbeat_check()
+                timeout = self.housekeeping(streams)
+                if sock is None:
+                    timeout = min(timeout, POLL_INTERVAL)
+                elif not wait_readable(sock, self.waker, timeout):
+                    # timed out, or woken up by stop()
+                    continue
+                try:
+                    rabbitmq.drain_events(timeout=timeout)
+                except socket.timeout:
+                    pass
         finally:
-            if consumer is not None:
-                consumer.cancel()
-            if channel is not None:
-                channel.close()
+            self.close_streams(streams)
             if rabbitmq is not None:
-                rabbitmq.release()
+                try:
+                    rabbitmq.release()
+                except Exception as e:
+                    log.debug('error closing the connection: %s' % e)
+
+    def open_streams(self,
+                     rabbitmq,       # type: Any
+                     queue_configs,  # type: List[QueueConfig]
+                     ):  # type: (...) -> List[Stream]
+        """Starts consuming `queue_configs` on a connection.
+
+        The queues share a channel, or with `channel_per_queue` each one
+        has its own channel, prefetch window and acknowledgements.
+        """
+        no_ack = not self.ack
+        if self.channel_per_queue:
+            groups = [[q] for q in queue_configs]
+        else:
+            groups = [queue_configs]
+        streams = []  # type: List[Stream]
+        try:
+            for group in groups:
+                prefetch_count = self.prefetch_count
+                if len(group) == 1 and group[0].prefetch_count is not None:
+                    prefetch_count = group[0].prefetch_count
+                if not self.ack:
+                    # without acknowledgements the window is unlimited
+                    prefetch_count = 0
+                ack_tracker = None
+                if self.ack:
+                    ack_tracker = AckTracker(
+                        batch_size=self.ack_batch_size,
+                        interval=self.ack_interval,
+                        # only the amqp transports implement multiple acks
+                        multiple=rabbitmq.transport.driver_type == 'amqp')
+                stream = Stream(','.join(q.queue for q in group),
+                                prefetch_count, ack_tracker)
+                if self.checkpoint is not None:
+                    resume = self.checkpoint.min_timestamp(stream.name)
+                    if resume is not None:
+                        log.info('resuming %s from checkpoint %s'
+                                 % (stream.name, resume))
+                        stream.min_timestamp = resume
+                streams.append(stream)
+                stream.channel = rabbitmq.channel()
+                if self.raw:
+                    stream.consumer = kombu.Consumer(
+                        stream.channel,
+                        on_message=partial(self.handle_message, None,
+                                           stream=stream),
+                        no_ack=no_ack)
+                else:
+                    stream.consumer = kombu.Consumer(
+                        stream.channel,
+                        callbacks=[partial(self.handle_message,
+                                           stream=stream)],
+                        no_ack=no_ack)
+                if self.ack:
+                    stream.consumer.qos(prefetch_count=prefetch_count)
+
+                for q in group:
+                    exchange = kombu.Exchange(q.exchange,
+                                              type='topic',
+                                              durable=False)
+                    q = kombu.Queue(q.queue, exchange=exchange,
+                                    routing_key=q.routing_key,
+                                    durable=q.durable, no_ack=no_ack,
+                                    auto_delete=not q.durable)
+                    stream.consumer.add_queue(q)
+
+                stream.consumer.consume(no_ack=no_ack)
+        except Exception:
+            self.close_streams(streams)
+            raise
+        with self.streams_lock:
+            self.streams = self.streams + streams
+        return streams
+
+    def close_streams(self,
+                      streams,  # type: List[Stream]
+                      ):  # type: (...) -> None
+        """Flushes the pending work and closes the channels of `streams`.
+
+        While stopping, the received messages are first processed or
+        abandoned as requested by `stop` (on a hub, `stop` drains them
+        itself, not to hold up the connection thread).
+        """
+        stopping = self.stopping
+        if stopping is None or stopping[0]:
+            self.flush_coalescer()
+            self.flush_batch()
+        else:
+            self.abandon()
+        if stopping is not None and stopping[0] and self.hub is None:
+            self.drain(streams, stopping[1])
+        with self.streams_lock:
+            self.streams = [s for s in self.streams if s not in streams]
+        for stream in streams:
+            closers = []  # type: List[Callable[[], Any]]
+            if stream.ack_tracker is not None:
+                closers.append(stream.ack_tracker.flush)
+            if stream.consumer is not None:
+                closers.append(stream.consumer.cancel)
+            if stream.channel is not None:
+                closers.append(stream.channel.close)
+            for close in closers:
+                # the connection may be broken already
+                try:
+                    close()
+                except Exception as e:
+                    log.debug('error closing the connection: %s' % e)
+
+    def pause_streams(self,
+                      streams,  # type: List[Stream]
+                      ):  # type: (...) -> None
+        """Stops consuming `streams` and flushes the pending work.
+
+        The channels stay open to acknowledge the messages received.
+        """
+        for stream in streams:
+            if stream.consumer is None:
+                continue
+            try:
+                stream.consumer.cancel()
+            except Exception as e:
+                log.debug('error cancelling the consumer: %s' % e)
+        self.flush_coalescer()
+        self.flush_batch()
+
+    def drain(self,
+              streams,   # type: List[Stream]
+              deadline,  # type: Optional[float]
+              ):  # type: (...) -> None
+        """Waits for the messages of `streams` to be processed, until
+        `deadline`.
+
+        Does not acknowledge them: see `close_streams`.
+        """
+        for stream in streams:
+            ack_tracker = stream.ack_tracker
+            if ack_tracker is None:
+                continue
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0.0)
+            if not ack_tracker.wait(timeout):
+                log.warning('stop timed out, abandoning %d messages' %
+                            sum(s.ack_tracker.in_flight() for s in streams
+                                if s.ack_tracker is not None))
+                return
+
+    def abandon(self):  # type: () -> None
+        """Drops the notifications waiting in the coalescer, the batch
+        and the dispatcher queue.
+
+        Their messages are not acknowledged, with `ack=True` rabbitmq
+        delivers them again.
+        """
+        if self.coalescer is not None:
+            self.coalescer.flush()
+        if self.batcher is not None:
+            with self.batch_lock:
+                self.batcher.take()
+        discard = getattr(self.dispatcher, 'discard', None)
+        if discard is not None:
+            discard()
+
+    @property
+    def ack_tracker(self):  # type: () -> Optional[AckTracker]
+        """Acknowledgements of the first channel, None if not consuming."""
+        streams = self.streams
+        if not streams:
+            return None
+        return streams[0].ack_tracker
+
+    def in_flight(self):  # type: () -> int
+        """Number of received messages not acknowledged yet."""
+        return sum(s.ack_tracker.in_flight() for s in self.streams
+                   if s.ack_tracker is not None)
+
+    def connection_stats(self):  # type: () -> Dict[str, Any]
+        """Reconnections and seconds spent reconnecting."""
+        return {'connected': bool(self.streams),
+                'reconnects': self.reconnects,
+                'connection_errors': self.connection_errors,
+                'downtime': self.downtime}
+
+    def queue_stats(self):  # type: () -> Dict[str, Dict[str, int]]
+        """Received and unacknowledged messages, by channel.
+
+        The keys are the names of the queues consumed on each channel.
+        """
+        return dict((s.name, s.stats()) for s in self.streams)
 
     def alive(self):  # type: () -> bool
-        return self.thread is not None and self.thread.isAlive()
+        if self.hub is not None:
+            return bool(self.hub.alive(self))
+        return self.thread is not None and self.thread.is_alive()
+
+    def queue_depth(self):  # type: () -> int
+        """Number of notifications waiting for a dispatcher worker."""
+        return int(self.dispatcher.queue_depth())
+
+    def stop(self,
+             timeout=None,  # type: Optional[float]
+             drain=True,    # type: bool
+             ):  # type: (...) -> None
+        """Stops consuming and waits for the consumer threads.
 
-    def stop(self):  # type: () -> None
+        With `drain` the notifications already received are processed,
+        and acknowledged, before closing the channels, for at most
+        `timeout` seconds. Without `drain`, or after the timeout, the
+        notifications not processed yet are abandoned: the callbacks
+        already running complete, the others are not called and, with
+        `ack=True`, rabbitmq delivers their messages again.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self.stopping = (drain, deadline)
         self.quit_event.set()
-        if self.thread is not None and self.thread.isAlive():
+        if self.waker is not None:
+            self.waker.wake()
+        if not drain:
+            self.abandon()
+        if self.hub is not None:
+            if drain:
+                self.hub.pause(self)
+                with self.streams_lock:
+                    streams = list(self.streams)
+                self.drain(streams, deadline)
+            self.hub.detach(self)
+        if self.thread is not None and self.thread.is_alive():
             self.thread.join()
         self.thread = None
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - time.time(), 0.0)
+        if not drain or timeout == 0.0:
+            self.abandon()
+        self.dispatcher.stop(timeout)
+        if self.waker is not None:
+            self.waker.close()
+            self.waker = None
+        self.ready.clear()
+        if self.checkpoint is not None:
+            self.checkpoint.flush()
+        if self.recorder is not None:
+            self.recorder.flush()
         self.quit_event.clear()
@@ -0,0 +1,243 @@
+from threading import Lock, local
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import cProfile
+import logging
+import pstats
+import time
+
+try:
+    from StringIO import StringIO  # type: ignore
+except ImportError:
+    from io import StringIO
+
+log = logging.getLogger(__name__)
+
+clock = getattr(time, 'perf_counter', time.time)
+
+STAGES = ('receive', 'decode', 'unwrap', 'timestamp', 'filter', 'dispatch',
+          'callback')
+
+# hook(stages, event_type), stages maps a stage name to seconds
+Hook = Callable[[Dict[str, float], Optional[str]], None]
+
+
+class Profiler(object):
+    """Times the stages of the message handling.
+
+    The stages of a message are:
+
+    - `receive`: the time spent by kombu since the previous message of the
+      consumer thread (idle time included, meaningful under load);
+    - `decode`: the json decoding of a raw message (its oslo envelope
+      included) or the scan of a lazy one;
+    - `unwrap`: the decoding of the oslo envelope of a message decoded by
+      kombu;
+    - `timestamp`: the timestamp parsing;
+    - `filter`: the rest of the message handling (filters, handler lookup,
+      projection);
+    - `dispatch`: the delivery to the dispatcher (the whole callback with
+      the inline one);
+    - `callback`: the callback duration, reported by the dispatcher.
+
+    One message every `every` is timed and the `hooks` are called with
+    its stages and event type. Callbacks running more than
+    `slow_callback` seconds are logged. The notifier is instrumented
+    only when a profiler is set.
+    """
+
+    def __init__(self,
+                 hooks=(),            # type: Tuple[Hook, ...]
+                 every=1,             # type: int
+                 slow_callback=None,  # type: Optional[float]
+                 ):
+        if every < 1:
+            raise ValueError('every must be >= 1')
+        self.hooks = list(hooks)  # type: List[Hook]
+        self.every = every
+        self.slow_callback = slow_callback
+        self.lock = Lock()
+        self.local = local()
+        self.totals = {}  # type: Dict[str, List[float]]
+        self.slow = 0
+        self.callbacks = 0
+        self.trigger = None  # type: Optional[Tuple[int, Optional[str]]]
+
+    def add_hook(self,
+                 hook,  # type: Hook
+                 ):  # type: (...) -> None
+        self.hooks.append(hook)
+
+    def timed(self,
+              stage,     # type: str
+              function,  # type: Callable[..., Any]
+              ):  # type: (...) -> Callable[..., Any]
+        """Returns `function` timed as `stage` in the sampled messages."""
+        state = self.local
+
+        def timed_function(*args, **kwargs):  # type: (*Any, **Any) -> Any
+            stages = getattr(state, 'stages', None)
+            if stages is None:
+                return function(*args, **kwargs)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stages[stage] = stages.get(stage, 0.0) + clock() - start
+
+        return timed_function
+
+    def timed_message(self,
+                      handle_message,  # type: Callable[..., None]
+                      ):  # type: (...) -> Callable[..., None]
+        """Returns `handle_message` timing every `every` message."""
+        state = self.local
+
+        def timed_handle_message(body,         # type: Any
+                                 message,      # type: Any
+                                 stream=None,  # type: Any
+                                 ):  # type: (...) -> None
+            if self.trigger is not None:
+                self.start_profile()
+            count = getattr(state, 'count', 0) + 1
+            state.count = count
+            if count % self.every:
+                handle_message(body, message, stream=stream)
+                state.last = clock()
+                self.profiled()
+                return
+            stages = {}  # type: Dict[str, float]
+            state.stages = stages
+            state.event_type = None
+            start = clock()
+            try:
+                handle_message(body, message, stream=stream)
+            finally:
+                end = clock()
+                state.stages = None
+                last, state.last = getattr(state, 'last', None), end
+                stages['filter'] = max(0.0, end - start - sum(
+                    stages.values()))
+                if last is not None:
+                    stages['receive'] = start - last
+                self.record(stages, state.event_type)
+                self.profiled()
+
+        return timed_handle_message
+
+    def timed_deliver(self,
+                      deliver,  # type: Callable[..., None]
+                      ):  # type: (...) -> Callable[..., None]
+        """Returns `deliver` timed as the dispatch stage."""
+        state = self.local
+        timed_deliver = self.timed('dispatch', deliver)
+
+        def deliver_data(data,      # type: Any
+                         *args      # type: Any
+                         ):  # type: (...) -> None
+            if getattr(state, 'stages', None) is not None:
+                state.event_type = data.event_type
+            timed_deliver(data, *args)
+
+        return deliver_data
+
+    def record(self,
+               stages,      # type: Dict[str, float]
+               event_type,  # type: Optional[str]
+               ):  # type: (...) -> None
+        with self.lock:
+            for stage, seconds in stages.items():
+                total = self.totals.get(stage)
+                if total is None:
+                    # count, seconds, max
+                    total = self.totals[stage] = [0, 0.0, 0.0]
+                total[0] += 1
+                total[1] += seconds
+                total[2] = max(total[2], seconds)
+        for hook in self.hooks:
+            try:
+                hook(stages, event_type)
+            except Exception:
+                log.exception('Error in profiling hook %s' % hook)
+
+    def callback_finished(self,
+                          data,     # type: Any
+                          seconds,  # type: float
+                          ok,       # type: bool
+                          ):  # type: (...) -> None
+        """Dispatcher observer warning about the slow callbacks.
+
+        The duration of one callback every `every` is recorded.
+        """
+        self.callbacks += 1
+        slow = self.slow_callback is not None and seconds > self.slow_callback
+        if not slow and self.callbacks % self.every:
+            return
+        if isinstance(data, list):
+            event_type = 'batch of %d' % len(data)
+        else:
+            event_type = data.event_type
+        if slow:
+            self.slow += 1
+            log.warning('slow callback for %s: %.3f seconds'
+                        % (event_type, seconds))
+        self.record({'callback': seconds}, event_type)
+
+    def stats(self):  # type: () -> Dict[str, Dict[str, float]]
+        """Count, total and maximum seconds of every stage."""
+        with self.lock:
+            return dict((stage, {'count': int(total[0]),
+                                 'seconds': total[1],
+                                 'max': total[2]})
+                        for stage, total in self.totals.items())
+
+    def profile(self,
+                messages=1000,  # type: int
+                path=None,      # type: Optional[str]
+                ):  # type: (...) -> None
+        """Runs cProfile on a consumer thread for the next `messages`.
+
+        The stats are written to `path`, in the `pstats` format, or logged.
+        """
+        self.trigger = (messages, path)
+
+    def start_profile(self):  # type: () -> None
+        with self.lock:
+            trigger, self.trigger = self.trigger, None
+        if trigger is None or getattr(self.local, 'profile', None):
+            return
+        self.local.left, self.local.path = trigger
+        self.local.profile = cProfile.Profile()
+        self.local.profile.enable()
+
+    def profiled(self):  # type: () -> None
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            return
+        self.local.left -= 1
+        if self.local.left > 0:
+            return
+        profile.disable()
+        self.local.profile = None
+        if self.local.path is not None:
+            profile.dump_stats(self.local.path)
+            return
+        out = StringIO()
+        pstats.Stats(profile, stream=out).sort_stats(
+            'cumulative').print_stats(30)
+        log.info('profile of the notifier thread:\n%s' % out.getvalue())
+
+
+def metrics_hook(metrics,  # type: Any
+                 ):  # type: (...) -> Hook
+    """Returns a hook recording the stages in `<stage>_seconds` histograms
+    of a `Metrics`."""
+
+    def hook(stages,      # type: Dict[str, float]
+             event_type,  # type: Optional[str]
+             ):  # type: (...) -> None
+        for stage, seconds in stages.items():
+            if stage != 'callback':
+                # already recorded as callback_seconds
+                metrics.observe('%s_seconds' % stage, seconds)
+
+    return hook
@@ -0,0 +1,74 @@
+from typing import Any, Dict, List, Optional
+
+Tree = Dict[str, Any]
+
+
+def _add_path(tree,  # type: Tree
+              path,  # type: List[str]
+              ):  # type: (...) -> None
+    key = path[0]
+    if len(path) == 1 or (key in tree and tree[key] is None):
+        # the whole value is kept
+        tree[key] = None
+        return
+    _add_path(tree.setdefault(key, {}), path[1:])
+
+
+def _project(tree,   # type: Tree
+             value,  # type: Any
+             ):  # type: (...) -> Any
+    if isinstance(value, list):
+        return [_project(tree, item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    for key, subtree in tree.items():
+        if key in value:
+            if subtree is None:
+                result[key] = value[key]
+            else:
+                result[key] = _project(subtree, value[key])
+    return result
+
+
+class Projection(object):
+    """Keeps only some fields of a payload.
+
+    `paths` are dotted field names like `port.fixed_ips.ip_address`; a
+    path going through a list applies to each of its items. The missing
+    fields are left out.
+    """
+    __slots__ = ('paths', 'tree')
+
+    def __init__(self,
+                 paths,  # type: List[str]
+                 ):
+        self.paths = tuple(paths)
+        self.tree = {}  # type: Tree
+        for path in self.paths:
+            _add_path(self.tree, path.split('.'))
+
+    def __call__(self,
+                 payload,  # type: Dict[str, Any]
+                 ):  # type: (...) -> Dict[str, Any]
+        return _project(self.tree, payload)  # type: ignore
+
+    def __getstate__(self):  # type: () -> Any
+        return self.paths
+
+    def __setstate__(self, paths):  # type: (Any) -> None
+        self.__init__(paths)  # type: ignore
+
+    def __repr__(self):  # type: () -> str
+        return '<Projection(%s)>' % ', '.join(self.paths)
+
+
+def merge(projections,  # type: List[Projection]
+          ):  # type: (...) -> Optional[Projection]
+    """Returns a projection keeping the fields of all `projections`."""
+    if not projections:
+        return None
+    if len(projections) == 1:
+        return projections[0]
+    return Projection([p for projection in projections
+                       for p in projection.paths])
@@ -0,0 +1,27 @@
+import random
+
+
+def backoff_delay(failures,       # type: int
+                  base=0.5,       # type: float
+                  maximum=30.0,   # type: float
+                  ):  # type: (...) -> float
+    """Seconds to wait after `failures` consecutive connection failures.
+
+    Exponential backoff with jitter: a random delay between half and the
+    whole of `base * 2 ** (failures - 1)`, capped at `maximum`.
+    """
+    delay = min(maximum, base * 2.0 ** min(failures - 1, 30))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def rotate_urls(url,     # type: str
+                offset,  # type: int
+                ):  # type: (...) -> str
+    """Rotates a `;` separated list of broker urls by `offset`.
+
+    kombu tries the alternates in order, starting from the first one, so
+    every reconnection starts from the next broker.
+    """
+    urls = url.split(';')
+    offset = offset % len(urls)
+    return ';'.join(urls[offset:] + urls[:offset])
@@ -0,0 +1,230 @@
+"""Recording of the raw notifications to files, and their replay.
+
+A recording file starts with `MAGIC` followed by blocks, each one a 4
+bytes (big endian) length and a zlib compressed sequence of frames. A
+frame is the receive time (8 bytes double), the body length (4 bytes) and
+the json body of a message.
+"""
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'ONREC1\n'
+BLOCK = struct.Struct('>I')
+FRAME = struct.Struct('>dI')
+
+
+class Recorder(object):
+    """Appends the received messages to `<path>.<n>` recording files.
+
+    The frames are compressed in blocks of about `block_size` bytes,
+    written at least every `flush_interval` seconds; a new file is started
+    once the current one reaches `max_bytes`. The existing files are never
+    overwritten.
+    """
+
+    def __init__(self,
+                 path,                    # type: str
+                 max_bytes=256 * 1024 * 1024,  # type: int
+                 block_size=256 * 1024,   # type: int
+                 flush_interval=1.0,      # type: float
+                 level=6,                 # type: int
+                 ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.level = level
+        self.lock = Lock()
+        self.frames = []  # type: List[bytes]
+        self.buffered = 0
+        self.last_flush = time.time()
+        self.index = 0
+        self.file = None  # type: Any
+        self.written = 0
+        self.recorded = 0
+
+    def file_name(self, index):  # type: (int) -> str
+        return '%s.%06d' % (self.path, index)
+
+    def open(self):  # type: () -> None
+        while os.path.exists(self.file_name(self.index)):
+            self.index += 1
+        self.file = open(self.file_name(self.index), 'wb')
+        self.file.write(MAGIC)
+        self.written = len(MAGIC)
+
+    def record(self,
+               body,            # type: bytes
+               timestamp=None,  # type: Optional[float]
+               ):  # type: (...) -> None
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.frames.append(FRAME.pack(timestamp, len(body)))
+            self.frames.append(body)
+            self.buffered += FRAME.size + len(body)
+            self.recorded += 1
+            if self.buffered >= self.block_size \
+                    or time.time() - self.last_flush >= self.flush_interval:
+                self.write_block()
+
+    def record_message(self,
+                       message,  # type: Any
+                       ):  # type: (...) -> None
+        """Records a kombu message, as json."""
+        if message.content_type == 'application/json' \
+                and not message.headers.get('compression'):
+            body = message.body
+        else:
+            body = json.dumps(message.decode())
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.record(body)
+
+    def due(self):  # type: () -> bool
+        return self.buffered > 0 \
+            and time.time() - self.last_flush >= self.flush_interval
+
+    def write_block(self):  # type: () -> None
+        self.last_flush = time.time()
+        if not self.frames:
+            return
+        if self.file is None:
+            self.open()
+        block = zlib.compress(b''.join(self.frames), self.level)
+        self.frames = []
+        self.buffered = 0
+        self.file.write(BLOCK.pack(len(block)))
+        self.file.write(block)
+        self.file.flush()
+        self.written += BLOCK.size + len(block)
+        if self.written >= self.max_bytes:
+            self.file.close()
+            self.file = None
+
+    def flush(self):  # type: () -> None
+        with self.lock:
+            self.write_block()
+
+    def close(self):  # type: () -> None
+        with self.lock:
+            self.write_block()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_frames(path,  # type: str
+                ):  # type: (...) -> Iterator[Tuple[float, bytes]]
+    """Yields the (receive time, body) frames of a recording file.
+
+    The file is memory mapped and decompressed one block at a time, so the
+    memory used does not depend on the file size.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < len(MAGIC):
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError('%s is not a recording' % path)
+            offset = len(MAGIC)
+            size = len(data)
+            while offset + BLOCK.size <= size:
+                length, = BLOCK.unpack_from(data, offset)
+                offset += BLOCK.size
+                if offset + length > size:
+                    log.warning('%s: truncated block at %d'
+                                % (path, offset))
+                    return
+                block = zlib.decompress(data[offset:offset + length])
+                offset += length
+                position = 0
+                while position < len(block):
+                    timestamp, body_length = FRAME.unpack_from(block,
+                                                               position)
+                    position += FRAME.size
+                    yield timestamp, block[position:position + body_length]
+                    position += body_length
+        finally:
+            data.close()
+
+
+class RecordedMessage(object):
+    """A recorded message, with the attributes of a kombu message."""
+    content_type = 'application/json'
+    content_encoding = 'utf-8'
+    headers = {}  # type: Dict[str, Any]
+    delivery_info = {}  # type: Dict[str, Any]
+
+    def __init__(self, body):  # type: (bytes) -> None
+        self.body = body
+
+    def decode(self):  # type: () -> Any
+        return json.loads(self.body.decode('utf-8'))
+
+    def ack(self, multiple=False):  # type: (bool) -> None
+        pass
+
+    def requeue(self):  # type: () -> None
+        pass
+
+    def reject(self, requeue=False):  # type: (bool) -> None
+        pass
+
+
+def replay(paths,       # type: List[str]
+           notifier,    # type: Any
+           speed=None,  # type: Optional[float]
+           ):  # type: (...) -> int
+    """Feeds the recorded messages to a notifier, without a broker.
+
+    The messages go through `notifier.rabbitmq_message` with `raw=True`,
+    `notifier.rabbitmq_callback` otherwise. With `speed` the original pace,
+    multiplied by `speed`, is kept; by default they are replayed as fast as
+    possible. The dispatcher of the notifier is started, and stopped once
+    the callbacks have run, unless the notifier is consuming. Returns the
+    number of replayed messages.
+    """
+    count = 0
+    first = None  # type: Optional[float]
+    # the dispatcher of a notifier that is not consuming is not running
+    running = notifier.alive()
+    if not running:
+        notifier.dispatcher.start()
+    try:
+        start = time.time()
+        for path in paths:
+            for timestamp, body in read_frames(path):
+                if speed is not None:
+                    if first is None:
+                        first = timestamp
+                    delay = (timestamp - first) / speed \
+                        - (time.time() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                message = RecordedMessage(body)
+                if notifier.raw:
+                    notifier.rabbitmq_message(message)
+                else:
+                    notifier.rabbitmq_callback(message.decode(), message)
+                count += 1
+                if count % 1000 == 0:
+                    # flushes the batches and the coalesced notifications
+                    notifier.housekeeping()
+        notifier.flush_coalescer()
+        notifier.flush_batch()
+    finally:
+        if not running:
+            # runs the queued callbacks
+            notifier.dispatcher.stop()
+    return count
@@ -0,0 +1,347 @@
+from threading import Thread, Event, Lock
+from typing import Any, Callable, Dict, Hashable, List, Optional
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from openstack_notifier.codec import decode_body, scan_resource_key
+from openstack_notifier.dispatch import resource_key
+from openstack_notifier.notifier import OpenstackNotifier, QueueConfig
+from openstack_notifier.notifier import CallbackData, Stream
+from openstack_notifier.notifier import default_queue_configs
+from openstack_notifier.recording import RecordedMessage
+
+log = logging.getLogger(__name__)
+
+# the keyword arguments of the router notifier, the other ones go to the
+# notifiers of the shards
+ROUTER_ARGS = ('channel_per_queue', 'thread_per_queue', 'reconnect',
+               'reconnect_delay', 'max_reconnect_delay', 'heartbeat',
+               'recorder')
+
+
+def jump_hash(key,      # type: int
+              buckets,  # type: int
+              ):  # type: (...) -> int
+    """Jump consistent hash of a 64 bit key (Lamping, Veach 2014)."""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def shard_of(key,     # type: Hashable
+             shards,  # type: int
+             ):  # type: (...) -> int
+    """Returns the shard of a key, the same in every process."""
+    if key is None:
+        return 0
+    digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+    return jump_hash(int(digest[:16], 16), shards)
+
+
+def message_body(message,  # type: Any
+                 ):  # type: (...) -> bytes
+    """The json body of a kombu message."""
+    if message.content_type == 'application/json' \
+            and not message.headers.get('compression'):
+        body = message.body
+    else:
+        body = json.dumps(message.decode())
+    if isinstance(body, bytes):
+        return body
+    return str(body).encode('utf-8')
+
+
+class ShardRouter(OpenstackNotifier):
+    """Consumes the queues and forwards the raw notifications to the
+    shards.
+
+    With the default `key_func` the key of a notification is scanned from
+    its raw body (see `scan_resource_key`): it is decoded only when that
+    fails, or with another `key_func`. The bodies are sent to the `pipes`
+    of the shards in batches of `max_batch_size`, or every
+    `max_batch_latency` seconds. The shards do not report back the
+    notifications they handled, so `ack=True` is not supported: the
+    messages sent to a shard that dies would be lost once acknowledged.
+    """
+
+    def __init__(self,
+                 url,                     # type: str
+                 shards,                  # type: int
+                 key_func=resource_key,   # type: Callable[[Any], Any]
+                 max_batch_size=100,      # type: int
+                 max_batch_latency=0.01,  # type: float
+                 **kwargs                 # type: Any
+                 ):
+        if kwargs.get('ack'):
+            raise ValueError('ack is not supported by the shard router')
+        super(ShardRouter, self).__init__(url, raw=True, **kwargs)
+        self.shards = shards
+        self.key_func = key_func
+        self.max_batch_size = max_batch_size
+        self.max_batch_latency = max_batch_latency
+        self.pipes = [None] * shards  # type: List[Any]
+        # shard -> bodies of the messages not sent yet
+        self.buffers = [[] for _ in range(shards)]  # type: List[List[Any]]
+        self.buffer_lock = Lock()
+        self.last_send = time.time()
+        self.routed = [0] * shards
+        self.decoded = 0
+
+    def shard_key(self,
+                  body,  # type: bytes
+                  ):  # type: (...) -> Any
+        if self.key_func is resource_key:
+            key = scan_resource_key(body)
+            if key is not None:
+                return key
+        self.decoded += 1
+        decoded = decode_body(body, self.loads)
+        event_type = decoded.get('event_type')
+        if event_type is None:
+            return None
+        return self.key_func(CallbackData(event_type,
+                                          decoded.get('payload', {})))
+
+    def handle_message(self,
+                       body,         # type: Optional[Dict[str, Any]]
+                       message,      # type: Any
+                       stream=None,  # type: Optional[Stream]
+                       ):  # type: (...) -> None
+        if stream is not None:
+            stream.received += 1
+        try:
+            if self.recorder is not None:
+                self.recorder.record_message(message)
+            raw = message_body(message)
+            index = shard_of(self.shard_key(raw), self.shards)
+            with self.buffer_lock:
+                buffer = self.buffers[index]
+                buffer.append(raw)
+                if len(buffer) >= self.max_batch_size:
+                    self.send(index)
+        except Exception:
+            log.exception('Error while routing message %s'
+                          % getattr(message, 'body', None))
+
+    def send(self,
+             index,  # type: int
+             ):  # type: (...) -> None
+        """Sends the buffer of a shard, called with `buffer_lock` held."""
+        buffer, self.buffers[index] = self.buffers[index], []
+        if not buffer:
+            return
+        try:
+            self.pipes[index].send(buffer)
+            self.routed[index] += len(buffer)
+        except (AttributeError, IOError, OSError) as e:
+            log.warning('shard %d unavailable, %d messages lost: %s'
+                        % (index, len(buffer), e))
+
+    def flush_batch(self):  # type: () -> None
+        super(ShardRouter, self).flush_batch()
+        with self.buffer_lock:
+            for index in range(self.shards):
+                self.send(index)
+            self.last_send = time.time()
+
+    def housekeeping(self,
+                     streams=None,  # type: Optional[List[Stream]]
+                     ):  # type: (...) -> float
+        timeout = self.max_batch_latency - (time.time() - self.last_send)
+        if timeout <= 0:
+            self.flush_batch()
+            timeout = self.max_batch_latency
+        return min(timeout,
+                   super(ShardRouter, self).housekeeping(streams))
+
+    def abandon(self):  # type: () -> None
+        super(ShardRouter, self).abandon()
+        with self.buffer_lock:
+            self.buffers = [[] for _ in range(self.shards)]
+
+    def set_pipe(self,
+                 index,  # type: int
+                 pipe,   # type: Any
+                 ):  # type: (...) -> Any
+        """Replaces the pipe of a shard, returns the previous one."""
+        with self.buffer_lock:
+            previous, self.pipes[index] = self.pipes[index], pipe
+        return previous
+
+
+def _run_shard(url,       # type: str
+               callback,  # type: Any
+               index,     # type: int
+               pipe,      # type: Any
+               parent,    # type: int
+               kwargs,    # type: Any
+               ):  # type: (...) -> None
+    """Handles the notifications sent by the router on `pipe`.
+
+    Stops when the router sends None, or when the parent process exits.
+    """
+    notifier = OpenstackNotifier(url, callback=callback, **kwargs)
+    notifier.dispatcher.start()
+    try:
+        while True:
+            if not pipe.poll(min(notifier.housekeeping(), 0.5)):
+                if os.getppid() != parent:
+                    log.error('shard %d lost its parent' % index)
+                    break
+                continue
+            bodies = pipe.recv()
+            if bodies is None:
+                break
+            for body in bodies:
+                notifier.rabbitmq_message(RecordedMessage(body))
+    except EOFError:
+        log.error('shard %d lost the router' % index)
+    finally:
+        notifier.flush_coalescer()
+        notifier.flush_batch()
+        notifier.stop()
+
+
+class ShardedOpenstackNotifier(object):
+    """Handles the notifications in `shards` processes.
+
+    A `ShardRouter` consumes the queues in the parent process and sends
+    every notification, still raw, to the process its `key_func(data)` (by
+    default the resource type and id) hashes to, so the notifications of a
+    resource are always handled, in order, by the same process. The
+    notifications without a key go to the first shard. Each process
+    decodes and handles only its own notifications, with an
+    `OpenstackNotifier` fed by the router. Dead processes are restarted
+    every `restart_interval` seconds.
+
+    The connection keyword arguments (`ROUTER_ARGS`) configure the router,
+    the other ones the notifiers of the shards: they, and `callback`, must
+    be picklable when multiprocessing does not use fork. The `recorder`
+    records the messages consumed by the router. `ack=True` is not
+    supported (see `ShardRouter`), nor is a `checkpoint`: the router does
+    not know which notifications were processed.
+    """
+
+    def __init__(self,
+                 url,                   # type: str
+                 callback=None,         # type: Any
+                 shards=None,           # type: Optional[int]
+                 queue_configs=None,    # type: Optional[List[QueueConfig]]
+                 key_func=resource_key,  # type: Callable[[Any], Any]
+                 restart_interval=1.0,  # type: float
+                 **kwargs               # type: Any
+                 ):
+        if shards is None:
+            shards = multiprocessing.cpu_count()
+        if shards < 1:
+            raise ValueError('shards must be >= 1')
+        if kwargs.get('ack'):
+            raise ValueError('ack is not supported with shards')
+        if kwargs.get('checkpoint') is not None:
+            raise ValueError('checkpoint is not supported with shards')
+        self.url = url
+        self.callback = callback
+        self.shards = shards
+        if queue_configs is None:
+            queue_configs = default_queue_configs()
+        self.queue_configs = queue_configs
+        self.key_func = key_func
+        self.restart_interval = restart_interval
+        router_kwargs = dict((name, kwargs.pop(name)) for name in ROUTER_ARGS
+                             if name in kwargs)
+        self.kwargs = kwargs
+        self.router = ShardRouter(url, shards, key_func,
+                                  queue_configs=queue_configs,
+                                  **router_kwargs)
+        self.processes = [None] * shards  # type: List[Any]
+        self.restarts = 0
+        self.quit_event = Event()
+        self.thread = None  # type: Optional[Thread]
+
+    def spawn(self, index):  # type: (int) -> None
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_run_shard,
+            name='openstack_notifier-shard%d' % index,
+            args=(self.url, self.callback, index, reader, os.getpid(),
+                  self.kwargs))
+        process.daemon = True
+        process.start()
+        reader.close()
+        self.processes[index] = process
+        previous = self.router.set_pipe(index, writer)
+        if previous is not None:
+            previous.close()
+
+    def supervise(self):  # type: () -> None
+        while not self.quit_event.wait(self.restart_interval):
+            for index, process in enumerate(self.processes):
+                if process.is_alive() or self.quit_event.is_set():
+                    continue
+                log.warning('restarting shard %d (exit code %s)'
+                            % (index, process.exitcode))
+                self.restarts += 1
+                self.spawn(index)
+
+    def start(self):  # type: () -> None
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.quit_event.clear()
+        for index in range(self.shards):
+            self.spawn(index)
+        self.router.start()
+        self.thread = Thread(target=self.supervise)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wait_ready(self,
+                   timeout=None,  # type: Optional[float]
+                   ):  # type: (...) -> bool
+        """Waits until the router consumes all the queues."""
+        return self.router.wait_ready(timeout)
+
+    def alive(self):  # type: () -> bool
+        """True if the router and every shard are running."""
+        return self.router.alive() and self.alive_shards() == self.shards
+
+    def alive_shards(self):  # type: () -> int
+        return sum(1 for p in self.processes
+                   if p is not None and p.is_alive())
+
+    def stop(self,
+             timeout=10.0,  # type: float
+             ):  # type: (...) -> None
+        """Stops the router, then the shards once they have handled the
+        notifications sent to them."""
+        self.quit_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = None
+        self.router.stop(timeout)
+        pipes = [self.router.set_pipe(index, None)
+                 for index in range(self.shards)]
+        for pipe in pipes:
+            try:
+                if pipe is not None:
+                    pipe.send(None)
+            except (IOError, OSError):
+                pass  # the shard died
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                log.warning('terminating %s' % process.name)
+                process.terminate()
+                process.join()
+        for pipe in pipes:
+            if pipe is not None:
+                pipe.close()
+        self.processes = [None] * self.shards
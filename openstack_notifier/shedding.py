@@ -0,0 +1,130 @@
+from threading import Lock
+from typing import Dict, Optional, Tuple
+import time
+
+from openstack_notifier.subscriptions import PatternIndex
+
+
+class TokenBucket(object):
+    """Allows `rate` events per second, with bursts up to `burst`."""
+
+    def __init__(self,
+                 rate,        # type: float
+                 burst=None,  # type: Optional[float]
+                 ):
+        self.rate = rate
+        self.burst = max(1.0, rate) if burst is None else burst
+        self.tokens = self.burst
+        self.last = None  # type: Optional[float]
+
+    def take(self,
+             now,  # type: float
+             ):  # type: (...) -> bool
+        if self.last is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def refund(self):  # type: () -> None
+        """Gives back the token of an event rejected by another rule."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class _Sample(object):
+    """Keeps `ratio` of the events, evenly spaced."""
+
+    def __init__(self, ratio):  # type: (float) -> None
+        self.ratio = ratio
+        self.credit = 0.0
+
+    def take(self, now):  # type: (float) -> bool
+        self.credit += self.ratio
+        if self.credit < 1:
+            return False
+        self.credit -= 1
+        return True
+
+    def refund(self):  # type: () -> None
+        """The events are counted by the sample, kept or not."""
+
+
+class LoadShedder(object):
+    """Drops notifications during storms, before they reach the callbacks.
+
+    A notification is shed when a rate limit (`limit`) or a sampling rule
+    (`sample`) matching its event_type rejects it, or when it is older
+    than `max_lag` seconds. A notification shed by one rule does not use
+    up the tokens of the other rate limits. The notifications matching the
+    `keep` patterns are never shed. `stats` counts the shed notifications
+    by reason and event_type.
+    """
+
+    def __init__(self,
+                 max_lag=None,  # type: Optional[float]
+                 keep=(),       # type: Tuple[str, ...]
+                 ):
+        self.max_lag = max_lag
+        self.keep = PatternIndex()
+        for pattern in keep:
+            self.keep.add(pattern, True)
+        self.rules = PatternIndex()
+        self.lock = Lock()
+        self.counts = {}  # type: Dict[Tuple[str, str], int]
+
+    def limit(self,
+              pattern,     # type: str
+              rate,        # type: float
+              burst=None,  # type: Optional[float]
+              ):  # type: (...) -> None
+        """Limits the notifications matching `pattern` to `rate` per
+        second, with bursts of `burst`."""
+        self.rules.add(pattern, ('rate', TokenBucket(rate, burst)))
+
+    def sample(self,
+               pattern,  # type: str
+               ratio,    # type: float
+               ):  # type: (...) -> None
+        """Keeps `ratio` (0 to 1) of the notifications matching `pattern`."""
+        self.rules.add(pattern, ('sample', _Sample(ratio)))
+
+    def shed(self,
+             event_type,  # type: str
+             timestamp,   # type: float
+             now=None,    # type: Optional[float]
+             ):  # type: (...) -> Optional[str]
+        """Returns why the notification is shed, None to keep it."""
+        if self.keep.match(event_type):
+            return None
+        if now is None:
+            now = time.time()
+        reason = None
+        if self.max_lag is not None and now - timestamp > self.max_lag:
+            reason = 'lag'
+        else:
+            rules = self.rules.match(event_type)
+            if rules:
+                with self.lock:
+                    for index, (name, rule) in enumerate(rules):
+                        if not rule.take(now):
+                            reason = name
+                            for _, taken in rules[:index]:
+                                taken.refund()
+                            break
+        if reason is not None:
+            key = (reason, event_type)
+            with self.lock:
+                self.counts[key] = self.counts.get(key, 0) + 1
+        return reason
+
+    def stats(self):  # type: () -> Dict[str, Dict[str, int]]
+        """`{reason: {event_type: shed notifications}}`."""
+        with self.lock:
+            counts = dict(self.counts)
+        stats = {}  # type: Dict[str, Dict[str, int]]
+        for (reason, event_type), n in counts.items():
+            stats.setdefault(reason, {})[event_type] = n
+        return stats
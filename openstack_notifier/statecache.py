@@ -0,0 +1,230 @@
+from threading import RLock
+from typing import Any, Dict, List, Optional, Set
+import json
+import os
+
+RESOURCES = ('network', 'subnet', 'port', 'router', 'security_group')
+
+Resource = Dict[str, Any]
+
+
+def _index_add(index,  # type: Dict[Any, Set[str]]
+               key,    # type: Any
+               value,  # type: str
+               ):  # type: (...) -> None
+    if key is not None:
+        index.setdefault(key, set()).add(value)
+
+
+def _index_remove(index,  # type: Dict[Any, Set[str]]
+                  key,    # type: Any
+                  value,  # type: str
+                  ):  # type: (...) -> None
+    values = index.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del index[key]
+
+
+def _port_ips(port,  # type: Resource
+              ):  # type: (...) -> List[str]
+    return [ip['ip_address'] for ip in port.get('fixed_ips') or []
+            if 'ip_address' in ip]
+
+
+class ResourceCache(object):
+    """In-memory copy of the neutron resources, kept by notifications.
+
+    The `*.create.end`, `*.update.end` and `*.delete.end` notifications
+    of networks, subnets, ports, routers and security groups are applied
+    by `apply` (the cache can be used as a callback, or registered with
+    `subscribe`). Updates older than the cached resource, by its
+    `revision_number`, are ignored. The resources are stored, and the
+    queries (dict lookups under a lock) return, shallow copies.
+    """
+
+    def __init__(self):  # type: () -> None
+        self.lock = RLock()
+        self.clear()
+
+    def clear(self):  # type: () -> None
+        self.resources = {}  # type: Dict[str, Dict[str, Resource]]
+        for resource in RESOURCES:
+            self.resources[resource] = {}
+        self.ports_by_network = {}  # type: Dict[str, Set[str]]
+        self.ports_by_device = {}  # type: Dict[str, Set[str]]
+        self.ports_by_ip = {}  # type: Dict[str, Set[str]]
+        self.subnets_by_network = {}  # type: Dict[str, Set[str]]
+        # timestamp of the newest applied notification
+        self.timestamp = None  # type: Optional[float]
+
+    def __call__(self, data):  # type: (Any) -> None
+        self.apply(data)
+
+    def subscribe(self, notifier):  # type: (Any) -> None
+        """Registers the cache as a handler of `notifier`."""
+        for resource in RESOURCES:
+            notifier.subscribe('%s.*.end' % resource, self.apply)
+
+    def apply(self, data):  # type: (Any) -> None
+        parts = data.event_type.split('.')
+        if len(parts) != 3 or parts[0] not in RESOURCES \
+                or parts[2] != 'end':
+            return
+        resource, action = parts[0], parts[1]
+        payload = data.payload
+        with self.lock:
+            if action in ('create', 'update'):
+                body = payload.get(resource)
+                bodies = [body] if isinstance(body, dict) \
+                    else payload.get(resource + 's') or []
+                for body in bodies:
+                    if 'id' in body:
+                        self.put(resource, body)
+            elif action == 'delete':
+                resource_id = payload.get(resource + '_id')
+                if resource_id is None \
+                        and isinstance(payload.get(resource), dict):
+                    resource_id = payload[resource].get('id')
+                if resource_id is not None:
+                    self.remove(resource, resource_id)
+            else:
+                return
+            if data.timestamp is not None and (
+                    self.timestamp is None or data.timestamp > self.timestamp):
+                self.timestamp = data.timestamp
+
+    def put(self,
+            resource,  # type: str
+            body,      # type: Resource
+            ):  # type: (...) -> None
+        body = dict(body)
+        with self.lock:
+            old = self.resources[resource].get(body['id'])
+            if old is not None:
+                if body.get('revision_number', 0) \
+                        < old.get('revision_number', 0):
+                    return
+                self.unindex(resource, old)
+            self.resources[resource][body['id']] = body
+            self.index(resource, body)
+
+    def remove(self,
+               resource,     # type: str
+               resource_id,  # type: str
+               ):  # type: (...) -> None
+        with self.lock:
+            old = self.resources[resource].pop(resource_id, None)
+            if old is not None:
+                self.unindex(resource, old)
+
+    def index(self,
+              resource,  # type: str
+              body,      # type: Resource
+              ):  # type: (...) -> None
+        if resource == 'port':
+            _index_add(self.ports_by_network, body.get('network_id'),
+                       body['id'])
+            _index_add(self.ports_by_device, body.get('device_id') or None,
+                       body['id'])
+            for ip in _port_ips(body):
+                _index_add(self.ports_by_ip, ip, body['id'])
+        elif resource == 'subnet':
+            _index_add(self.subnets_by_network, body.get('network_id'),
+                       body['id'])
+
+    def unindex(self,
+                resource,  # type: str
+                body,      # type: Resource
+                ):  # type: (...) -> None
+        if resource == 'port':
+            _index_remove(self.ports_by_network, body.get('network_id'),
+                          body['id'])
+            _index_remove(self.ports_by_device,
+                          body.get('device_id') or None, body['id'])
+            for ip in _port_ips(body):
+                _index_remove(self.ports_by_ip, ip, body['id'])
+        elif resource == 'subnet':
+            _index_remove(self.subnets_by_network, body.get('network_id'),
+                          body['id'])
+
+    def get(self,
+            resource,     # type: str
+            resource_id,  # type: str
+            ):  # type: (...) -> Optional[Resource]
+        with self.lock:
+            cached = self.resources[resource].get(resource_id)
+            return None if cached is None else dict(cached)
+
+    def _lookup(self,
+                resource,  # type: str
+                index,     # type: Dict[str, Set[str]]
+                key,       # type: str
+                ):  # type: (...) -> List[Resource]
+        with self.lock:
+            resources = self.resources[resource]
+            return [dict(resources[i]) for i in index.get(key, ())]
+
+    def network_ports(self, network_id):  # type: (str) -> List[Resource]
+        return self._lookup('port', self.ports_by_network, network_id)
+
+    def device_ports(self, device_id):  # type: (str) -> List[Resource]
+        return self._lookup('port', self.ports_by_device, device_id)
+
+    def ip_ports(self, ip_address):  # type: (str) -> List[Resource]
+        """The ports with `ip_address`, in any network."""
+        return self._lookup('port', self.ports_by_ip, ip_address)
+
+    def network_subnets(self, network_id):  # type: (str) -> List[Resource]
+        return self._lookup('subnet', self.subnets_by_network, network_id)
+
+    def port_network(self, port_id):  # type: (str) -> Optional[Resource]
+        with self.lock:
+            port = self.resources['port'].get(port_id)
+            network_id = None if port is None else port.get('network_id')
+            if network_id is None:
+                return None
+            network = self.resources['network'].get(network_id)
+            return None if network is None else dict(network)
+
+    def __len__(self):  # type: () -> int
+        with self.lock:
+            return sum(len(r) for r in self.resources.values())
+
+    def snapshot(self):  # type: () -> Dict[str, Any]
+        """Returns the cached resources, for `restore`."""
+        with self.lock:
+            return {'version': 1,
+                    'timestamp': self.timestamp,
+                    'resources': dict((r, list(v.values()))
+                                      for r, v in self.resources.items())}
+
+    def restore(self,
+                snapshot,  # type: Dict[str, Any]
+                ):  # type: (...) -> None
+        """Replaces the cached resources with a `snapshot`."""
+        if snapshot.get('version') != 1:
+            raise ValueError('unsupported snapshot version %s'
+                             % snapshot.get('version'))
+        with self.lock:
+            self.clear()
+            self.timestamp = snapshot.get('timestamp')
+            for resource, bodies in snapshot['resources'].items():
+                if resource not in self.resources:
+                    continue
+                for body in bodies:
+                    self.put(resource, body)
+
+    def save(self, path):  # type: (str) -> None
+        """Writes a snapshot to `path`, atomically."""
+        tmp = '%s.tmp' % path
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, path)
+
+    def load(self, path):  # type: (str) -> None
+        with open(path) as f:
+            self.restore(json.load(f))
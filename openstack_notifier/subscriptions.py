@@ -0,0 +1,93 @@
+from typing import Any, Dict, List, Tuple
+import fnmatch
+import re
+
+_CACHE_SIZE = 10000
+
+_EVENT_TYPE_RE = re.compile(r'\\?"event_type\\?"\s*:\s*\\?"([^"\\]*)')
+_EVENT_TYPE_BYTES_RE = re.compile(br'\\?"event_type\\?"\s*:\s*\\?"([^"\\]*)')
+
+
+def scan_event_types(raw,  # type: Any
+                     ):  # type: (...) -> List[str]
+    """Finds the event_type values in a raw json notification.
+
+    Works on oslo-wrapped notifications too, without decoding them. The
+    result may contain more than an item if the payload has an
+    `event_type` key too, or none if the body is not in the usual format.
+    """
+    if isinstance(raw, bytes):
+        return [e.decode('utf-8', 'replace')
+                for e in _EVENT_TYPE_BYTES_RE.findall(raw)]
+    return _EVENT_TYPE_RE.findall(raw)
+
+
+class PatternIndex(object):
+    """Maps event_type glob patterns (like `port.*.end`) to values.
+
+    Exact names are looked up in a dict, the patterns with wildcards are
+    grouped by their literal prefix and the result of `match` is cached
+    per event_type, so routing a notification is a dict lookup once the
+    event_type has been seen.
+    """
+
+    def __init__(self):  # type: () -> None
+        self.exact = {}  # type: Dict[str, List[Tuple[int, Any]]]
+        self.prefixes = {}  # type: Dict[str, List[Tuple[int, Any, Any]]]
+        self.prefix_lengths = []  # type: List[int]
+        self.cache = {}  # type: Dict[str, Tuple[Any, ...]]
+        self.count = 0
+
+    def __len__(self):  # type: () -> int
+        return self.count
+
+    def add(self,
+            pattern,  # type: str
+            value,    # type: Any
+            ):  # type: (...) -> None
+        wildcards = [i for i, c in enumerate(pattern) if c in '*?[']
+        if not wildcards:
+            self.exact.setdefault(pattern, []).append((self.count, value))
+        else:
+            prefix = pattern[:wildcards[0]]
+            regex = re.compile(fnmatch.translate(pattern))
+            self.prefixes.setdefault(prefix, []).append(
+                (self.count, regex, value))
+            self.prefix_lengths = sorted(set(len(p) for p in self.prefixes))
+        self.count += 1
+        self.cache = {}
+
+    def match(self,
+              event_type,  # type: str
+              ):  # type: (...) -> Tuple[Any, ...]
+        """Returns the values of the matching patterns, in insertion order.
+        """
+        values = self.cache.get(event_type)
+        if values is None:
+            values = self.compute(event_type)
+            if len(self.cache) >= _CACHE_SIZE:
+                self.cache = {}
+            self.cache[event_type] = values
+        return values
+
+    def compute(self,
+                event_type,  # type: str
+                ):  # type: (...) -> Tuple[Any, ...]
+        found = list(self.exact.get(event_type, []))
+        for length in self.prefix_lengths:
+            if length > len(event_type):
+                break
+            for n, regex, value in self.prefixes.get(event_type[:length], []):
+                if regex.match(event_type):
+                    found.append((n, value))
+        found.sort(key=lambda x: x[0])
+        return tuple(value for _, value in found)
+
+    def match_raw(self,
+                  raw,  # type: Any
+                  ):  # type: (...) -> bool
+        """False if the raw notification surely matches no pattern."""
+        event_types = scan_event_types(raw)
+        if not event_types:
+            return True
+        return any(self.match(e) for e in event_types)
@@ -0,0 +1,37 @@
+from typing import Dict
+import calendar
+
+_CACHE_SIZE = 4096
+
+_seconds_cache = {}  # type: Dict[str, int]
+
+
+def parse_timestamp(value,  # type: str
+                    ):  # type: (...) -> float
+    """Converts an oslo notification timestamp to an UTC epoch.
+
+    The timestamp has the `YYYY-MM-DD HH:MM:SS[.ffffff]` format, always
+    in UTC. The conversion of the whole seconds part is cached, since
+    notifications come in bursts sharing the same second.
+
+    Raises ValueError if the timestamp is not in this format.
+    """
+    prefix = value[:19]
+    seconds = _seconds_cache.get(prefix)
+    if seconds is None:
+        if len(prefix) != 19 or prefix[4] != '-' or prefix[7] != '-' \
+                or prefix[10] not in ' T' or prefix[13] != ':' \
+                or prefix[16] != ':':
+            raise ValueError('invalid timestamp: %r' % value)
+        seconds = calendar.timegm((int(prefix[0:4]), int(prefix[5:7]),
+                                   int(prefix[8:10]), int(prefix[11:13]),
+                                   int(prefix[14:16]), int(prefix[17:19]),
+                                   0, 0, 0))
+        if len(_seconds_cache) >= _CACHE_SIZE:
+            _seconds_cache.clear()
+        _seconds_cache[prefix] = seconds
+    if len(value) == 19:
+        return float(seconds)
+    if value[19] != '.' or not value[20:].isdigit():
+        raise ValueError('invalid timestamp: %r' % value)
+    return seconds + int(value[20:]) / (10.0 ** (len(value) - 20))
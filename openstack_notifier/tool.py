@@ -1,58 +1,171 @@
 from argparse import ArgumentParser, Namespace
 from .notifier import OpenstackNotifier, QueueConfig
 from .notifier import CallbackData
+from .checkpoint import Checkpoint
+from .recording import Recorder, replay
 from typing import List
+import glob
 import time
 import logging
 
 log = logging.getLogger(__name__)
 
 
-def parse_args(args):  # type: (List[str]) -> Namespace
-    parser = ArgumentParser()
-    parser.description = 'openstack notifications monitor'
+def add_queue_config_argument(parser):  # type: (ArgumentParser) -> None
     parser.add_argument('--queue_config', action='append', default=[],
                         help='ex: "--queue_config neutron:notifications.info:*'
                         '--queue_config nova:notifications.info:*"')
 
-    parser.add_argument('--min_timestamp', default=0)
-    parser.add_argument('--debug', action='store_true', default=False)
-    parser.add_argument('--rabbitmq_url', required=True)
-    parsed_args = parser.parse_args(args)
 
+def parse_queue_configs(parser,       # type: ArgumentParser
+                        parsed_args,  # type: Namespace
+                        durable=False,  # type: bool
+                        ):  # type: (...) -> None
     queue_configs = []
     for s in parsed_args.queue_config:
         parts = s.split(':')
-        queue_configs.append(QueueConfig(parts[0], parts[1], parts[2]))
+        try:
+            queue_configs.append(QueueConfig(parts[0], parts[1], parts[2],
+                                             durable=durable))
+        except ValueError as e:
+            parser.error(str(e))
     parsed_args.queue_config = queue_configs
 
+
+def parse_args(args):  # type: (List[str]) -> Namespace
+    parser = ArgumentParser()
+    parser.description = 'openstack notifications monitor'
+    add_queue_config_argument(parser)
+
+    parser.add_argument('--min_timestamp', default=0)
+    parser.add_argument('--debug', action='store_true', default=False)
+    parser.add_argument('--rabbitmq_url', required=True)
+    parser.add_argument('--durable', action='store_true', default=False,
+                        help='keep the queues, and their notifications, '
+                        'when stopped (needs named queues)')
+    parser.add_argument('--checkpoint', default=None,
+                        help='file holding the timestamp of the last '
+                        'processed notification')
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.durable and not parsed_args.queue_config:
+        parser.error('--durable needs named queues (--queue_config)')
+    parse_queue_configs(parser, parsed_args, durable=parsed_args.durable)
+
     return parsed_args
 
 
-def openstack_notifier_tool():  # type: () -> None
-    import sys
-    args = parse_args(sys.argv[1:])
+def parse_record_args(args):  # type: (List[str]) -> Namespace
+    parser = ArgumentParser(prog='openstack_notifier record')
+    parser.description = 'record the openstack notifications to files'
+    add_queue_config_argument(parser)
+    parser.add_argument('--debug', action='store_true', default=False)
+    parser.add_argument('--rabbitmq_url', required=True)
+    parser.add_argument('--output', required=True,
+                        help='recording files prefix, the files are named '
+                        '<output>.<n>')
+    parser.add_argument('--max_bytes', type=int, default=256 * 1024 * 1024,
+                        help='size of a recording file before rotation')
+    parsed_args = parser.parse_args(args)
+    parse_queue_configs(parser, parsed_args)
+    return parsed_args
+
+
+def parse_replay_args(args):  # type: (List[str]) -> Namespace
+    parser = ArgumentParser(prog='openstack_notifier replay')
+    parser.description = 'replay recorded openstack notifications'
+    parser.add_argument('--debug', action='store_true', default=False)
+    parser.add_argument('--speed', type=float, default=None,
+                        help='replay at the original pace multiplied by '
+                        'SPEED, by default as fast as possible')
+    parser.add_argument('--quiet', action='store_true', default=False,
+                        help='do not log the notifications')
+    parser.add_argument('path', nargs='+',
+                        help='recording files, or their prefix')
+    parsed_args = parser.parse_args(args)
+    paths = []
+    for path in parsed_args.path:
+        paths.extend(sorted(glob.glob('%s.[0-9]*' % path)) or [path])
+    parsed_args.path = paths
+    return parsed_args
+
 
-    if args.debug:
+def setup_logging(debug):  # type: (bool) -> None
+    if debug:
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
 
+
+def wait_for_interrupt():  # type: () -> None
+    while True:
+        try:
+            time.sleep(1)
+        except KeyboardInterrupt:
+            break
+
+
+def record_tool(args):  # type: (Namespace) -> None
+    recorder = Recorder(args.output, max_bytes=args.max_bytes)
+    notifier = OpenstackNotifier(
+        url=args.rabbitmq_url,
+        queue_configs=args.queue_config or None,
+        raw=True,
+        recorder=recorder)
+    log.info('start recording to %s' % args.output)
+    notifier.start()
+    wait_for_interrupt()
+    notifier.stop()
+    recorder.close()
+    log.info('recorded %d notifications' % recorder.recorded)
+
+
+def replay_tool(args):  # type: (Namespace) -> None
+    def callback(data):  # type: (CallbackData) -> None
+        if not args.quiet:
+            log.info('%s' % data)
+
+    notifier = OpenstackNotifier(url='', callback=callback, raw=True)
+    start = time.time()
+    count = replay(args.path, notifier, speed=args.speed)
+    elapsed = time.time() - start
+    log.info('replayed %d notifications in %.2f seconds (%.0f/s)'
+             % (count, elapsed, count / max(elapsed, 1e-9)))
+
+
+def openstack_notifier_tool():  # type: () -> None
+    import sys
+    argv = sys.argv[1:]
+    if argv and argv[0] == 'record':
+        record_args = parse_record_args(argv[1:])
+        setup_logging(record_args.debug)
+        record_tool(record_args)
+        return
+    if argv and argv[0] == 'replay':
+        replay_args = parse_replay_args(argv[1:])
+        setup_logging(replay_args.debug)
+        replay_tool(replay_args)
+        return
+    args = parse_args(argv)
+    setup_logging(args.debug)
+
     def callback(data):  # type: (CallbackData) -> None
         log.info('%s' % data)
 
+    checkpoint = None
+    if args.checkpoint is not None:
+        checkpoint = Checkpoint(args.checkpoint)
+
     notifier = OpenstackNotifier(
         url=args.rabbitmq_url,
         queue_configs=args.queue_config,
         min_timestamp=args.min_timestamp,
-        callback=callback)
+        callback=callback,
+        ack=args.durable,
+        checkpoint=checkpoint)
 
     log.info('start monitoring')
     notifier.start()
-    while True:
-        try:
-            time.sleep(1)
-        except KeyboardInterrupt:
-            break
+    wait_for_interrupt()
     log.info('stop monitoring')
     notifier.stop()
@@ -0,0 +1,71 @@
+from typing import Any, Optional
+import errno
+import select
+import socket
+
+
+class Waker(object):
+    """A socket made readable by `wake`, to interrupt a `select`.
+
+    It stays readable, waking up every thread selecting on it, until
+    `clear` is called.
+    """
+
+    def __init__(self):  # type: () -> None
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+
+    def fileno(self):  # type: () -> int
+        return self.reader.fileno()
+
+    def wake(self):  # type: () -> None
+        try:
+            self.writer.send(b'x')
+        except (IOError, OSError) as e:
+            # a full buffer is readable already
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def clear(self):  # type: () -> None
+        try:
+            while self.reader.recv(4096):
+                pass
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def close(self):  # type: () -> None
+        self.reader.close()
+        self.writer.close()
+
+
+def connection_socket(rabbitmq,  # type: Any
+                      ):  # type: (...) -> Optional[Any]
+    """Returns the socket of a py-amqp connection, None for the others.
+
+    The virtual transports (memory, redis, ...) have no socket to select
+    on.
+    """
+    if rabbitmq.transport.driver_type != 'amqp':
+        return None
+    return getattr(rabbitmq.connection, 'sock', None)
+
+
+def wait_readable(sock,    # type: Any
+                  waker,   # type: Optional[Waker]
+                  timeout,  # type: float
+                  ):  # type: (...) -> bool
+    """Waits for `sock` to be readable, or for `waker` to be woken up.
+
+    Returns True if `sock` is readable.
+    """
+    pending = getattr(sock, 'pending', None)
+    if pending is not None and pending():
+        # data already decrypted by the ssl layer
+        return True
+    if waker is None:
+        readable = select.select([sock], [], [], timeout)[0]
+    else:
+        readable = select.select([sock, waker], [], [], timeout)[0]
+    return sock in readable
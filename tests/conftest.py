@@ -1,4 +1,5 @@
 from openstack_notifier import OpenstackNotifier
+from openstack_notifier.notifier import QueueConfig
 import openstack
 import re
 import pytest
@@ -6,9 +7,14 @@ import logging
 import docker
 import time
 import kombu
+import json
+import sys
 
 log = logging.getLogger(__name__)
 
+if sys.version_info < (3, 5):
+    collect_ignore = ['test_aio.py']
+
 
 def pytest_addoption(parser):
     parser.addoption("--rabbitmq_url", default=None)
@@ -27,7 +33,66 @@ def pytest_collection_modifyitems(config, items):
             item.add_marker(skip_live)
 
 
-class RabbitMQContainer:
+class NotificationPublisher(object):
+    def publish(self, data, exchange, routing_key, add_timestamp=True):
+        raise NotImplementedError()
+
+    def port_create(self, port_id):
+        self.publish(
+            {'event_type': 'port.create.end',
+             'payload': {'port': {'id': port_id}}},
+            'neutron', 'notifications.info')
+
+    def port_update(self, port_id):
+        self.publish(
+            {'event_type': 'port.update.end',
+             'payload': {'port': {'id': port_id}}},
+            'neutron', 'notifications.info')
+
+    def port_delete(self, port_id):
+        self.publish(
+            {'event_type': 'port.delete.end',
+             'payload': {'port': {'id': port_id}}},
+            'neutron', 'notifications.info')
+
+    def network_create(self, network_id):
+        self.publish(
+            {'event_type': 'network.create.end',
+             'payload': {'network': {'id': network_id}}},
+            'neutron', 'notifications.info')
+
+    def network_update(self, network_id):
+        self.publish(
+            {'event_type': 'network.update.end',
+             'payload': {'network': {'id': network_id}}},
+            'neutron', 'notifications.info')
+
+    def network_delete(self, network_id):
+        self.publish(
+            {'event_type': 'network.delete.end',
+             'payload': {'network': {'id': network_id}}},
+            'neutron', 'notifications.info')
+
+    def security_group_create(self, security_group_id):
+        self.publish(
+            {'event_type': 'security_group.create.end',
+             'payload': {'security_group': {'id': security_group_id}}},
+            'nova', 'notifications.info')
+
+    def security_group_update(self, security_group_id):
+        self.publish(
+            {'event_type': 'security_group.update.end',
+             'payload': {'security_group': {'id': security_group_id}}},
+            'nova', 'notifications.info')
+
+    def security_group_delete(self, security_group_id):
+        self.publish(
+            {'event_type': 'security_group.delete.end',
+             'payload': {'security_group': {'id': security_group_id}}},
+            'nova', 'notifications.info')
+
+
+class RabbitMQContainer(NotificationPublisher):
     def __init__(self, ident=''):
         docker.from_env().images.pull('rabbitmq:3.7.10-alpine')
         self.container = docker.from_env().containers.create(
@@ -76,59 +141,49 @@ class RabbitMQContainer:
             producer.publish(data, exchange=_exchange,
                              routing_key=routing_key)
 
-    def port_create(self, port_id):
-        self.publish(
-            {'event_type': 'port.create.end',
-             'payload': {'port': {'id': port_id}}},
-            'neutron', 'notifications.info')
 
-    def port_update(self, port_id):
-        self.publish(
-            {'event_type': 'port.update.end',
-             'payload': {'port': {'id': port_id}}},
-            'neutron', 'notifications.info')
+class MemoryBroker(NotificationPublisher):
+    """Publishes notifications on kombu's in-memory transport.
 
-    def port_delete(self, port_id):
-        self.publish(
-            {'event_type': 'port.delete.end',
-             'payload': {'port': {'id': port_id}}},
-            'neutron', 'notifications.info')
+    The exchange names get a per-test prefix, since the memory transport
+    state is shared by the whole process.
+    """
+    def __init__(self, ident=''):
+        self.prefix = 'test_%s' % ident
+        self.connection = kombu.Connection('memory://')
 
-    def network_create(self, network_id):
-        self.publish(
-            {'event_type': 'network.create.end',
-             'payload': {'network': {'id': network_id}}},
-            'neutron', 'notifications.info')
+    def url(self):
+        return 'memory://'
 
-    def network_update(self, network_id):
-        self.publish(
-            {'event_type': 'network.update.end',
-             'payload': {'network': {'id': network_id}}},
-            'neutron', 'notifications.info')
+    def exchange(self, name):
+        return '%s_%s' % (self.prefix, name)
 
-    def network_delete(self, network_id):
-        self.publish(
-            {'event_type': 'network.delete.end',
-             'payload': {'network': {'id': network_id}}},
-            'neutron', 'notifications.info')
+    def queue_configs(self):
+        return [QueueConfig(exchange=self.exchange('neutron'),
+                            routing_key='notifications.info'),
+                QueueConfig(exchange=self.exchange('nova'),
+                            routing_key='notifications.info')]
 
-    def security_group_create(self, security_group_id):
-        self.publish(
-            {'event_type': 'security_group.create.end',
-             'payload': {'security_group': {'id': security_group_id}}},
-            'nova', 'notifications.info')
+    def publish(self, data, exchange, routing_key, add_timestamp=True,
+                oslo=False):
+        if add_timestamp:
+            data['timestamp'] = time.strftime(
+                '%Y-%m-%d %H:%M:%S.000', time.gmtime())
+        if oslo:
+            data = {'oslo.version': '2.0',
+                    'oslo.message': json.dumps(data)}
+        _exchange = kombu.Exchange(self.exchange(exchange), 'topic',
+                                   durable=False)
+        producer = self.connection.Producer(serializer='json')
+        producer.publish(data, exchange=_exchange, routing_key=routing_key)
 
-    def security_group_update(self, security_group_id):
-        self.publish(
-            {'event_type': 'security_group.update.end',
-             'payload': {'security_group': {'id': security_group_id}}},
-            'nova', 'notifications.info')
 
-    def security_group_delete(self, security_group_id):
-        self.publish(
-            {'event_type': 'security_group.delete.end',
-             'payload': {'security_group': {'id': security_group_id}}},
-            'nova', 'notifications.info')
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('timeout waiting for %s' % condition)
+        time.sleep(0.01)
 
 
 @pytest.fixture
@@ -161,6 +216,15 @@ def rabbitmq_container(request):
     return r
 
 
+@pytest.fixture
+def memory_broker(request):
+    function_name = request.function.__name__
+    function_name = re.sub(r"[^a-zA-Z0-9]+", "", function_name)
+    r = MemoryBroker(function_name)
+    request.addfinalizer(r.connection.release)
+    return r
+
+
 @pytest.fixture
 def openstack_notifier_builder(request):
     managers = []
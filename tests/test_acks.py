@@ -0,0 +1,117 @@
+from openstack_notifier.notifier import OpenstackNotifier
+from openstack_notifier.dispatch import PoolDispatcher
+from conftest import wait_for
+import pytest
+import logging
+
+log = logging.getLogger(__name__)
+
+
+@pytest.mark.timeout(30)
+def test_ack_redelivers_failed_callback(openstack_notifier_builder,
+                                        memory_broker):
+    received = []
+
+    def callback(data):
+        received.append(data.event_type)
+        if data.event_type == 'port.update.end' \
+                and received.count('port.update.end') == 1:
+            raise ValueError('boom')
+
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=callback,
+        queue_configs=memory_broker.queue_configs(),
+        ack=True, prefetch_count=10, ack_batch_size=2)
+    om.start()
+    assert om.wait_ready(5)
+    memory_broker.port_create('0000000000')
+    memory_broker.port_update('0000000000')
+    memory_broker.port_delete('0000000000')
+    wait_for(lambda: len(received) == 4)
+    assert sorted(received) == ['port.create.end', 'port.delete.end',
+                                'port.update.end', 'port.update.end']
+    wait_for(lambda: om.ack_tracker is not None
+             and om.ack_tracker.in_flight() == 0)
+
+
+@pytest.mark.timeout(30)
+def test_ack_pool_dispatcher(openstack_notifier_builder, memory_broker):
+    received = []
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=received.append,
+        queue_configs=memory_broker.queue_configs(),
+        dispatcher=PoolDispatcher(workers=4),
+        ack=True, prefetch_count=5, ack_batch_size=3, ack_interval=0.05)
+    om.start()
+    assert om.wait_ready(5)
+    for i in range(20):
+        memory_broker.port_create(str(i))
+    wait_for(lambda: len(received) == 20)
+    wait_for(lambda: om.ack_tracker is not None
+             and om.ack_tracker.in_flight() == 0)
+
+
+@pytest.mark.timeout(30)
+@pytest.mark.parametrize('options', [{'channel_per_queue': True},
+                                     {'thread_per_queue': True}])
+def test_ack_per_queue_channels(openstack_notifier_builder, memory_broker,
+                                options):
+    received = []
+    queue_configs = memory_broker.queue_configs()
+    queue_configs[1].prefetch_count = 2
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=received.append,
+        queue_configs=queue_configs,
+        ack=True, prefetch_count=10, ack_batch_size=3, **options)
+    om.start()
+    wait_for(lambda: len(om.queue_stats()) == 2)
+    for i in range(5):
+        memory_broker.port_create(str(i))
+    memory_broker.publish({'event_type': 'compute.instance.update',
+                           'payload': {'instance_id': 'i1'}},
+                          'nova', 'notifications.info')
+    wait_for(lambda: len(received) == 6)
+    wait_for(lambda: om.in_flight() == 0)
+    stats = om.queue_stats()
+    assert stats[queue_configs[0].queue] == {
+        'received': 5, 'in_flight': 0, 'prefetch_count': 10}
+    assert stats[queue_configs[1].queue] == {
+        'received': 1, 'in_flight': 0, 'prefetch_count': 2}
+
+
+def test_per_queue_prefetch_count_checks(memory_broker, caplog):
+    queue_configs = memory_broker.queue_configs()
+    queue_configs[1].prefetch_count = 2
+    with pytest.raises(ValueError):
+        OpenstackNotifier('memory://', queue_configs=queue_configs,
+                          channel_per_queue=True)
+    with pytest.raises(ValueError):
+        OpenstackNotifier('memory://', queue_configs=queue_configs,
+                          ack=True)
+    with caplog.at_level(logging.WARNING):
+        OpenstackNotifier('memory://', queue_configs=queue_configs,
+                          ack=True, channel_per_queue=True)
+    assert 'single thread' in caplog.text
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        OpenstackNotifier('memory://', queue_configs=queue_configs,
+                          ack=True, channel_per_queue=True,
+                          dispatcher=PoolDispatcher())
+        OpenstackNotifier('memory://', queue_configs=queue_configs,
+                          ack=True, thread_per_queue=True)
+    assert caplog.text == ''
+
+
+@pytest.mark.timeout(30)
+def test_no_ack_prefetch_count(openstack_notifier_builder, memory_broker):
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        queue_configs=memory_broker.queue_configs(),
+        prefetch_count=10)
+    om.start()
+    assert om.wait_ready(5)
+    # the prefetch window applies only to the messages not acknowledged
+    assert [s['prefetch_count'] for s in om.queue_stats().values()] == [0]
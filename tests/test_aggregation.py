@@ -0,0 +1,91 @@
+from openstack_notifier.aggregation import Aggregator, Aggregate, OVERFLOW
+from openstack_notifier.notifier import OpenstackNotifier, CallbackData
+import time
+import pytest
+
+
+def port(timestamp, project_id='t1', event_type='port.create.end', mtu=None):
+    body = {'id': 'p', 'project_id': project_id}
+    if mtu is not None:
+        body['mtu'] = mtu
+    return CallbackData(event_type, {'port': body}, timestamp=timestamp)
+
+
+def test_aggregator_invalid_windows():
+    with pytest.raises(ValueError):
+        Aggregator(window=0)
+    with pytest.raises(ValueError):
+        Aggregator(window=60, slide=25)
+
+
+def test_tumbling_windows():
+    a = Aggregator(window=60, fields=('port.project_id',), value='port.mtu')
+    a.add(port(0, 't1', mtu=1500))
+    a.add(port(30, 't1', mtu=1450))
+    a.add(port(59, 't2'))
+    a.add(port(61, 't1', event_type='port.delete.end'))
+    assert a.expired(now=59) == []
+    assert sorted(a.expired(now=60), key=repr) == [
+        Aggregate(0, 60, ('port.create.end', 't1'), 2, 2950.0),
+        Aggregate(0, 60, ('port.create.end', 't2'), 1, 0.0)]
+    # the window was emitted
+    a.add(port(10, 't1'))
+    assert a.late == 1
+    assert a.expired(now=119) == []
+    assert a.expired(now=500) == [
+        Aggregate(60, 120, ('port.delete.end', 't1'), 1, 0.0)]
+    assert len(a) == 0
+    assert a.expired(now=1000) == []
+
+
+def test_sliding_windows():
+    a = Aggregator(window=30, slide=10, by_event_type=False)
+    a.add(port(5))
+    a.add(port(15))
+    a.add(port(16))
+    assert a.expired(now=20) == [Aggregate(-20, 10, (), 1),
+                                 Aggregate(-10, 20, (), 3)]
+    # the empty panes are emitted while the window holds notifications
+    assert a.expired(now=1000) == [Aggregate(0, 30, (), 3),
+                                   Aggregate(10, 40, (), 2)]
+    assert len(a) == 0
+    a.add(port(2000))
+    assert a.expired(now=2010) == [Aggregate(1980, 2010, (), 1)]
+
+
+def test_lateness():
+    a = Aggregator(window=10, lateness=5, by_event_type=False)
+    a.add(port(1))
+    assert a.expired(now=12) == []
+    a.add(port(8))
+    assert a.expired(now=15) == [Aggregate(0, 10, (), 2)]
+
+
+def test_max_keys():
+    a = Aggregator(window=10, fields=('port.project_id',),
+                   by_event_type=False, max_keys=2)
+    for project_id in ('t1', 't2', 't3', 't4', 't1'):
+        a.add(port(1, project_id))
+    assert len(a) == 3
+    assert a.overflowed == 2
+    assert sorted(a.flush(), key=repr) == [
+        Aggregate(0, 10, OVERFLOW, 2),
+        Aggregate(0, 10, ('t1',), 2),
+        Aggregate(0, 10, ('t2',), 1)]
+    assert len(a) == 0
+
+
+def test_aggregator_subscribe():
+    received = []
+    a = Aggregator(window=0.1, callback=received.extend)
+    notifier = OpenstackNotifier('memory://')
+    a.subscribe(notifier, 'port.*')
+    notifier.handle_message(
+        {'event_type': 'port.create.end',
+         'timestamp': time.strftime('%Y-%m-%d %H:%M:%S.000', time.gmtime()),
+         'payload': {'port': {'id': 'p1'}}}, None)
+    a.start()
+    a.stop()
+    assert len(received) == 1
+    assert received[0].key == ('port.create.end',)
+    assert received[0].count == 1
@@ -0,0 +1,87 @@
+from openstack_notifier.aio import AsyncOpenstackNotifier
+from openstack_notifier.notifier import CallbackData
+from conftest import wait_for
+import asyncio
+import pytest
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def async_wait_for(condition, timeout=5):
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, wait_for, condition, timeout)
+
+
+@pytest.mark.timeout(30)
+def test_async_iterator(memory_broker):
+    async def main():
+        received = []
+        async with AsyncOpenstackNotifier(
+                memory_broker.url(),
+                queue_configs=memory_broker.queue_configs(),
+                ack=True) as notifier:
+            assert await notifier.wait_ready(5)
+            memory_broker.port_create('0')
+            memory_broker.port_delete('0')
+            async for data in notifier:
+                received.append(data)
+                if len(received) == 2:
+                    break
+        return received
+
+    assert run(main()) == [
+        CallbackData('port.create.end', {'port': {'id': '0'}}),
+        CallbackData('port.delete.end', {'port': {'id': '0'}})]
+
+
+@pytest.mark.timeout(30)
+def test_async_callback(memory_broker):
+    received = []
+    running = []
+
+    async def callback(data):
+        running.append(data)
+        await asyncio.sleep(0.05)
+        received.append(data.payload['port']['id'])
+        running.remove(data)
+
+    async def main():
+        notifier = AsyncOpenstackNotifier(
+            memory_broker.url(), callback=callback, concurrency=4,
+            queue_configs=memory_broker.queue_configs())
+        await notifier.start()
+        assert await notifier.wait_ready(5)
+        for i in range(8):
+            memory_broker.port_create(str(i))
+        max_running = 0
+        while len(received) < 8:
+            max_running = max(max_running, len(running))
+            await asyncio.sleep(0.01)
+        await notifier.stop()
+        assert not notifier.alive()
+        return max_running
+
+    assert run(main()) > 1
+    assert sorted(received) == [str(i) for i in range(8)]
+
+
+@pytest.mark.timeout(30)
+def test_async_stop_while_full(memory_broker):
+    async def main():
+        notifier = AsyncOpenstackNotifier(
+            memory_broker.url(), max_queue_size=1,
+            queue_configs=memory_broker.queue_configs())
+        await notifier.start()
+        assert await notifier.wait_ready(5)
+        for i in range(3):
+            memory_broker.port_create(str(i))
+        await async_wait_for(lambda: notifier.queue_depth() == 1)
+        await notifier.stop()
+
+    run(main())
@@ -0,0 +1,76 @@
+from openstack_notifier.batch import Batcher
+from openstack_notifier.dispatch import KeyedDispatcher
+from openstack_notifier.notifier import OpenstackNotifier
+from conftest import wait_for
+from time import sleep, time
+import pytest
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def test_batcher_size():
+    results = []
+    b = Batcher(max_batch_size=3, max_batch_latency=60)
+    for i in range(3):
+        assert not b.due()
+        b.add(i, results.append)
+    assert b.due()
+    items, done = b.take()
+    assert items == [0, 1, 2]
+    assert len(b) == 0 and b.timeout() is None
+    done(True)
+    assert results == [True, True, True]
+
+
+def test_batcher_latency():
+    b = Batcher(max_batch_size=100, max_batch_latency=0.05)
+    b.add(1, None)
+    assert not b.due()
+    assert 0 < b.timeout() <= 0.05
+    sleep(0.06)
+    assert b.due()
+
+
+def test_batch_callback_keyed_dispatcher():
+    with pytest.raises(ValueError):
+        OpenstackNotifier('memory://', batch_callback=lambda _: None,
+                          dispatcher=KeyedDispatcher())
+
+
+@pytest.mark.timeout(30)
+def test_batch_callback(openstack_notifier_builder, memory_broker):
+    batches = []
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        batch_callback=batches.append,
+        queue_configs=memory_broker.queue_configs(),
+        max_batch_size=4, max_batch_latency=0.2,
+        ack=True)
+    om.start()
+    assert om.wait_ready(5)
+    for i in range(6):
+        memory_broker.port_create(str(i))
+    start = time()
+    wait_for(lambda: sum(len(b) for b in batches) == 6)
+    assert time() - start < 1
+    assert [len(b) for b in batches] == [4, 2]
+    assert batches[1][1].payload == {'port': {'id': '5'}}
+    wait_for(lambda: om.ack_tracker.in_flight() == 0)
+
+
+@pytest.mark.timeout(30)
+def test_batch_flush_on_stop(openstack_notifier_builder, memory_broker):
+    batches = []
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        batch_callback=batches.append,
+        queue_configs=memory_broker.queue_configs(),
+        max_batch_size=100, max_batch_latency=60)
+    om.start()
+    assert om.wait_ready(5)
+    memory_broker.port_create('0')
+    sleep(0.5)
+    assert batches == []
+    om.stop()
+    assert len(batches) == 1
@@ -0,0 +1,127 @@
+from openstack_notifier.checkpoint import Checkpoint
+from openstack_notifier.notifier import OpenstackNotifier, QueueConfig
+from openstack_notifier.notifier import Stream
+from openstack_notifier.acks import AckTracker
+from openstack_notifier.recording import RecordedMessage
+from conftest import wait_for
+import json
+import os
+import pytest
+
+
+def test_checkpoint(tmp_path):
+    path = str(tmp_path / 'checkpoint')
+    checkpoint = Checkpoint(path, batch_size=2, interval=60, rewind=10)
+    assert checkpoint.timestamps == {}
+    assert checkpoint.min_timestamp('q') is None
+    done = checkpoint.wrap(100.0, None, 'q')
+    done(True)
+    checkpoint.wrap(50.0, None, 'q')(True)
+    checkpoint.wrap(200.0, None, 'q')(False)
+    assert checkpoint.due()
+    checkpoint.flush()
+    assert not checkpoint.due()
+    assert not os.path.exists(path + '.tmp')
+    assert Checkpoint(path).timestamps == {'q': 100.0}
+    assert Checkpoint(path, rewind=10).min_timestamp('q') == 90.0
+    assert Checkpoint(path).min_timestamp('other') is None
+
+
+def test_checkpoint_low_watermark(tmp_path):
+    path = str(tmp_path / 'checkpoint')
+    checkpoint = Checkpoint(path)
+    # a lagging queue is not resumed from the newest notification
+    slow = checkpoint.wrap(100.0, None, 'slow')
+    checkpoint.wrap(200.0, None, 'fast')(True)
+    checkpoint.wrap(150.0, None, 'slow')(True)
+    checkpoint.flush()
+    assert Checkpoint(path).timestamps == {'slow': 100.0, 'fast': 200.0}
+    slow(True)
+    checkpoint.flush()
+    assert Checkpoint(path).timestamps == {'slow': 150.0, 'fast': 200.0}
+    # a requeued notification holds the watermark until redelivered
+    checkpoint.wrap(160.0, None, 'slow', retry_key=b'a')(False)
+    checkpoint.wrap(170.0, None, 'slow')(True)
+    checkpoint.flush()
+    assert checkpoint.timestamps['slow'] == 160.0
+    checkpoint.redelivery('slow', b'b', None)(True)
+    checkpoint.flush()
+    assert checkpoint.timestamps['slow'] == 160.0
+    checkpoint.redelivery('slow', b'a', None)(True)
+    checkpoint.flush()
+    assert checkpoint.timestamps['slow'] == 170.0
+
+
+class Message(RecordedMessage):
+    def __init__(self, body, delivery_tag, redelivered):
+        super(Message, self).__init__(body)
+        self.delivery_tag = delivery_tag
+        self.delivery_info = {'redelivered': redelivered}
+
+
+def test_checkpoint_redelivery_dropped(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint'))
+
+    def callback(data):
+        raise ValueError(data)
+
+    om = OpenstackNotifier('memory://', callback=callback,
+                           checkpoint=checkpoint)
+    stream = Stream('q', 1, AckTracker())
+    body = json.dumps({'event_type': 'port.update.end',
+                       'timestamp': '2019-03-15 08:32:59.000000',
+                       'payload': {}}).encode('utf-8')
+    om.handle_message(None, Message(body, 1, False), stream=stream)
+    checkpoint.wrap(2000000000.0, None, 'q')(True)
+    assert checkpoint.watermarks()['q'] < 2000000000.0
+    # the redelivery is filtered before reaching the checkpoint
+    om.min_timestamp = 2000000000.0
+    om.handle_message(None, Message(body, 2, True), stream=stream)
+    assert checkpoint.watermarks()['q'] == 2000000000.0
+
+
+def test_checkpoint_invalid(tmp_path):
+    path = tmp_path / 'checkpoint'
+    path.write_text(u'foo')
+    assert Checkpoint(str(path)).timestamps == {}
+
+
+def test_durable_queue_config():
+    with pytest.raises(ValueError):
+        QueueConfig('neutron', durable=True)
+    assert QueueConfig('neutron', 'q', durable=True).durable
+
+
+@pytest.mark.timeout(30)
+def test_durable_catch_up(openstack_notifier_builder, memory_broker,
+                          tmp_path):
+    received = []
+    path = str(tmp_path / 'checkpoint')
+    queue_configs = [
+        QueueConfig(exchange=memory_broker.exchange('neutron'),
+                    queue=memory_broker.exchange('durable'),
+                    routing_key='notifications.info', durable=True)]
+
+    def notifier():
+        return openstack_notifier_builder(
+            url=memory_broker.url(),
+            callback=received.append,
+            queue_configs=queue_configs,
+            ack=True, checkpoint=Checkpoint(path, rewind=0))
+
+    om = notifier()
+    om.start()
+    wait_for(lambda: om.connection_stats()['connected'])
+    memory_broker.port_create('0')
+    wait_for(lambda: len(received) == 1)
+    om.stop()
+    saved = Checkpoint(path).timestamps
+    assert saved == {memory_broker.exchange('durable'): received[0].timestamp}
+
+    # published while stopped
+    memory_broker.port_create('1')
+    om = notifier()
+    om.start()
+    wait_for(lambda: len(received) == 2)
+    assert om.streams[0].min_timestamp == received[0].timestamp
+    assert received[1].payload == {'port': {'id': '1'}}
@@ -0,0 +1,63 @@
+from openstack_notifier.coalesce import Coalescer
+from openstack_notifier.notifier import OpenstackNotifier, CallbackData
+
+
+def port(event_type, port_id, name=''):
+    return CallbackData(event_type, {'port': {'id': port_id, 'name': name}})
+
+
+def test_coalesce_keeps_latest():
+    results = []
+    c = Coalescer(window=1.0)
+    assert c.add(port('port.update.end', 'p1', 'a'),
+                 lambda ok: results.append('a'), now=0) == []
+    assert c.add(port('port.update.end', 'p1', 'b'),
+                 lambda ok: results.append('b'), now=0.5) == []
+    assert c.add(port('port.update.end', 'p2'), None, now=0.5) == []
+    assert c.timeout() == 0.0
+    assert c.expired(now=0.9) == []
+    ready = c.expired(now=1.0)
+    assert len(ready) == 1
+    data, done = ready[0]
+    assert data.payload['port']['name'] == 'b'
+    # the superseded notification is completed with the latest one
+    done(True)
+    assert sorted(results) == ['a', 'b']
+    assert c.coalesced == 1
+    assert len(c) == 1
+    assert [d for d, _ in c.flush()] == [port('port.update.end', 'p2')]
+
+
+def test_coalesce_terminal_flushes():
+    c = Coalescer(window=10)
+    c.add(port('port.create.end', 'p1'), None, now=0)
+    c.add(port('port.update.end', 'p1'), None, now=0)
+    ready = c.add(CallbackData('port.delete.end', {'port_id': 'p1'}),
+                  None, now=1)
+    assert [d.event_type for d, _ in ready] == [
+        'port.create.end', 'port.update.end', 'port.delete.end']
+    assert len(c) == 0
+
+
+def test_coalesce_max_keys_and_keyless():
+    c = Coalescer(window=10, max_keys=2)
+    c.add(port('port.update.end', 'p1'), None, now=0)
+    c.add(port('port.update.end', 'p2'), None, now=0)
+    ready = c.add(port('port.update.end', 'p3'), None, now=0)
+    assert [d for d, _ in ready] == [port('port.update.end', 'p1')]
+    keyless = CallbackData('compute.metrics.update', {'nodename': 'n1'})
+    assert c.add(keyless, None) == [(keyless, None)]
+
+
+def test_notifier_coalescer():
+    received = []
+    om = OpenstackNotifier('memory://', callback=received.append,
+                           coalescer=Coalescer(window=0))
+    for name in ('a', 'b'):
+        om.rabbitmq_callback({'event_type': 'port.update.end',
+                              'timestamp': '2019-03-15 08:32:59.000000',
+                              'payload': {'port': {'id': 'p1',
+                                                   'name': name}}}, None)
+    assert received == []
+    om.housekeeping()
+    assert received == [port('port.update.end', 'p1', 'b')]
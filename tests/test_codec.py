@@ -0,0 +1,138 @@
+from openstack_notifier.codec import decode_body, scan_envelope
+from openstack_notifier.codec import scan_resource_key
+from openstack_notifier.dispatch import resource_key
+from openstack_notifier.notifier import OpenstackNotifier
+from openstack_notifier.dedup import DedupCache
+from openstack_notifier.notifier import CallbackData
+from conftest import wait_for
+import json
+import pickle
+import pytest
+
+
+@pytest.mark.parametrize('loads', [None, json.loads])
+def test_decode_body(loads):
+    kwargs = {} if loads is None else {'loads': loads}
+    message = {'event_type': 'port.create.end', 'payload': {'a': [1, 2]}}
+    assert decode_body(json.dumps(message).encode(), **kwargs) == message
+    oslo = {'oslo.version': '2.0', 'oslo.message': json.dumps(message)}
+    assert decode_body(json.dumps(oslo).encode(), **kwargs) == message
+
+
+@pytest.mark.timeout(30)
+def test_raw_notifications(openstack_notifier_builder, memory_broker):
+    received = []
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=received.append,
+        queue_configs=memory_broker.queue_configs(),
+        raw=True, ack=True)
+    om.start()
+    assert om.wait_ready(5)
+    memory_broker.publish({'event_type': 'port.create.end',
+                           'payload': {'port': {'id': '0'}}},
+                          'neutron', 'notifications.info', oslo=True)
+    memory_broker.port_delete('0')
+    wait_for(lambda: len(received) == 2)
+    assert received == [
+        CallbackData('port.create.end', {'port': {'id': '0'}}),
+        CallbackData('port.delete.end', {'port': {'id': '0'}})]
+
+
+def test_scan_envelope():
+    message = {'event_type': 'port.create.end', 'payload': {'a': 1},
+               'timestamp': '2019-03-15 08:32:59.000000'}
+    expected = ('port.create.end', '2019-03-15 08:32:59.000000')
+    assert scan_envelope(json.dumps(message).encode()) == expected
+    oslo = {'oslo.version': '2.0', 'oslo.message': json.dumps(message)}
+    assert scan_envelope(json.dumps(oslo).encode()) == expected
+    # ambiguous, or escaped, values need a real decoding
+    nested = dict(message, payload={'timestamp': 'x'})
+    assert scan_envelope(json.dumps(nested).encode()) is None
+    escaped = dict(message, event_type='port.\u00e9')
+    assert scan_envelope(json.dumps(escaped).encode()) is None
+
+
+@pytest.mark.parametrize('oslo', [False, True])
+def test_scan_resource_key(oslo):
+    port = ('port', 'p1')
+    # None when the notification has to be decoded
+    payloads = [
+        ('port.create.end', {'port': {'name': 'a, "id": "x"', 'id': 'p1'}},
+         port),
+        ('port.create.end', {'port': {'id': 'p1', 'fixed_ips': [
+            {'subnet_id': 's1'}]}}, port),
+        ('port.delete.end', {'port_id': 'p1'}, port),
+        ('network.delete.end', {'network_id': 'n1', 'port_id': 'p1'},
+         ('network', 'n1')),
+        ('port.create.end', {'port': {'fixed_ips': [], 'id': 'p1'}}, None),
+        ('port.create.end', {'port': {'id': 1}}, None),
+        ('port.delete.end', {'port_id': 'p1', 'device': {'port_id': 'p2'}},
+         None),
+        ('router.create.end', {}, None),
+    ]
+    for event_type, payload, key in payloads:
+        body = {'event_type': event_type, 'payload': payload}
+        if oslo:
+            body = {'oslo.version': '2.0', 'oslo.message': json.dumps(body)}
+        assert scan_resource_key(json.dumps(body).encode()) == key
+        if key is not None:
+            assert key == resource_key(CallbackData(event_type, payload))
+
+
+def test_lazy_callback_data():
+    raw = json.dumps({'event_type': 'port.create.end',
+                      'payload': {'port': {'id': '0'}}}).encode()
+    data = CallbackData('port.create.end', raw=raw, timestamp=1.0)
+    assert data.raw == raw
+    assert pickle.loads(pickle.dumps(data)).raw == raw
+    assert data == CallbackData('port.create.end', {'port': {'id': '0'}})
+    assert data.raw is None
+    assert repr(data) == \
+        "<CallbackData(port.create.end, {'port': {'id': '0'}})"
+    with pytest.raises(AttributeError):
+        data.foo = 1
+
+
+def test_lazy_callback_data_decoded_concurrently():
+    raw = json.dumps({'payload': {'port': {'id': '0'}}}).encode()
+
+    class RacedCallbackData(CallbackData):
+        """Another thread decodes the payload after the first read of
+        raw."""
+        __slots__ = ()
+
+        @property
+        def raw(self):
+            value = CallbackData.raw.__get__(self)
+            CallbackData.raw.__set__(self, None)
+            return value
+
+        @raw.setter
+        def raw(self, value):
+            CallbackData.raw.__set__(self, value)
+
+    data = RacedCallbackData('port.create.end', raw=raw)
+    assert data.payload == {'port': {'id': '0'}}
+
+
+@pytest.mark.parametrize('dedup', [False, True])
+def test_lazy_notifier(dedup):
+    class Message(object):
+        content_type = 'application/json'
+        headers = {}  # type: dict
+
+        def __init__(self, body):
+            self.body = body
+
+    received = []
+    kwargs = {'dedup': DedupCache()} if dedup else {}
+    om = OpenstackNotifier('memory://', callback=received.append, raw=True,
+                           lazy=True, **kwargs)
+    body = {'event_type': 'port.create.end',
+            'timestamp': '2019-03-15 08:32:59.000000',
+            'payload': {'port': {'id': '0'}}}
+    om.rabbitmq_message(Message(json.dumps(body).encode()))
+    assert received[0].timestamp == 1552638779.0
+    assert (received[0].raw is None) == dedup
+    assert received[0].payload == {'port': {'id': '0'}}
@@ -0,0 +1,74 @@
+from openstack_notifier.dedup import DedupCache, notification_key
+from openstack_notifier.notifier import OpenstackNotifier
+from openstack_notifier.metrics import Metrics
+from conftest import wait_for
+import pytest
+
+
+def test_notification_key():
+    body = {'event_type': 'port.create.end', 'payload': {'a': 1},
+            'timestamp': '2019-03-15 08:32:59.000000'}
+    assert notification_key(dict(body, message_id='m1')) == 'm1'
+    assert notification_key(body) == notification_key(dict(body))
+    assert notification_key(body) != notification_key(
+        dict(body, payload={'a': 2}))
+
+
+def test_dedup_ttl():
+    cache = DedupCache(ttl=10)
+    assert not cache.seen('a', now=0)
+    assert cache.seen('a', now=5)
+    # refreshed by the previous hit
+    assert cache.seen('a', now=14)
+    assert not cache.seen('a', now=30)
+    assert not cache.seen('b', now=30)
+    assert cache.stats() == {'hits': 2, 'misses': 3, 'entries': 2}
+
+
+def test_dedup_max_entries():
+    cache = DedupCache(max_entries=2, ttl=100)
+    for key in ('a', 'b', 'c'):
+        assert not cache.seen(key, now=0)
+    assert len(cache) == 2
+    assert not cache.seen('a', now=1)
+    assert cache.seen('c', now=1)
+
+
+def test_notifier_dedup():
+    received = []
+    metrics = Metrics()
+    om = OpenstackNotifier('memory://', callback=received.append,
+                           dedup=DedupCache(), metrics=metrics)
+    body = {'message_id': 'm1', 'event_type': 'port.create.end',
+            'timestamp': '2019-03-15 08:32:59.000000', 'payload': {}}
+    om.rabbitmq_callback(dict(body), None)
+    om.rabbitmq_callback(dict(body), None)
+    om.rabbitmq_callback(dict(body, message_id='m2'), None)
+    assert len(received) == 2
+    assert metrics.snapshot()['counters']['duplicate'] == {
+        'port.create.end': 1}
+
+
+@pytest.mark.timeout(30)
+def test_notifier_dedup_redelivers_failed(openstack_notifier_builder,
+                                          memory_broker):
+    received = []
+    dedup = DedupCache()
+
+    def callback(data):
+        received.append(data.event_type)
+        if len(received) == 1:
+            raise ValueError('boom')
+
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=callback, dedup=dedup, ack=True, ack_batch_size=1,
+        queue_configs=memory_broker.queue_configs())
+    om.start()
+    assert om.wait_ready(5)
+    memory_broker.port_create('0')
+    # the failed message is requeued and processed again
+    wait_for(lambda: len(received) == 2)
+    wait_for(lambda: om.in_flight() == 0)
+    assert dedup.hits == 0
+    assert len(dedup) == 1
@@ -0,0 +1,115 @@
+from threading import Event
+from time import sleep
+from openstack_notifier.dispatch import PoolDispatcher, KeyedDispatcher
+from openstack_notifier.dispatch import resource_key
+from openstack_notifier.notifier import CallbackData
+from conftest import wait_for
+import pytest
+import random
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def test_pool_dispatcher_runs_callbacks():
+    received = []
+    d = PoolDispatcher(workers=2)
+    d.start()
+    for i in range(10):
+        d.dispatch(received.append, i)
+    d.stop()
+    assert sorted(received) == list(range(10))
+
+
+def test_pool_dispatcher_queue_depth():
+    release = Event()
+    d = PoolDispatcher(workers=1, max_queue_size=10)
+    d.start()
+    d.dispatch(lambda _: release.wait(), None)
+    wait_for(lambda: d.queue_depth() == 0)
+    for i in range(3):
+        d.dispatch(lambda _: None, i)
+    assert d.queue_depth() == 3
+    release.set()
+    d.stop()
+    assert d.queue_depth() == 0
+
+
+def test_pool_dispatcher_callback_error():
+    received = []
+
+    def callback(data):
+        if data == 1:
+            raise ValueError('boom')
+        received.append(data)
+
+    d = PoolDispatcher(workers=1)
+    d.start()
+    for i in range(3):
+        d.dispatch(callback, i)
+    d.stop()
+    assert received == [0, 2]
+
+
+def test_pool_dispatcher_processes():
+    d = PoolDispatcher(workers=2, processes=True)
+    d.start()
+    d.dispatch(log.info, 'from a worker process')
+    d.stop()
+
+
+def test_pool_dispatcher_invalid_workers():
+    with pytest.raises(ValueError):
+        PoolDispatcher(workers=0)
+
+
+@pytest.mark.timeout(30)
+def test_notifier_pool_dispatcher(openstack_notifier_builder,
+                                  memory_broker):
+    received = []
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=received.append,
+        queue_configs=memory_broker.queue_configs(),
+        dispatcher=PoolDispatcher(workers=2))
+    om.start()
+    assert om.wait_ready(5)
+    memory_broker.port_create('0000000000')
+    memory_broker.network_create('0000000000')
+    wait_for(lambda: len(received) == 2)
+    assert CallbackData('port.create.end',
+                        {'port': {'id': '0000000000'}}) in received
+    assert om.queue_depth() == 0
+
+
+def test_resource_key():
+    assert resource_key(CallbackData(
+        'port.create.end', {'port': {'id': 'p1'}})) == ('port', 'p1')
+    assert resource_key(CallbackData(
+        'port.delete.end', {'port_id': 'p1'})) == ('port', 'p1')
+    assert resource_key(CallbackData(
+        'compute.metrics.update', {'nodename': 'n1'})) is None
+
+
+def test_keyed_dispatcher_keeps_order_per_key():
+    received = {}  # type: ignore
+
+    def callback(data):
+        sleep(random.random() / 1000)
+        received.setdefault(resource_key(data), []).append(data.event_type)
+
+    d = KeyedDispatcher(workers=4)
+    d.start()
+    for port_id in range(20):
+        for action in ('create', 'update', 'delete'):
+            event_type = 'port.%s.end' % action
+            if action == 'delete':
+                payload = {'port_id': port_id}
+            else:
+                payload = {'port': {'id': port_id}}
+            d.dispatch(callback, CallbackData(event_type, payload))
+    d.stop()
+    assert len(received) == 20
+    for events in received.values():
+        assert events == ['port.create.end', 'port.update.end',
+                          'port.delete.end']
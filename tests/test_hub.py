@@ -0,0 +1,177 @@
+from threading import Event, Thread
+from openstack_notifier.hub import NotifierHub
+from openstack_notifier.dispatch import PoolDispatcher
+from openstack_notifier.notifier import CallbackData, QueueConfig
+from conftest import wait_for
+import pytest
+import time
+
+
+@pytest.fixture
+def hub(request):
+    hub = NotifierHub('memory://')
+    request.addfinalizer(hub.stop)
+    return hub
+
+
+def test_hub_invalid_connections():
+    with pytest.raises(ValueError):
+        NotifierHub('memory://', connections=0)
+
+
+@pytest.mark.timeout(30)
+def test_hub_routes_messages(hub, memory_broker):
+    neutron = []
+    nova = []
+    neutron_notifier = hub.notifier(
+        callback=neutron.append, ack=True,
+        queue_configs=[QueueConfig(exchange=memory_broker.exchange('neutron'),
+                                   routing_key='notifications.info')])
+    nova_notifier = hub.notifier(
+        callback=nova.append,
+        queue_configs=[QueueConfig(exchange=memory_broker.exchange('nova'),
+                                   routing_key='notifications.info')])
+    neutron_notifier.start()
+    nova_notifier.start()
+    wait_for(lambda: neutron_notifier.connection_stats()['connected'] and
+             nova_notifier.connection_stats()['connected'])
+    assert neutron_notifier.alive() and nova_notifier.alive()
+    assert hub.connection_stats()[0]['notifiers'] == 2
+
+    memory_broker.port_create('p1')
+    memory_broker.security_group_create('s1')
+    wait_for(lambda: len(neutron) == 1 and len(nova) == 1)
+    assert neutron == [CallbackData('port.create.end',
+                                    {'port': {'id': 'p1'}})]
+    assert nova == [CallbackData('security_group.create.end',
+                                 {'security_group': {'id': 's1'}})]
+    wait_for(lambda: neutron_notifier.in_flight() == 0)
+
+    neutron_notifier.stop()
+    assert not neutron_notifier.alive()
+    assert not neutron_notifier.connection_stats()['connected']
+    assert nova_notifier.alive()
+    memory_broker.security_group_create('s2')
+    wait_for(lambda: len(nova) == 2)
+
+    neutron_notifier.start()
+    wait_for(lambda: neutron_notifier.connection_stats()['connected'])
+    memory_broker.port_create('p2')
+    wait_for(lambda: len(neutron) == 2)
+    nova_notifier.stop()
+    neutron_notifier.stop()
+    assert hub.connection_stats()[0]['notifiers'] == 0
+
+
+@pytest.mark.timeout(30)
+def test_hub_drains_off_the_connection_thread(hub, memory_broker):
+    release = Event()
+    neutron = []
+    nova = []
+
+    def slow(data):
+        release.wait()
+        neutron.append(data)
+
+    neutron_notifier = hub.notifier(
+        callback=slow, ack=True, dispatcher=PoolDispatcher(workers=1),
+        queue_configs=[QueueConfig(exchange=memory_broker.exchange('neutron'),
+                                   routing_key='notifications.info')])
+    nova_notifier = hub.notifier(
+        callback=nova.append,
+        queue_configs=[QueueConfig(exchange=memory_broker.exchange('nova'),
+                                   routing_key='notifications.info')])
+    neutron_notifier.start()
+    nova_notifier.start()
+    wait_for(lambda: neutron_notifier.connection_stats()['connected'] and
+             nova_notifier.connection_stats()['connected'])
+    memory_broker.port_create('p1')
+    wait_for(lambda: neutron_notifier.in_flight() == 1)
+    stopping = Thread(target=neutron_notifier.stop)
+    stopping.start()
+    time.sleep(0.3)
+    try:
+        # the other notifiers of the connection keep going while draining
+        memory_broker.security_group_create('s1')
+        wait_for(lambda: len(nova) == 1)
+        assert stopping.is_alive()
+    finally:
+        release.set()
+    stopping.join()
+    assert len(neutron) == 1
+    assert neutron_notifier.in_flight() == 0
+    nova_notifier.stop()
+
+
+@pytest.mark.timeout(30)
+def test_hub_balances_connections(memory_broker):
+    hub = NotifierHub('memory://', connections=2)
+    notifiers = [hub.notifier(queue_configs=memory_broker.queue_configs())
+                 for _ in range(3)]
+    try:
+        for notifier in notifiers:
+            notifier.start()
+        wait_for(lambda: all(n.connection_stats()['connected']
+                             for n in notifiers))
+        assert [c['notifiers'] for c in hub.connection_stats()] == [2, 1]
+        notifiers[0].stop()
+        assert [c['notifiers'] for c in hub.connection_stats()] == [1, 1]
+    finally:
+        for notifier in notifiers:
+            notifier.stop()
+        hub.stop()
+
+
+@pytest.mark.timeout(30)
+def test_hub_reconnects(memory_broker, monkeypatch):
+    from openstack_notifier.hub import _Connection
+    received = []
+    urls = []
+    consume_once = _Connection.consume_once
+
+    def failing_consume_once(self, url):
+        urls.append(url)
+        if len(urls) <= 2:
+            raise IOError('connection refused')
+        consume_once(self, 'memory://')
+
+    monkeypatch.setattr(_Connection, 'consume_once', failing_consume_once)
+    hub = NotifierHub('memory://', reconnect_delay=0.05)
+    notifier = hub.notifier(callback=received.append,
+                            queue_configs=memory_broker.queue_configs())
+    try:
+        notifier.start()
+        wait_for(lambda: notifier.connection_stats()['connected'])
+        stats = notifier.connection_stats()
+        assert stats['reconnects'] == 1
+        assert stats['connection_errors'] == 2
+        memory_broker.port_create('p1')
+        wait_for(lambda: len(received) == 1)
+    finally:
+        notifier.stop()
+        hub.stop()
+
+
+@pytest.mark.timeout(30)
+def test_hub_detaches_failing_notifier(hub, memory_broker):
+    received = []
+    healthy = hub.notifier(callback=received.append,
+                           queue_configs=memory_broker.queue_configs())
+    broken = hub.notifier(queue_configs=memory_broker.queue_configs())
+
+    def open_streams(rabbitmq, queue_configs):
+        raise ValueError('PRECONDITION_FAILED')
+
+    broken.open_streams = open_streams
+    healthy.start()
+    assert healthy.wait_ready(5)
+    with pytest.raises(ValueError):
+        broken.start()
+    assert not broken.alive()
+    assert healthy.alive()
+    memory_broker.port_create('p1')
+    wait_for(lambda: len(received) == 1)
+    stats = hub.connection_stats()[0]
+    assert stats['connection_errors'] == 0
+    assert stats['notifiers'] == 1
+    healthy.stop()
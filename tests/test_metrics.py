@@ -0,0 +1,93 @@
+from threading import Thread
+from openstack_notifier.metrics import Metrics, MetricsServer
+from openstack_notifier.notifier import OpenstackNotifier
+import time
+import pytest
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # pragma: no cover
+    from urllib2 import urlopen  # type: ignore
+
+
+def message(event_type='port.create.end', age=0.0):
+    ts = time.gmtime(time.time() - age)
+    return {'event_type': event_type,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S.000', ts),
+            'payload': {}}
+
+
+def test_metrics_threads():
+    metrics = Metrics(buckets=(1, 10))
+
+    def count():
+        for _ in range(1000):
+            metrics.inc('received', 'port.create.end')
+        metrics.observe('lag_seconds', 5)
+
+    threads = [Thread(target=count) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'received': {'port.create.end': 4000}}
+    assert snapshot['histograms']['lag_seconds'] == {
+        'buckets': [(1, 0), (10, 4), (float('inf'), 4)],
+        'sum': 20.0, 'count': 4}
+
+
+def test_notifier_metrics():
+    metrics = Metrics()
+
+    def callback(data):
+        if data.event_type == 'port.delete.end':
+            raise ValueError('boom')
+
+    om = OpenstackNotifier('memory://', callback=callback, metrics=metrics,
+                           min_timestamp=time.time() - 60)
+    om.rabbitmq_callback(message(), None)
+    om.rabbitmq_callback(message('port.delete.end'), None)
+    om.rabbitmq_callback(message(age=3600), None)
+    om.rabbitmq_callback({'event_type': 'port.update.end'}, None)
+    om.rabbitmq_callback(dict(message(), timestamp='yesterday'), None)
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {
+        'received': {'port.create.end': 3, 'port.delete.end': 1,
+                     'port.update.end': 1},
+        'filtered_old': {'port.create.end': 1},
+        'missing_timestamp': {'port.update.end': 1},
+        'parse_error': {'port.create.end': 1},
+        'callback_error': {'port.delete.end': 1}}
+    assert snapshot['histograms']['callback_seconds']['count'] == 2
+    lag = snapshot['histograms']['lag_seconds']
+    assert lag['count'] == 2 and lag['sum'] < 10
+    assert snapshot['gauges'] == {'queue_depth': 0, 'reconnects': 0,
+                                  'downtime_seconds': 0.0}
+
+
+def test_metrics_shared_gauges():
+    metrics = Metrics()
+    first = OpenstackNotifier('memory://', metrics=metrics)
+    second = OpenstackNotifier('memory://', metrics=metrics)
+    first.reconnects = 2
+    second.reconnects = 3
+    assert metrics.snapshot()['gauges']['reconnects'] == 5
+
+
+@pytest.mark.timeout(30)
+def test_metrics_server():
+    metrics = Metrics()
+    metrics.inc('received', 'port.create.end')
+    metrics.observe('lag_seconds', 0.2)
+    server = MetricsServer(metrics, host='127.0.0.1', port=0)
+    server.start()
+    try:
+        text = urlopen('http://127.0.0.1:%d/metrics'
+                       % server.port).read().decode()
+    finally:
+        server.stop()
+    assert 'openstack_notifier_received_total' \
+        '{event_type="port.create.end"} 1' in text
+    assert 'openstack_notifier_lag_seconds_bucket{le="0.5"} 1' in text
+    assert 'openstack_notifier_lag_seconds_count 1' in text
@@ -0,0 +1,125 @@
+from openstack_notifier.profiling import Profiler, metrics_hook
+from openstack_notifier.metrics import Metrics
+from openstack_notifier.notifier import OpenstackNotifier
+from conftest import wait_for
+import pstats
+import logging
+import json
+import time
+import pytest
+
+
+class FakeMessage(object):
+    content_type = 'application/json'
+    headers = {}  # type: dict
+    delivery_info = {}  # type: dict
+
+    def __init__(self, body):
+        self.body = body
+
+
+def message(event_type='port.create.end', oslo=False):
+    body = {'event_type': event_type,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S.000',
+                                       time.gmtime()),
+            'payload': {'port': {'id': 'p1'}}}
+    if oslo:
+        body = {'oslo.version': '2.0', 'oslo.message': json.dumps(body)}
+    return body
+
+
+def test_profiler_invalid_every():
+    with pytest.raises(ValueError):
+        Profiler(every=0)
+
+
+def test_profiler_stages():
+    received = []
+    records = []
+    profiler = Profiler(hooks=(lambda *args: records.append(args),))
+    om = OpenstackNotifier('memory://', callback=received.append,
+                           profiler=profiler)
+    om.handle_message(message(oslo=True), None)
+    om.handle_message(message(), None)
+    assert len(received) == 2
+    # the callback of the inline dispatcher, then the message
+    assert [r[1] for r in records] == ['port.create.end'] * 4
+    stages = records[1][0]
+    assert set(stages) == {'unwrap', 'timestamp', 'filter', 'dispatch'}
+    assert set(records[3][0]) == {'receive', 'timestamp', 'filter',
+                                  'dispatch'}
+    stats = profiler.stats()
+    assert stats['callback']['count'] == 2
+    assert stats['timestamp']['count'] == 2
+    assert stats['unwrap']['count'] == 1
+
+
+def test_profiler_raw_decode():
+    records = []
+    profiler = Profiler(hooks=(lambda *args: records.append(args),))
+    om = OpenstackNotifier('memory://', callback=lambda data: None,
+                           raw=True, profiler=profiler)
+    om.handle_message(None, FakeMessage(json.dumps(message())))
+    assert 'decode' in records[-1][0]
+
+
+def test_profiler_sampling():
+    profiler = Profiler(every=3)
+    om = OpenstackNotifier('memory://', callback=lambda data: None,
+                           profiler=profiler)
+    for _ in range(9):
+        om.handle_message(message(), None)
+    stats = profiler.stats()
+    assert stats['timestamp']['count'] == 3
+    assert stats['callback']['count'] == 3
+
+
+def test_slow_callback(caplog):
+    profiler = Profiler(slow_callback=0.01)
+    om = OpenstackNotifier('memory://',
+                           callback=lambda data: time.sleep(0.02),
+                           profiler=profiler)
+    with caplog.at_level(logging.WARNING):
+        om.handle_message(message(), None)
+    assert profiler.slow == 1
+    assert 'slow callback for port.create.end' in caplog.text
+
+
+def test_profile_trigger(tmpdir):
+    path = str(tmpdir.join('profile'))
+    profiler = Profiler()
+    om = OpenstackNotifier('memory://', callback=lambda data: None,
+                           profiler=profiler)
+    profiler.profile(messages=2, path=path)
+    for _ in range(3):
+        om.handle_message(message(), None)
+    assert profiler.trigger is None
+    assert pstats.Stats(path).total_calls > 0
+
+
+def test_metrics_hook():
+    metrics = Metrics()
+    profiler = Profiler(hooks=(metrics_hook(metrics),))
+    om = OpenstackNotifier('memory://', callback=lambda data: None,
+                           metrics=metrics, profiler=profiler)
+    om.handle_message(message(), None)
+    histograms = metrics.snapshot()['histograms']
+    assert histograms['timestamp_seconds']['count'] == 1
+    assert histograms['callback_seconds']['count'] == 1
+
+
+@pytest.mark.timeout(30)
+def test_profiled_notifier(openstack_notifier_builder, memory_broker):
+    received = []
+    profiler = Profiler()
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=received.append,
+        queue_configs=memory_broker.queue_configs(),
+        raw=True, ack=True, profiler=profiler)
+    om.start()
+    assert om.wait_ready(5)
+    memory_broker.port_create('0')
+    memory_broker.port_create('1')
+    wait_for(lambda: len(received) == 2)
+    assert profiler.stats()['decode']['count'] == 2
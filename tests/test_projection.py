@@ -0,0 +1,55 @@
+from openstack_notifier.projection import Projection, merge
+from openstack_notifier.notifier import OpenstackNotifier, CallbackData
+import json
+import pickle
+import pytest
+
+PORT = {'port': {'id': 'p1', 'network_id': 'n1', 'name': 'foo',
+                 'fixed_ips': [{'subnet_id': 's1', 'ip_address': '10.0.0.1'},
+                               {'subnet_id': 's2', 'ip_address': '10.0.1.1'}],
+                 'binding:profile': {}}}
+
+
+def test_projection():
+    projection = Projection(['port.id', 'port.fixed_ips.ip_address',
+                             'port.missing', 'missing.id'])
+    assert projection(PORT) == {
+        'port': {'id': 'p1', 'fixed_ips': [{'ip_address': '10.0.0.1'},
+                                           {'ip_address': '10.0.1.1'}]}}
+    assert Projection(['port.fixed_ips', 'port.fixed_ips.subnet_id'])(
+        PORT)['port']['fixed_ips'] == PORT['port']['fixed_ips']
+    assert pickle.loads(pickle.dumps(projection)).paths == projection.paths
+
+
+def test_merge():
+    assert merge([]) is None
+    merged = merge([Projection(['port.id']), Projection(['port.name'])])
+    assert merged(PORT) == {'port': {'id': 'p1', 'name': 'foo'}}
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_notifier_projections(lazy):
+    class Message(object):
+        content_type = 'application/json'
+        headers = {}  # type: dict
+
+        def __init__(self, body):
+            self.body = body
+
+    received = []
+    om = OpenstackNotifier(
+        'memory://', callback=received.append, raw=True, lazy=lazy,
+        projections={'port.*': ['port.id', 'port.network_id']})
+    om.project('port.create.*', ['port.name'])
+    for event_type in ('port.create.end', 'port.update.end',
+                       'network.create.end'):
+        body = {'event_type': event_type,
+                'timestamp': '2019-03-15 08:32:59.000000',
+                'payload': PORT}
+        om.rabbitmq_message(Message(json.dumps(body).encode()))
+    assert received == [
+        CallbackData('port.create.end', {'port': {
+            'id': 'p1', 'network_id': 'n1', 'name': 'foo'}}),
+        CallbackData('port.update.end', {'port': {
+            'id': 'p1', 'network_id': 'n1'}}),
+        CallbackData('network.create.end', PORT)]
@@ -0,0 +1,94 @@
+from openstack_notifier.reconnect import backoff_delay, rotate_urls
+from openstack_notifier.notifier import OpenstackNotifier
+from conftest import wait_for
+from threading import Event
+import kombu
+import pytest
+
+
+def test_backoff_delay():
+    for failures in range(1, 10):
+        delay = min(30.0, 0.5 * 2 ** (failures - 1))
+        assert delay / 2 <= backoff_delay(failures) <= delay
+    assert backoff_delay(1000) <= 30.0
+
+
+def test_rotate_urls():
+    url = 'amqp://a;amqp://b;amqp://c'
+    assert rotate_urls(url, 0) == url
+    assert rotate_urls(url, 1) == 'amqp://b;amqp://c;amqp://a'
+    assert rotate_urls(url, 5) == 'amqp://c;amqp://a;amqp://b'
+    assert rotate_urls('memory://', 3) == 'memory://'
+
+
+@pytest.mark.timeout(30)
+def test_notifier_reconnects(openstack_notifier_builder, memory_broker,
+                             monkeypatch):
+    received = []
+    urls = []
+    consume_once = OpenstackNotifier.consume_once
+
+    def failing_consume_once(self, url, queue_configs, on_connected=None):
+        urls.append(url)
+        if len(urls) <= 2:
+            raise IOError('connection refused')
+        consume_once(self, 'memory://', queue_configs, on_connected)
+
+    monkeypatch.setattr(OpenstackNotifier, 'consume_once',
+                        failing_consume_once)
+    om = openstack_notifier_builder(
+        url='memory://a;memory://b',
+        callback=received.append,
+        queue_configs=memory_broker.queue_configs(),
+        reconnect_delay=0.05)
+    om.start()
+    wait_for(lambda: om.connection_stats()['connected'])
+    assert urls == ['memory://a;memory://b', 'memory://b;memory://a',
+                    'memory://a;memory://b']
+    stats = om.connection_stats()
+    assert stats['reconnects'] == 1
+    assert stats['connection_errors'] == 2
+    assert 0 < stats['downtime'] < 5
+    memory_broker.port_create('0')
+    wait_for(lambda: len(received) == 1)
+
+
+@pytest.mark.timeout(30)
+def test_notifier_without_reconnect(openstack_notifier_builder,
+                                    monkeypatch):
+    def failing_consume_once(self, url, queue_configs, on_connected=None):
+        raise IOError('connection refused')
+
+    monkeypatch.setattr(OpenstackNotifier, 'consume_once',
+                        failing_consume_once)
+    om = openstack_notifier_builder(url='memory://', reconnect=False)
+    om.start()
+    wait_for(lambda: not om.alive())
+    assert om.connection_stats()['connection_errors'] == 1
+
+
+@pytest.mark.timeout(30)
+def test_heartbeats_under_load(openstack_notifier_builder, memory_broker,
+                               monkeypatch):
+    checks = []
+    monkeypatch.setattr(kombu.Connection, 'heartbeat_check',
+                        lambda self, rate=2: checks.append(rate))
+    published = Event()
+    seen = []
+
+    def callback(data):
+        # the other notifications are queued meanwhile
+        published.wait(5)
+        seen.append(len(checks))
+
+    om = openstack_notifier_builder(
+        url=memory_broker.url(), callback=callback,
+        queue_configs=memory_broker.queue_configs())
+    om.start()
+    assert om.wait_ready(5)
+    for i in range(50):
+        memory_broker.port_create(str(i))
+    published.set()
+    wait_for(lambda: len(seen) == 50)
+    # the connection was never idle, yet heartbeats were checked
+    assert seen[-1] - seen[1] >= 40
@@ -0,0 +1,103 @@
+from openstack_notifier.recording import Recorder, read_frames, replay
+from openstack_notifier.notifier import OpenstackNotifier, CallbackData
+from openstack_notifier.dispatch import PoolDispatcher
+from conftest import wait_for
+import glob
+import json
+import pytest
+
+
+def body(i):
+    return json.dumps({'event_type': 'port.create.end',
+                       'timestamp': '2019-03-15 08:32:59.000000',
+                       'payload': {'port': {'id': str(i)}}}).encode('utf-8')
+
+
+def test_recorder_rotation(tmp_path):
+    path = str(tmp_path / 'capture')
+    recorder = Recorder(path, max_bytes=500, block_size=200)
+    for i in range(100):
+        recorder.record(body(i), timestamp=float(i))
+    recorder.close()
+    files = sorted(glob.glob(path + '.*'))
+    assert len(files) > 1
+    frames = [frame for f in files for frame in read_frames(f)]
+    assert frames == [(float(i), body(i)) for i in range(100)]
+    # an existing file is never overwritten
+    recorder = Recorder(path)
+    recorder.record(body(0))
+    recorder.close()
+    assert len(glob.glob(path + '.*')) == len(files) + 1
+
+
+def test_read_frames_truncated(tmp_path):
+    path = str(tmp_path / 'capture')
+    recorder = Recorder(path, block_size=1)
+    for i in range(3):
+        recorder.record(body(i))
+    recorder.close()
+    with open(path + '.000000', 'rb') as f:
+        data = f.read()
+    with open(path + '.000000', 'wb') as f:
+        f.write(data[:-5])
+    assert len(list(read_frames(path + '.000000'))) == 2
+
+
+def test_read_frames_not_a_recording(tmp_path):
+    path = tmp_path / 'capture'
+    path.write_bytes(b'not a recording file')
+    with pytest.raises(ValueError):
+        list(read_frames(str(path)))
+
+
+@pytest.mark.parametrize('raw', [True, False])
+def test_replay(tmp_path, raw):
+    path = str(tmp_path / 'capture')
+    recorder = Recorder(path)
+    for i in range(10):
+        recorder.record(body(i), timestamp=i / 100.0)
+    recorder.close()
+    received = []
+    notifier = OpenstackNotifier('memory://', callback=received.append,
+                                 raw=raw)
+    assert replay([path + '.000000'], notifier, speed=1.0) == 10
+    assert received[3] == CallbackData('port.create.end',
+                                       {'port': {'id': '3'}})
+
+
+@pytest.mark.timeout(30)
+def test_replay_dispatcher(tmp_path):
+    path = str(tmp_path / 'capture')
+    recorder = Recorder(path)
+    for i in range(20):
+        recorder.record(body(i))
+    recorder.close()
+    received = []
+    dispatcher = PoolDispatcher(workers=1, max_queue_size=2)
+    notifier = OpenstackNotifier('memory://', callback=received.append,
+                                 raw=True, dispatcher=dispatcher)
+    assert replay([path + '.000000'], notifier) == 20
+    # the callbacks have run and the workers are stopped
+    assert len(received) == 20
+    assert dispatcher.threads == []
+
+
+@pytest.mark.timeout(30)
+def test_notifier_recorder(openstack_notifier_builder, memory_broker,
+                           tmp_path):
+    path = str(tmp_path / 'capture')
+    recorder = Recorder(path)
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        queue_configs=memory_broker.queue_configs(),
+        raw=True, recorder=recorder)
+    om.start()
+    wait_for(lambda: om.connection_stats()['connected'])
+    memory_broker.port_create('0')
+    memory_broker.network_create('0')
+    wait_for(lambda: recorder.recorded == 2)
+    om.stop()
+    recorder.close()
+    frames = list(read_frames(path + '.000000'))
+    assert [json.loads(b.decode('utf-8'))['event_type']
+            for _, b in frames] == ['port.create.end', 'network.create.end']
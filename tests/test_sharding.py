@@ -0,0 +1,130 @@
+from openstack_notifier.sharding import ShardedOpenstackNotifier, ShardRouter
+from openstack_notifier.sharding import jump_hash, shard_of
+from openstack_notifier.recording import RecordedMessage, Recorder
+from openstack_notifier.checkpoint import Checkpoint
+from conftest import wait_for
+from functools import partial
+import multiprocessing
+import json
+import os
+import pytest
+
+
+def test_jump_hash():
+    keys = range(1000)
+    for buckets in (1, 3, 10):
+        assert all(0 <= jump_hash(k, buckets) < buckets for k in keys)
+    # growing from 10 to 11 shards moves about 1/11 of the keys
+    moved = sum(1 for k in keys if jump_hash(k, 10) != jump_hash(k, 11))
+    assert 0 < moved < 200
+
+
+def test_shard_of():
+    assert shard_of(None, 4) == 0
+    assert shard_of(('port', 'p1'), 4) == shard_of(('port', 'p1'), 4)
+    assert len(set(shard_of(('port', str(i)), 4) for i in range(100))) == 4
+
+
+class FakePipe(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, bodies):
+        self.sent.extend(bodies)
+
+
+def test_router_routes_raw():
+    router = ShardRouter('memory://', 2, max_batch_size=3)
+    pipes = [FakePipe(), FakePipe()]
+    for index, pipe in enumerate(pipes):
+        router.set_pipe(index, pipe)
+    for i in range(20):
+        router.handle_message(None, RecordedMessage(json.dumps(
+            {'event_type': 'port.update.end',
+             'timestamp': '2019-03-15 08:32:59.000000',
+             'payload': {'port': {'id': str(i)}}}).encode()))
+    router.flush_batch()
+    assert router.decoded == 0
+    assert sum(router.routed) == 20
+    assert pipes[0].sent and pipes[1].sent
+    for index, pipe in enumerate(pipes):
+        for body in pipe.sent:
+            port_id = json.loads(body)['payload']['port']['id']
+            assert shard_of(('port', port_id), 2) == index
+    # the id can not be scanned before a nested value
+    router.handle_message(None, RecordedMessage(json.dumps(
+        {'event_type': 'port.update.end',
+         'timestamp': '2019-03-15 08:32:59.000000',
+         'payload': {'port': {'fixed_ips': [], 'id': '0'}}}).encode()))
+    router.flush_batch()
+    assert router.decoded == 1
+    assert sum(router.routed) == 21
+
+
+def put_pid(queue, data):
+    queue.put((os.getpid(), data.payload['port']['id']))
+
+
+@pytest.mark.timeout(60)
+def test_sharded_notifier(memory_broker):
+    received = multiprocessing.Queue()
+    om = ShardedOpenstackNotifier(
+        memory_broker.url(), callback=partial(put_pid, received), shards=2,
+        queue_configs=memory_broker.queue_configs()[:1])
+    om.start()
+    try:
+        assert om.wait_ready(5)
+        wait_for(om.alive, timeout=20)
+        for i in range(10):
+            memory_broker.port_create(str(i))
+            memory_broker.port_update(str(i))
+        pids = {}  # type: dict
+        for _ in range(20):
+            pid, port_id = received.get(timeout=20)
+            pids.setdefault(port_id, set()).add(pid)
+    finally:
+        om.stop()
+    # the notifications of a port are handled by the same process
+    assert all(len(p) == 1 for p in pids.values())
+    assert len(set.union(*pids.values())) == 2
+    assert om.router.decoded == 0
+
+
+@pytest.mark.timeout(60)
+def test_sharded_notifier_restarts_workers():
+    om = ShardedOpenstackNotifier('memory://', shards=2,
+                                  restart_interval=0.1)
+    om.start()
+    try:
+        wait_for(om.alive, timeout=20)
+        om.processes[0].terminate()
+        wait_for(lambda: om.restarts == 1, timeout=20)
+        wait_for(om.alive, timeout=20)
+    finally:
+        om.stop()
+    assert not om.alive()
+
+
+def test_sharded_notifier_invalid_shards():
+    with pytest.raises(ValueError):
+        ShardedOpenstackNotifier('memory://', shards=0)
+
+
+def test_sharded_notifier_rejects_ack():
+    with pytest.raises(ValueError):
+        ShardedOpenstackNotifier('memory://', shards=1, ack=True)
+    with pytest.raises(ValueError):
+        ShardRouter('memory://', 1, ack=True)
+
+
+def test_sharded_notifier_checkpoint_and_recorder(tmp_path):
+    with pytest.raises(ValueError):
+        ShardedOpenstackNotifier('memory://', shards=1,
+                                 checkpoint=Checkpoint(str(tmp_path / 'cp')))
+    recorder = Recorder(str(tmp_path / 'capture'))
+    om = ShardedOpenstackNotifier('memory://', shards=1, recorder=recorder)
+    assert om.router.recorder is recorder
+    assert 'recorder' not in om.kwargs
+    om.router.set_pipe(0, FakePipe())
+    om.router.handle_message(None, RecordedMessage(b'{}'))
+    assert recorder.recorded == 1
@@ -0,0 +1,61 @@
+from openstack_notifier.shedding import LoadShedder, TokenBucket
+from openstack_notifier.notifier import OpenstackNotifier
+from openstack_notifier.metrics import Metrics
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take(0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.take(0.5)
+    assert not bucket.take(0.5)
+    assert [bucket.take(10) for _ in range(4)] == [True, True, True, False]
+
+
+def test_shedder_rules():
+    shedder = LoadShedder(keep=('*.delete.end',))
+    shedder.limit('compute.metrics.*', rate=1, burst=2)
+    shedder.sample('compute.instance.exists', 0.25)
+    shedder.limit('*', rate=0.001, burst=100)
+    reasons = [shedder.shed('compute.metrics.update', 0, now=0)
+               for _ in range(3)]
+    assert reasons == [None, None, 'rate']
+    reasons = [shedder.shed('compute.instance.exists', 0, now=0)
+               for _ in range(8)]
+    assert reasons.count(None) == 2
+    assert shedder.shed('compute.instance.delete.end', 0, now=0) is None
+    assert shedder.stats() == {'rate': {'compute.metrics.update': 1},
+                               'sample': {'compute.instance.exists': 6}}
+
+
+def test_shedder_overlapping_rules():
+    shedder = LoadShedder()
+    shedder.limit('port.*', rate=1, burst=2)
+    shedder.limit('port.update.end', rate=1, burst=1)
+    assert shedder.shed('port.update.end', 0, now=0) is None
+    assert shedder.shed('port.update.end', 0, now=0) == 'rate'
+    # the token of the rejected update is left to the other ports
+    assert shedder.shed('port.create.end', 0, now=0) is None
+    assert shedder.shed('port.create.end', 0, now=0) == 'rate'
+
+
+def test_shedder_lag():
+    shedder = LoadShedder(max_lag=60, keep=('port.delete.end',))
+    assert shedder.shed('port.update.end', 100, now=150) is None
+    assert shedder.shed('port.update.end', 100, now=200) == 'lag'
+    assert shedder.shed('port.delete.end', 100, now=200) is None
+
+
+def test_notifier_shedder():
+    received = []
+    metrics = Metrics()
+    shedder = LoadShedder()
+    shedder.sample('compute.metrics.update', 0)
+    om = OpenstackNotifier('memory://', callback=received.append,
+                           shedder=shedder, metrics=metrics)
+    for event_type in ('compute.metrics.update', 'port.create.end'):
+        om.rabbitmq_callback({'event_type': event_type,
+                              'timestamp': '2019-03-15 08:32:59.000000',
+                              'payload': {}}, None)
+    assert [d.event_type for d in received] == ['port.create.end']
+    assert metrics.snapshot()['counters']['shed'] == {
+        'compute.metrics.update': 1}
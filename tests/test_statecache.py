@@ -0,0 +1,98 @@
+from openstack_notifier.statecache import ResourceCache
+from openstack_notifier.notifier import OpenstackNotifier, CallbackData
+import pytest
+
+
+def port(port_id, network_id='n1', device_id='d1', ips=('10.0.0.1',),
+         revision=1):
+    return {'id': port_id, 'network_id': network_id, 'device_id': device_id,
+            'fixed_ips': [{'subnet_id': 's1', 'ip_address': ip}
+                          for ip in ips],
+            'revision_number': revision}
+
+
+def ids(resources):
+    return sorted(r['id'] for r in resources)
+
+
+def test_resource_cache_ports():
+    cache = ResourceCache()
+    cache(CallbackData('network.create.end', {'network': {'id': 'n1'}}))
+    cache(CallbackData('subnet.create.end',
+                       {'subnet': {'id': 's1', 'network_id': 'n1'}}))
+    cache(CallbackData('port.create.end', {'port': port('p1')}))
+    cache(CallbackData('port.create.end', {'port': port('p2', ips=())}))
+    assert ids(cache.network_ports('n1')) == ['p1', 'p2']
+    assert ids(cache.device_ports('d1')) == ['p1', 'p2']
+    assert ids(cache.ip_ports('10.0.0.1')) == ['p1']
+    assert ids(cache.network_subnets('n1')) == ['s1']
+    assert cache.port_network('p1')['id'] == 'n1'
+
+    cache(CallbackData('port.update.end', {'port': port(
+        'p1', network_id='n2', device_id='', ips=('10.0.0.2',),
+        revision=3)}))
+    # older than the cached port
+    cache(CallbackData('port.update.end', {'port': port('p1', revision=2)}))
+    assert ids(cache.network_ports('n1')) == ['p2']
+    assert ids(cache.network_ports('n2')) == ['p1']
+    assert ids(cache.device_ports('d1')) == ['p2']
+    assert cache.ip_ports('10.0.0.1') == []
+    assert ids(cache.ip_ports('10.0.0.2')) == ['p1']
+
+    cache(CallbackData('port.delete.end', {'port_id': 'p1'}))
+    assert cache.get('port', 'p1') is None
+    assert cache.ip_ports('10.0.0.2') == []
+    assert cache.port_network('p1') is None
+    assert cache.ports_by_network == {'n1': set(['p2'])}
+
+
+def test_resource_cache_returns_copies():
+    cache = ResourceCache()
+    cache(CallbackData('network.create.end', {'network': {'id': 'n1'}}))
+    cache(CallbackData('port.create.end', {'port': port('p1')}))
+    cache.get('port', 'p1')['network_id'] = 'n2'
+    cache.network_ports('n1')[0]['device_id'] = 'd2'
+    cache.port_network('p1')['name'] = 'foo'
+    assert cache.get('port', 'p1') == port('p1')
+    assert cache.get('network', 'n1') == {'id': 'n1'}
+    # the payloads are copied too
+    payload = {'port': port('p2')}
+    cache(CallbackData('port.create.end', payload))
+    payload['port']['network_id'] = 'n2'
+    assert cache.get('port', 'p2') == port('p2')
+    assert ids(cache.network_ports('n1')) == ['p1', 'p2']
+
+
+def test_resource_cache_ignores_other_events():
+    cache = ResourceCache()
+    cache(CallbackData('port.create.start', {'port': port('p1')}))
+    cache(CallbackData('compute.instance.create.end', {'instance_id': 'i'}))
+    cache(CallbackData('floatingip.create.end', {'floatingip': {'id': 'f'}}))
+    assert len(cache) == 0
+
+
+def test_resource_cache_snapshot(tmp_path):
+    cache = ResourceCache()
+    cache(CallbackData('port.create.end', {'port': port('p1')},
+                       timestamp=10.0))
+    cache(CallbackData('security_group.create.end',
+                       {'security_group': {'id': 'sg1'}}, timestamp=5.0))
+    path = str(tmp_path / 'snapshot.json')
+    cache.save(path)
+    restored = ResourceCache()
+    restored.load(path)
+    assert restored.timestamp == 10.0
+    assert len(restored) == 2
+    assert ids(restored.ip_ports('10.0.0.1')) == ['p1']
+    with pytest.raises(ValueError):
+        restored.restore({'version': 2})
+
+
+def test_resource_cache_subscribe():
+    cache = ResourceCache()
+    om = OpenstackNotifier('memory://')
+    cache.subscribe(om)
+    om.rabbitmq_callback({'event_type': 'router.create.end',
+                          'timestamp': '2019-03-15 08:32:59.000000',
+                          'payload': {'router': {'id': 'r1'}}}, None)
+    assert cache.get('router', 'r1') == {'id': 'r1'}
@@ -0,0 +1,72 @@
+from openstack_notifier.subscriptions import PatternIndex, scan_event_types
+from openstack_notifier.notifier import OpenstackNotifier, CallbackData
+from conftest import wait_for
+import json
+import pytest
+
+
+def test_pattern_index():
+    index = PatternIndex()
+    index.add('port.*.end', 'port_end')
+    index.add('port.create.end', 'port_create')
+    index.add('security_group.*', 'sg')
+    index.add('*', 'all')
+    assert index.match('port.create.end') == ('port_end', 'port_create',
+                                              'all')
+    assert index.match('port.update.end') == ('port_end', 'all')
+    assert index.match('port.update.start') == ('all',)
+    assert index.match('security_group.rule.create.end') == ('sg', 'all')
+    index.add('network.create.end', 'network')
+    assert index.match('network.create.end') == ('all', 'network')
+
+
+def test_scan_event_types():
+    message = {'event_type': 'port.create.end', 'payload': {}}
+    assert scan_event_types(json.dumps(message)) == ['port.create.end']
+    oslo = json.dumps({'oslo.version': '2.0',
+                       'oslo.message': json.dumps(message)}).encode()
+    assert scan_event_types(oslo) == ['port.create.end']
+    assert scan_event_types(b'{}') == []
+
+
+def test_match_raw():
+    index = PatternIndex()
+    index.add('port.*', None)
+    assert index.match_raw(b'{"event_type": "port.create.end"}')
+    assert not index.match_raw(b'{"event_type": "compute.metrics.update"}')
+    # unknown format, can not be filtered before decoding
+    assert index.match_raw(b'{"eventtype": "compute.metrics.update"}')
+
+
+@pytest.mark.timeout(30)
+def test_subscribe(openstack_notifier_builder, memory_broker):
+    ports = []
+    networks = []
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        queue_configs=memory_broker.queue_configs(),
+        raw=True)
+    om.subscribe('port.*.end', ports.append)
+    om.subscribe('network.create.end', networks.append)
+    om.start()
+    assert om.wait_ready(5)
+    memory_broker.network_update('0')
+    memory_broker.publish({'event_type': 'port.create.end',
+                           'payload': {'port': {'id': '0'}}},
+                          'neutron', 'notifications.info', oslo=True)
+    memory_broker.network_create('0')
+    wait_for(lambda: len(networks) == 1)
+    assert ports == [CallbackData('port.create.end', {'port': {'id': '0'}})]
+    assert networks == [CallbackData('network.create.end',
+                                     {'network': {'id': '0'}})]
+
+
+def test_subscribe_with_callback():
+    received = []
+    om = OpenstackNotifier('memory://', callback=received.append)
+    om.subscribe('port.*', lambda data: received.append(data.event_type))
+    om.rabbitmq_callback({'event_type': 'port.create.end',
+                          'timestamp': '2019-03-15 08:32:59.000000',
+                          'payload': {}}, None)
+    assert received == [CallbackData('port.create.end', {}),
+                        'port.create.end']
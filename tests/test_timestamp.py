@@ -0,0 +1,38 @@
+from openstack_notifier.timestamp import parse_timestamp
+from openstack_notifier.notifier import OpenstackNotifier, CallbackData
+import calendar
+import pytest
+
+
+def test_parse_timestamp_utc():
+    expected = calendar.timegm((2019, 3, 15, 8, 32, 59, 0, 0, 0))
+    assert parse_timestamp('2019-03-15 08:32:59.000000') == expected
+    assert parse_timestamp('2019-03-15 08:32:59') == expected
+    assert parse_timestamp('2019-03-15T08:32:59') == expected
+
+
+def test_parse_timestamp_fraction():
+    expected = calendar.timegm((2019, 3, 15, 8, 32, 59, 0, 0, 0))
+    assert parse_timestamp('2019-03-15 08:32:59.250000') == expected + 0.25
+    assert parse_timestamp('2019-03-15 08:32:59.5') == expected + 0.5
+    # cached seconds, different fractions
+    assert parse_timestamp('2019-03-15 08:32:59.750') == expected + 0.75
+
+
+@pytest.mark.parametrize('value', ['', '2019-03-15', '2019/03/15 08:32:59',
+                                   '2019-03-15 08:32:59,123',
+                                   '2019-03-15 08:32:59.12a'])
+def test_parse_timestamp_invalid(value):
+    with pytest.raises(ValueError):
+        parse_timestamp(value)
+
+
+def test_min_timestamp_subsecond():
+    received = []
+    om = OpenstackNotifier('memory://', callback=received.append,
+                           min_timestamp=calendar.timegm(
+                               (2019, 3, 15, 8, 32, 59, 0, 0, 0)) + 0.5)
+    for ts in ('2019-03-15 08:32:59.400000', '2019-03-15 08:32:59.600000'):
+        om.rabbitmq_callback({'event_type': 'port.create.end',
+                              'timestamp': ts, 'payload': {}}, None)
+    assert received == [CallbackData('port.create.end', {})]
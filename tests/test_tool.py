@@ -1,6 +1,7 @@
 # from multiprocessing import Process
 from openstack_notifier.tool import QueueConfig
 from openstack_notifier.tool import parse_args
+from openstack_notifier.tool import parse_record_args, parse_replay_args
 
 import pytest
 import logging
@@ -53,3 +54,27 @@ def test_tool_multiple_queue():
 #     p.terminate()
 #     sleep(1)
 #     assert not p.is_alive()
+
+
+def test_tool_durable():
+    url_args = ['--rabbitmq_url', 'foo']
+    args = parse_args(url_args + ['--durable',
+                                  '--queue_config', 'foo:bar:foobar'])
+    assert args.queue_config[0].durable
+    with pytest.raises(SystemExit):
+        parse_args(url_args + ['--durable'])
+    with pytest.raises(SystemExit):
+        parse_args(url_args + ['--durable', '--queue_config', 'foo::*'])
+
+
+def test_tool_record_replay(tmp_path):
+    args = parse_record_args(['--rabbitmq_url', 'foo', '--output', 'out',
+                              '--queue_config', 'foo:bar:foobar'])
+    assert args.output == 'out'
+    assert args.queue_config == [QueueConfig('foo', 'bar', 'foobar')]
+    for name in ('capture.000000', 'capture.000001'):
+        (tmp_path / name).write_bytes(b'')
+    prefix = str(tmp_path / 'capture')
+    args = parse_replay_args([prefix, '--speed', '2'])
+    assert args.path == [prefix + '.000000', prefix + '.000001']
+    assert args.speed == 2.0
@@ -0,0 +1,155 @@
+from threading import Event, Timer
+from openstack_notifier.wakeup import Waker, wait_readable
+from openstack_notifier.dispatch import PoolDispatcher
+from conftest import wait_for
+import socket
+import pytest
+import time
+
+
+def test_waker():
+    waker = Waker()
+    reader, writer = socket.socketpair()
+    try:
+        assert not wait_readable(reader, waker, 0.01)
+        start = time.time()
+        waker.wake()
+        waker.wake()
+        assert not wait_readable(reader, waker, 5)
+        assert time.time() - start < 1
+        waker.clear()
+        writer.send(b'x')
+        assert wait_readable(reader, waker, 5)
+    finally:
+        waker.close()
+        reader.close()
+        writer.close()
+
+
+@pytest.mark.timeout(30)
+def test_ready_and_fast_stop(openstack_notifier_builder, memory_broker):
+    received = []
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=received.append,
+        queue_configs=memory_broker.queue_configs())
+    assert not om.wait_ready(0)
+    om.start()
+    assert om.wait_ready(5)
+    memory_broker.port_create('0')
+    wait_for(lambda: len(received) == 1)
+    start = time.time()
+    om.stop()
+    assert time.time() - start < 0.5
+    assert not om.alive()
+    assert not om.wait_ready(0)
+
+
+@pytest.mark.timeout(30)
+def test_stop_drains(openstack_notifier_builder, memory_broker):
+    received = []
+
+    def callback(data):
+        time.sleep(0.05)
+        received.append(data)
+
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=callback, ack=True,
+        queue_configs=memory_broker.queue_configs(),
+        dispatcher=PoolDispatcher(workers=1))
+    om.start()
+    assert om.wait_ready(5)
+    for i in range(5):
+        memory_broker.port_create(str(i))
+    wait_for(lambda: om.in_flight() == 5)
+    om.stop()
+    assert len(received) == 5
+    assert om.in_flight() == 0
+
+
+@pytest.mark.timeout(30)
+def test_stop_abandons(openstack_notifier_builder, memory_broker):
+    started = Event()
+    release = Event()
+    received = []
+
+    def callback(data):
+        started.set()
+        release.wait()
+        received.append(data)
+
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=callback, ack=True,
+        queue_configs=memory_broker.queue_configs(),
+        dispatcher=PoolDispatcher(workers=1))
+    om.start()
+    assert om.wait_ready(5)
+    for i in range(5):
+        memory_broker.port_create(str(i))
+    assert started.wait(5)
+    wait_for(lambda: om.queue_depth() == 4)
+    Timer(0.2, release.set).start()
+    om.stop(drain=False)
+    # the running callback completes, the queued ones are dropped
+    assert len(received) == 1
+    assert om.queue_depth() == 0
+
+
+@pytest.mark.timeout(30)
+def test_stop_timeout(openstack_notifier_builder, memory_broker):
+    received = []
+
+    def callback(data):
+        time.sleep(0.2)
+        received.append(data)
+
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=callback, ack=True,
+        queue_configs=memory_broker.queue_configs(),
+        dispatcher=PoolDispatcher(workers=1))
+    om.start()
+    assert om.wait_ready(5)
+    for i in range(10):
+        memory_broker.port_create(str(i))
+    wait_for(lambda: om.in_flight() == 10)
+    start = time.time()
+    om.stop(timeout=0.3)
+    assert time.time() - start < 1
+    assert 0 < len(received) < 10
+
+
+@pytest.mark.timeout(30)
+def test_stop_timeout_running_callback(openstack_notifier_builder,
+                                       memory_broker):
+    release = Event()
+    received = []
+
+    def callback(data):
+        release.wait()
+        received.append(data)
+
+    om = openstack_notifier_builder(
+        url=memory_broker.url(),
+        callback=callback, ack=True,
+        queue_configs=memory_broker.queue_configs(),
+        dispatcher=PoolDispatcher(workers=1))
+    om.start()
+    assert om.wait_ready(5)
+    for i in range(3):
+        memory_broker.port_create(str(i))
+    wait_for(lambda: om.in_flight() == 3)
+    workers = list(om.dispatcher.threads)
+    start = time.time()
+    try:
+        # the running callback does not hold up the stop
+        om.stop(timeout=0.3)
+        assert time.time() - start < 1
+    finally:
+        release.set()
+    for worker in workers:
+        worker.join()
+    # it completes, the queued ones are dropped
+    assert len(received) == 1